@@ -2,7 +2,7 @@
 python3 - <<'PY'
 from confluent_kafka.admin import AdminClient, NewTopic
 admin = AdminClient({'bootstrap.servers':'localhost:9092'})
-topics = [NewTopic(t, num_partitions=6, replication_factor=1) for t in ['incoming.messages','outgoing.messages','delivery.events','file.uploads','audit.events']]
+topics = [NewTopic(t, num_partitions=6, replication_factor=1) for t in ['incoming.messages','incoming.messages.bulk','outgoing.messages','delivery.events','file.uploads','audit.events','deadletters','retry.5s','retry.30s','retry.5m']]
 fs = admin.create_topics(topics)
 for t, f in fs.items():
     try:
@@ -13,6 +13,8 @@ TOKEN = os.getenv("INSTAGRAM_TOKEN", "")
 TIMEOUT = int(os.getenv("HTTP_TIMEOUT", "15"))
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "4"))
 BASE_BACKOFF = float(os.getenv("BASE_BACKOFF", "0.5"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "10"))
 
 ADAPTER_REQUESTS = Counter('adapter_requests_total', 'Adapter requests', ['adapter', 'status'])
 ADAPTER_LATENCY = Histogram('adapter_request_duration_seconds', 'Adapter latency seconds', ['adapter'])
@@ -71,38 +73,79 @@ async def do_with_retries(fn, *args, **kwargs):
             log.warning("attempt %s failed, sleeping %s: %s", attempt, backoff, e)
             await asyncio.sleep(backoff)
 
+class InvalidPayload(Exception):
+    pass
+
+async def deliver(session: ClientSession, message: dict, recipient: str):
+    """Send one message to one recipient; raises InvalidPayload for unusable payloads."""
+    ptype = message.get("payload_type","text")
+    pref = message.get("payload_ref")
+    if ptype == "text" or isinstance(pref, str):
+        text = pref if isinstance(pref, str) else message.get("payload_ref","")
+        return await do_with_retries(send_text, session, recipient, text)
+    elif ptype in ("image","video","file"):
+        info = pref or {}
+        url = info.get("url")
+        mime = info.get("mime")
+        caption = info.get("caption")
+        if not url:
+            raise InvalidPayload("missing media url")
+        mtype = "image" if (mime and mime.startswith("image/")) else ("video" if (mime and mime.startswith("video/")) else "file")
+        return await do_with_retries(send_media, session, recipient, url, mtype, caption)
+    else:
+        raise InvalidPayload("unsupported payload_type")
+
 async def handle_send(request):
     data = await request.json()
     message = data.get("message", {})
     recipient = data.get("recipient_id")
     if not recipient:
         return web.json_response({"error":"missing recipient_id"}, status=400)
-
-    ptype = message.get("payload_type","text")
-    pref = message.get("payload_ref")
     try:
-        async with ClientSession(timeout=ClientTimeout(total=TIMEOUT)) as s:
-            if ptype == "text" or isinstance(pref, str):
-                text = pref if isinstance(pref, str) else message.get("payload_ref","")
-                res = await do_with_retries(send_text, s, recipient, text)
-            elif ptype in ("image","video","file"):
-                info = pref or {}
-                url = info.get("url")
-                mime = info.get("mime")
-                caption = info.get("caption")
-                if not url:
-                    return web.json_response({"error":"missing media url"}, status=400)
-                mtype = "image" if (mime and mime.startswith("image/")) else ("video" if (mime and mime.startswith("video/")) else "file")
-                res = await do_with_retries(send_media, s, recipient, url, mtype, caption)
-            else:
-                return web.json_response({"error":"unsupported payload_type"}, status=400)
+        async with ClientSession(timeout=ClientTimeout(total=TIMEOUT)) as session:
+            res = await deliver(session, message, recipient)
+    except InvalidPayload as e:
+        return web.json_response({"error": str(e)}, status=400)
     except Exception as e:
         log.exception("instagram send failed")
         return web.json_response({"error":str(e)}, status=502)
     return web.json_response({"status":"ok","provider_response":res})
 
+async def handle_send_batch(request):
+    """POST /send_batch {"items": [{"message": {...}, "recipient_id": "..."}, ...]}
+
+    Items are delivered concurrently over one provider session. The response holds one
+    result per item in request order: {"recipient_id", "status": "ok"|"error", "code", ...}.
+    """
+    data = await request.json()
+    items = data.get("items")
+    if not isinstance(items, list):
+        return web.json_response({"error": "missing items"}, status=400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return web.json_response({"error": f"at most {BATCH_MAX_ITEMS} items per batch"}, status=413)
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def send_item(session, item):
+        recipient = item.get("recipient_id")
+        if not recipient:
+            return {"recipient_id": recipient, "status": "error", "code": 400, "error": "missing recipient_id"}
+        try:
+            async with slots:
+                res = await deliver(session, item.get("message") or {}, recipient)
+        except InvalidPayload as e:
+            return {"recipient_id": recipient, "status": "error", "code": 400, "error": str(e)}
+        except Exception as e:
+            log.warning("batch item for %s failed: %s", recipient, e)
+            return {"recipient_id": recipient, "status": "error", "code": 502, "error": str(e)}
+        return {"recipient_id": recipient, "status": "ok", "code": 200, "provider_response": res}
+
+    async with ClientSession(timeout=ClientTimeout(total=TIMEOUT)) as session:
+        results = await asyncio.gather(*(send_item(session, item) for item in items))
+    return web.json_response({"results": results})
+
 app = web.Application()
 app.router.add_post("/send", handle_send)
+app.router.add_post("/send_batch", handle_send_batch)
 app.router.add_get("/metrics", metrics)
 
 if __name__ == "__main__":
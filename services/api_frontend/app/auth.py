@@ -1,14 +1,34 @@
 import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Set
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 from datetime import datetime, timedelta
 from pydantic import BaseModel
+from prometheus_client import Counter, Gauge
+from .timing import span
+
+log = logging.getLogger("api_frontend.auth")
 
 _signing_key = os.getenv("JWT_SIGNING_KEY", "replace_me_in_prod")
 _algo = "HS256"
 bearer = HTTPBearer(auto_error=False)
 
+JOB = "api_frontend"
+AUTH_CACHE_LOOKUPS = Counter("api_auth_cache_lookups_total", "Verified-token cache lookups", ["job", "result"])
+AUTH_CACHE_SIZE = Gauge("api_auth_cache_entries", "Verified tokens held in the cache", ["job"])
+
+# Revoked token digests live in a zset scored by token expiry, so entries age out on their own
+# (tokens without exp are scored +inf and stay revoked).
+# The version key is bumped on every revocation and is the only thing polled on the hot path.
+REVOKED_KEY = "auth:revoked"
+REVOKED_VERSION_KEY = "auth:revoked:version"
+
 class TokenData(BaseModel):
     sub: str
 
@@ -20,14 +40,123 @@ def create_jwt(subject: str, expires_minutes: int = 60*24):
     }
     return jwt.encode(payload, _signing_key, algorithm=_algo)
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer)) -> str:
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class VerifiedTokenCache:
+    """Bounded LRU of verified tokens keyed by digest; entries expire at the token's exp."""
+
+    def __init__(self, max_size: int = 10000, default_ttl: float = 300):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # digest -> (subject, expires_at)
+
+    def get(self, digest: str, now: float) -> Optional[str]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        subject, expires_at = entry
+        if expires_at <= now:
+            del self._entries[digest]
+            return None
+        self._entries.move_to_end(digest)
+        return subject
+
+    def put(self, digest: str, subject: str, exp: Optional[float], now: float):
+        if self.max_size <= 0:
+            return
+        expires_at = exp if exp is not None else now + self.default_ttl
+        self._entries[digest] = (subject, expires_at)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, digest: str):
+        self._entries.pop(digest, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+class RevocationList:
+    """In-process snapshot of the Redis revocation zset, refreshed only when its version changes."""
+
+    def __init__(self, refresh_interval: float = 2.0):
+        self.refresh_interval = refresh_interval
+        self.revoked: Set[str] = set()
+        self.redis = None
+        self._version = None
+        self._task = None
+
+    async def start(self, redis):
+        self.redis = redis
+        await self.refresh()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def refresh(self):
+        version = await self.redis.get(REVOKED_VERSION_KEY)
+        if version == self._version:
+            return
+        now = time.time()
+        await self.redis.zremrangebyscore(REVOKED_KEY, "-inf", now)
+        revoked = set(await self.redis.zrangebyscore(REVOKED_KEY, now, "+inf"))
+        for digest in revoked - self.revoked:
+            _token_cache.discard(digest)
+        self.revoked = revoked
+        self._version = version
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                log.exception("revocation list refresh failed")
+
+async def revoke_token(redis, token: str):
+    """Revoke a token cluster-wide; every node drops it on its next refresh."""
+    data = jwt.decode(token, options={"verify_signature": False})
+    # a token without exp verifies forever, so its revocation must never age out
+    exp = data.get("exp") or float("inf")
+    pipe = redis.pipeline(transaction=False)
+    pipe.zadd(REVOKED_KEY, {token_digest(token): exp})
+    pipe.incr(REVOKED_VERSION_KEY)
+    await pipe.execute()
+
+_token_cache = VerifiedTokenCache(
+    max_size=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+    default_ttl=float(os.getenv("AUTH_CACHE_DEFAULT_TTL", "300")),
+)
+revocation_list = RevocationList(refresh_interval=float(os.getenv("AUTH_REVOCATION_REFRESH", "2")))
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer)) -> str:
     if not credentials:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing auth")
-    token = credentials.credentials
+    with span("auth"):
+        return _authenticate(credentials.credentials)
+
+def _authenticate(token: str) -> str:
+    digest = token_digest(token)
+    if digest in revocation_list.revoked:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked")
+    now = time.time()
+    subject = _token_cache.get(digest, now)
+    if subject is not None:
+        AUTH_CACHE_LOOKUPS.labels(job=JOB, result="hit").inc()
+        return subject
+    AUTH_CACHE_LOOKUPS.labels(job=JOB, result="miss").inc()
     try:
         data = jwt.decode(token, _signing_key, algorithms=[_algo])
-        return data.get("sub")
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
     except Exception:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    subject = data.get("sub")
+    _token_cache.put(digest, subject, data.get("exp"), now)
+    AUTH_CACHE_SIZE.labels(job=JOB).set(len(_token_cache))
+    return subject
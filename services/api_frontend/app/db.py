@@ -1,5 +1,6 @@
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
 import aioredis
 
 mongo_client = None
@@ -19,6 +20,25 @@ async def init_db():
     redis_uri = os.getenv("REDIS_URI", "redis://localhost:6379/0")
     redis = await aioredis.from_url(redis_uri, encoding="utf-8", decode_responses=True)
 
+    await ensure_indexes()
+
+async def ensure_indexes():
+    # create_index is a no-op when an identical index already exists, so this is safe on every start
+    # history keyset pagination walks this index backwards from the cursor
+    await messages_collection.create_index(
+        [("conversation_id", ASCENDING), ("created_at", DESCENDING), ("message_id", DESCENDING)],
+        name="conversation_history",
+    )
+    # worker state updates and dedup lookups address messages by id
+    await messages_collection.create_index([("message_id", ASCENDING)], name="message_id")
+    # outbox relay scans only pending rows, one priority lane at a time; the partial filter keeps
+    # the index as small as the backlog
+    await messages_collection.create_index(
+        [("outbox", ASCENDING), ("priority", ASCENDING), ("created_at", ASCENDING)],
+        name="outbox_pending_by_lane",
+        partialFilterExpression={"outbox": "PENDING"},
+    )
+
 async def close_db():
     global mongo_client, redis
     if mongo_client:
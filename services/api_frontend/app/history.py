@@ -0,0 +1,55 @@
+import json
+import base64
+from typing import Optional, Tuple
+from . import db
+
+# only what the client renders; keeps documents small on the wire and lets Mongo skip the rest
+HISTORY_PROJECTION = {
+    "_id": 0,
+    "message_id": 1,
+    "conversation_id": 1,
+    "sender_id": 1,
+    "recipient_ids": 1,
+    "payload_type": 1,
+    "payload_ref": 1,
+    "metadata": 1,
+    "created_at": 1,
+    "state": 1,
+}
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(message: dict) -> str:
+    raw = json.dumps([message["created_at"], message["message_id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, message_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(created_at), str(message_id)
+    except Exception:
+        raise InvalidCursor("malformed cursor")
+
+async def fetch_page(conversation_id: str, limit: int, cursor: Optional[str] = None):
+    """Return (messages newest-first, next_cursor) using keyset pagination.
+
+    The (conversation_id, created_at desc, message_id desc) index makes each page an
+    index range scan starting right after the cursor, so cost is O(limit) however deep
+    the client has scrolled. Scheduled messages are not history until the scheduler
+    has sent them (it also adds them to the recent window then).
+    """
+    query = {"conversation_id": conversation_id, "state": {"$ne": "SCHEDULED"}}
+    if cursor:
+        created_at, message_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "message_id": {"$lt": message_id}},
+        ]
+    docs = await db.messages_collection.find(query, HISTORY_PROJECTION) \
+        .sort([("created_at", -1), ("message_id", -1)]) \
+        .limit(limit + 1) \
+        .to_list(limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
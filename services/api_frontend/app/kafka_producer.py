@@ -1,25 +1,138 @@
-import os, json, asyncio
+import os, json, asyncio, logging
+from contextlib import contextmanager
 from aiokafka import AIOKafkaProducer
+from prometheus_client import Counter, Gauge, Histogram
+
+log = logging.getLogger("api_frontend.kafka")
+
+JOB = "api_frontend"
+PRODUCER_IN_FLIGHT = Gauge("api_kafka_producer_in_flight", "Records handed to the producer and not yet acked", ["job"])
+PRODUCER_BATCH_RECORDS = Histogram(
+    "api_kafka_producer_batch_records", "Records per produce call", ["job"],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+PRODUCER_REJECTED = Counter("api_kafka_producer_rejected_total", "Records rejected because the producer buffer was full", ["job"])
+PRODUCER_ERRORS = Counter("api_kafka_producer_errors_total", "Records that failed after being buffered", ["job"])
+
+class ProducerBusyError(Exception):
+    """Raised when the bounded in-flight window is full; callers should shed load."""
+    pass
+
+class Reservation:
+    """In-flight slots claimed ahead of a send; see KafkaProducer.reserve."""
+    __slots__ = ("remaining",)
+
+    def __init__(self, n: int):
+        self.remaining = n
 
 class KafkaProducer:
     def __init__(self):
         self._producer = None
         self.bootstrap = os.getenv("KAFKA_BOOTSTRAP", "localhost:9092")
+        # "sync" waits for the broker ack per call, "async" returns once the record is buffered
+        self.mode = os.getenv("KAFKA_PRODUCER_MODE", "sync")
+        self.linger_ms = int(os.getenv("KAFKA_LINGER_MS", "5"))
+        self.max_batch_bytes = int(os.getenv("KAFKA_MAX_BATCH_BYTES", "65536"))
+        self.compression = os.getenv("KAFKA_COMPRESSION") or None  # gzip, snappy, lz4, zstd
+        self.acks = os.getenv("KAFKA_ACKS", "1")
+        self.max_in_flight = int(os.getenv("KAFKA_MAX_IN_FLIGHT", "10000"))
+        self._in_flight = 0
 
     async def start(self):
         if not self._producer:
-            self._producer = AIOKafkaProducer(bootstrap_servers=self.bootstrap)
+            self._producer = AIOKafkaProducer(
+                bootstrap_servers=self.bootstrap,
+                linger_ms=self.linger_ms,
+                max_batch_size=self.max_batch_bytes,
+                compression_type=self.compression,
+                acks="all" if self.acks == "all" else int(self.acks),
+            )
             await self._producer.start()
 
     async def stop(self):
         if self._producer:
+            # stop() flushes everything still sitting in the accumulator
             await self._producer.stop()
             self._producer = None
 
-    async def send(self, topic: str, key: str, value: dict):
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _reserve(self, n: int):
+        if self._in_flight + n > self.max_in_flight:
+            PRODUCER_REJECTED.labels(job=JOB).inc(n)
+            raise ProducerBusyError(f"producer has {self._in_flight} records in flight")
+        self._in_flight += n
+        PRODUCER_IN_FLIGHT.labels(job=JOB).set(self._in_flight)
+
+    @contextmanager
+    def reserve(self, n: int):
+        """Claim n in-flight slots before any other side effect of a request.
+
+        Raises ProducerBusyError right away when the window is full, so a request can
+        be rejected before it writes dedup keys or documents. Slots are consumed by
+        send_batch(..., reservation=...); whatever is left is given back on exit.
+        """
+        reservation = Reservation(n)
+        if n:
+            self._reserve(n)
+        try:
+            yield reservation
+        finally:
+            for _ in range(reservation.remaining):
+                self._release()
+
+    def _release(self, fut=None):
+        self._in_flight -= 1
+        PRODUCER_IN_FLIGHT.labels(job=JOB).set(self._in_flight)
+        if fut is not None and not fut.cancelled() and fut.exception() is not None:
+            PRODUCER_ERRORS.labels(job=JOB).inc()
+            log.error("kafka delivery failed: %s", fut.exception())
+
+    async def _enqueue(self, topic: str, records):
+        """Append records to the producer buffer; returns the per-record ack futures."""
+        futures = []
+        try:
+            for key, value in records:
+                fut = await self._producer.send(topic, json.dumps(value).encode(), key=key.encode())
+                fut.add_done_callback(self._release)
+                futures.append(fut)
+        finally:
+            # give back the slots of records that never reached the buffer
+            for _ in range(len(records) - len(futures)):
+                self._release()
+        return futures
+
+    async def send(self, topic: str, key: str, value: dict, reservation: Reservation = None):
+        await self.send_batch(topic, [(key, value)], reservation=reservation)
+
+    async def send_batch(self, topic: str, records, wait: bool = None, reservation: Reservation = None):
+        """Produce (key, value) pairs as one batch.
+
+        Records are appended to the producer buffer without waiting, so aiokafka
+        packs them into as few produce requests as the batch size allows. In
+        sync mode this waits for every ack; in async mode it returns as soon as
+        the records are buffered; pass wait=True to force waiting for acks.
+        Raises ProducerBusyError when the in-flight window cannot take the
+        whole batch, unless its slots come from a reservation.
+        """
         if not self._producer:
             await self.start()
-        await self._producer.send_and_wait(topic, json.dumps(value).encode(), key=key.encode())
+        records = list(records)
+        if not records:
+            return
+        if reservation is not None:
+            if reservation.remaining < len(records):
+                raise ValueError(f"reservation holds {reservation.remaining} slots, {len(records)} needed")
+            reservation.remaining -= len(records)
+        else:
+            self._reserve(len(records))
+        PRODUCER_BATCH_RECORDS.labels(job=JOB).observe(len(records))
+        futures = await self._enqueue(topic, records)
+        if wait is None:
+            wait = self.mode != "async"
+        if wait:
+            await asyncio.gather(*futures)
 
 kafka_producer = KafkaProducer()
-
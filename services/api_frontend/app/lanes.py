@@ -0,0 +1,18 @@
+"""Priority lanes: each priority is published to its own topic.
+
+Interactive traffic keeps incoming.messages, so a bulk backlog never sits in front of
+it; the worker consumes all lanes with weighted scheduling (WORKER_LANES there). Keep
+the topic names in sync with the worker's lane table.
+"""
+import os
+
+PRIORITIES = ("interactive", "bulk")
+DEFAULT_PRIORITY = "interactive"
+
+LANE_TOPICS = {
+    "interactive": os.getenv("LANE_TOPIC_INTERACTIVE", "incoming.messages"),
+    "bulk": os.getenv("LANE_TOPIC_BULK", "incoming.messages.bulk"),
+}
+
+def lane_topic(priority: str = None) -> str:
+    return LANE_TOPICS.get(priority or DEFAULT_PRIORITY, LANE_TOPICS[DEFAULT_PRIORITY])
@@ -1,42 +1,80 @@
 import os
 import asyncio
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from starlette.routing import compile_path
 from .routes import router
-from .kafka_producer import kafka_producer
+from .kafka_producer import kafka_producer, ProducerBusyError
+from . import db
 from .db import init_db, close_db
 from .websocket_mgr import ws_manager
+from .ws_cluster import ClusterRouter
+from .auth import revocation_list
+from .storage import storage
+from .timing import begin_request
+from .outbox_relay import outbox_relay, outbox_enabled
+from .scheduler import scheduler
 
 # Prometheus client
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 
 app = FastAPI(title="chat4all API")
 
-app.include_router(router, prefix="/v1")
+API_PREFIX = "/v1"
+app.include_router(router, prefix=API_PREFIX)
 
 # Prometheus metrics
 JOB = "api_frontend"
 HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "path", "code", "job"])
-HTTP_REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency seconds", ["job"])
+HTTP_REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency seconds", ["job", "path"])
 WS_CONNECTIONS = Counter("api_ws_connections_total", "Active websocket connections", ["job"])
 
+_TEMPLATES = []
+
+def _templates():
+    # (regex, template) for every route with its full path; built on first use because some
+    # FastAPI versions keep included routes unprefixed (scope["route"].path == "/health")
+    if not _TEMPLATES:
+        paths = [route.path for route in app.router.routes if getattr(route, "path", None)]
+        paths += [API_PREFIX + route.path for route in router.routes if getattr(route, "path", None)]
+        for path in dict.fromkeys(paths):
+            _TEMPLATES.append((compile_path(path)[0], path))
+    return _TEMPLATES
+
+def _route_template(request: Request) -> str:
+    # label with the route template (/v1/ws/{user_id}) rather than the raw path to bound cardinality
+    path = request.scope.get("path", "")
+    for regex, template in _templates():
+        if regex.match(path):
+            return template
+    return "unmatched"
+
 @app.middleware("http")
 async def metrics_middleware(request: Request, call_next):
     import time
     start = time.time()
+    timing = begin_request()
     try:
         response = await call_next(request)
         status_code = response.status_code
+        if timing.spans:
+            response.headers["Server-Timing"] = timing.server_timing()
     except Exception as exc:
         status_code = 500
         raise
     finally:
         duration = time.time() - start
-        # label path minimally to avoid high cardinality; for more advanced use replace dynamic segments
-        path = request.url.path
+        path = _route_template(request)
         HTTP_REQUESTS.labels(method=request.method, path=path, code=str(status_code), job=JOB).inc()
-        HTTP_REQUEST_LATENCY.labels(job=JOB).observe(duration)
+        HTTP_REQUEST_LATENCY.labels(job=JOB, path=path).observe(duration)
+        timing.observe(path)
     return response
 
+@app.exception_handler(ProducerBusyError)
+async def producer_busy_handler(request: Request, exc: ProducerBusyError):
+    # shed load fast instead of queueing more work behind a saturated producer
+    return JSONResponse(status_code=503, content={"detail": "Message pipeline busy, retry later"}, headers={"Retry-After": "1"})
+
 @app.get("/metrics")
 def metrics():
     """
@@ -56,9 +94,24 @@ async def startup():
 
     await init_db()
     await kafka_producer.start()
+    await storage.start()
+    if os.getenv("WS_CLUSTER_ENABLED", "1") == "1":
+        ws_manager.cluster = ClusterRouter(ws_manager)
+        await ws_manager.cluster.start(db.redis)
+    if os.getenv("AUTH_REVOCATION_ENABLED", "0") == "1":
+        await revocation_list.start(db.redis)
+    if outbox_enabled() and os.getenv("OUTBOX_RELAY_IN_PROCESS", "1") == "1":
+        await outbox_relay.start()
+    if os.getenv("SCHEDULER_IN_PROCESS", "1") == "1":
+        await scheduler.start()
 
 @app.on_event("shutdown")
 async def shutdown():
+    await scheduler.stop()
+    await outbox_relay.stop()
     await kafka_producer.stop()
-    await close_db()
+    await revocation_list.stop()
+    if ws_manager.cluster:
+        await ws_manager.cluster.stop()
     await ws_manager.close_all()
+    await close_db()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 
 class SendMessageReq(BaseModel):
     conversation_id: str = Field(..., example="conv:alice:bob")
@@ -8,11 +8,41 @@ class SendMessageReq(BaseModel):
     content: str
     message_id: Optional[str] = None
     metadata: Optional[Dict[str,Any]] = {}
+    # "bulk" traffic (campaigns, fan-out) goes through its own lane so it cannot delay chats
+    priority: Literal["interactive", "bulk"] = "interactive"
+    # epoch seconds; a time in the future holds the message until then, anything else sends now
+    deliver_at: Optional[float] = None
 
 class SendMessageResp(BaseModel):
     accepted: bool
     message_id: str
 
+class SendMessageBatchReq(BaseModel):
+    messages: List[SendMessageReq]
+
+class BatchItemResult(BaseModel):
+    message_id: str
+    accepted: bool
+    duplicate: bool = False
+
+class SendMessageBatchResp(BaseModel):
+    results: List[BatchItemResult]
+
+class MessageOut(BaseModel):
+    message_id: str
+    conversation_id: str
+    sender_id: Optional[str] = None
+    recipient_ids: List[str] = []
+    payload_type: Optional[str] = None
+    payload_ref: Any = None
+    metadata: Optional[Dict[str,Any]] = {}
+    created_at: float
+    state: Optional[str] = None
+
+class MessagePage(BaseModel):
+    messages: List[MessageOut]
+    next_cursor: Optional[str] = None
+
 class InitUploadResp(BaseModel):
     upload_id: str
     object_key: str
@@ -0,0 +1,146 @@
+"""Transactional outbox relay.
+
+In outbox mode (MESSAGE_OUTBOX_ENABLED=1) send_message persists each message with
+`outbox: "PENDING"` in the same document write and returns without touching
+Kafka. This relay polls the pending rows in created_at order, publishes them to
+their lane's incoming topic in large batches and flips them to `outbox: "SENT"`.
+Lanes are relayed in priority order, so a bulk backlog never delays interactive rows.
+
+Several relays may run at once (one per API pod, or standalone via
+`python -m app.outbox_relay`): a batch is claimed with a short lease before it is
+published, and an expired lease makes the rows claimable again. Delivery is
+at-least-once; the worker's dedup absorbs the rare republish.
+"""
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from prometheus_client import Counter, Histogram
+from . import db
+from .kafka_producer import kafka_producer, ProducerBusyError
+from .lanes import PRIORITIES, DEFAULT_PRIORITY, lane_topic
+
+log = logging.getLogger("api_frontend.outbox")
+
+JOB = "api_frontend"
+OUTBOX_RELAYED = Counter("api_outbox_relayed_total", "Outbox rows published to Kafka", ["job"])
+OUTBOX_BATCH_RECORDS = Histogram(
+    "api_outbox_batch_records", "Rows published per relay batch", ["job"],
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500),
+)
+OUTBOX_LAG = Histogram(
+    "api_outbox_lag_seconds", "Time from message accept to relay publish", ["job"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+# fields forwarded to Kafka; everything else on the document is bookkeeping
+EVENT_FIELDS = ("message_id", "conversation_id", "sender_id", "recipient_ids", "channel_hint",
+                "payload_type", "payload_ref", "metadata", "priority", "created_at")
+
+def outbox_enabled() -> bool:
+    return os.getenv("MESSAGE_OUTBOX_ENABLED", "0") == "1"
+
+class OutboxRelay:
+    def __init__(self):
+        self.relay_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.batch_size = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+        self.poll_interval = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.2"))
+        self.lease_seconds = float(os.getenv("OUTBOX_LEASE_SECONDS", "30"))
+        self.running = False
+        self.task = None
+
+    async def start(self):
+        self.running = True
+        self.task = asyncio.create_task(self._run_loop())
+        log.info("outbox relay %s started", self.relay_id)
+
+    async def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run_loop(self):
+        while self.running:
+            try:
+                relayed = 0
+                for priority in PRIORITIES:
+                    relayed += await self.run_once(priority)
+            except ProducerBusyError:
+                relayed = 0
+            except Exception:
+                log.exception("outbox relay batch failed")
+                relayed = 0
+            # a full batch means there is more backlog; go again without sleeping
+            if relayed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def run_once(self, priority: str = DEFAULT_PRIORITY) -> int:
+        coll = db.messages_collection
+        now = time.time()
+        # rows written before lanes existed have no priority and belong to the default lane
+        lane = [priority, None] if priority == DEFAULT_PRIORITY else [priority]
+        claimable = {
+            "outbox": "PENDING",
+            "priority": {"$in": lane},
+            "$or": [{"outbox_lease_until": {"$exists": False}}, {"outbox_lease_until": {"$lt": now}}],
+        }
+        projection = {f: 1 for f in EVENT_FIELDS}
+        docs = await coll.find(claimable, projection).sort("created_at", 1).limit(self.batch_size).to_list(self.batch_size)
+        if not docs:
+            return 0
+
+        ids = [d["_id"] for d in docs]
+        lease_until = now + self.lease_seconds
+        res = await coll.update_many(
+            {"_id": {"$in": ids}, **claimable},
+            {"$set": {"outbox_owner": self.relay_id, "outbox_lease_until": lease_until}},
+        )
+        if res.modified_count < len(ids):
+            # another relay claimed part of the batch; keep only what we own
+            docs = await coll.find({"_id": {"$in": ids}, "outbox_owner": self.relay_id,
+                                    "outbox_lease_until": lease_until}, projection).sort("created_at", 1).to_list(len(ids))
+            ids = [d["_id"] for d in docs]
+            if not docs:
+                return 0
+
+        events = [{f: d.get(f) for f in EVENT_FIELDS} for d in docs]
+        await kafka_producer.send_batch(lane_topic(priority), [(e["conversation_id"], e) for e in events], wait=True)
+
+        await coll.update_many(
+            {"_id": {"$in": ids}, "outbox_owner": self.relay_id},
+            {"$set": {"outbox": "SENT"}, "$unset": {"outbox_owner": "", "outbox_lease_until": ""}},
+        )
+        published_at = time.time()
+        OUTBOX_RELAYED.labels(job=JOB).inc(len(events))
+        OUTBOX_BATCH_RECORDS.labels(job=JOB).observe(len(events))
+        for e in events:
+            if e.get("created_at"):
+                OUTBOX_LAG.labels(job=JOB).observe(published_at - e["created_at"])
+        return len(events)
+
+outbox_relay = OutboxRelay()
+
+async def _main():
+    os.environ.setdefault("KAFKA_BOOTSTRAP", "redpanda:9092")
+    os.environ.setdefault("MONGO_URI", "mongodb://mongo:27017")
+    os.environ.setdefault("REDIS_URI", "redis://redis:6379/0")
+    await db.init_db()
+    await kafka_producer.start()
+    await outbox_relay.start()
+    try:
+        await outbox_relay.task
+    finally:
+        await outbox_relay.stop()
+        await kafka_producer.stop()
+        await db.close_db()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,174 @@
+"""Write-through cache of the most recent messages per conversation.
+
+Layout (all keys of a conversation share a hash tag so the scripts stay single-slot):
+    conv:{cid}:recent:ids     zset message_id -> created_at, capped at the window size
+    conv:{cid}:recent:msgs    hash message_id -> JSON document (HISTORY_PROJECTION fields)
+    conv:{cid}:recent:state   hash message_id -> delivery state, written by the worker
+    conv:{cid}:recent:full    present when the window holds the whole conversation
+
+The zset orders and trims by (created_at, message_id), the order pages are read in,
+so the window is always every message newer than its oldest entry; a message older
+than that is left out of a partial window rather than cached behind a gap. The
+message JSON is immutable; state lives in its own hash so the worker can update
+it without decoding documents. Keys expire after RECENT_CACHE_TTL of inactivity.
+The worker side lives in services/worker/app/recent_cache.py; keep the layout in sync.
+"""
+import os
+import json
+import logging
+from typing import List, Optional
+from prometheus_client import Counter
+from . import db
+from .history import HISTORY_PROJECTION, encode_cursor, decode_cursor
+
+log = logging.getLogger("api_frontend.recent_cache")
+
+JOB = "api_frontend"
+RECENT_CACHE_LOOKUPS = Counter("api_recent_cache_lookups_total", "History reads served by the recent-message cache", ["job", "result"])
+RECENT_CACHE_ERRORS = Counter("api_recent_cache_write_errors_total", "Failed write-throughs to the recent-message cache", ["job"])
+
+CACHED_FIELDS = [f for f, keep in HISTORY_PROJECTION.items() if keep and f != "state"]
+
+# KEYS: ids, msgs, state, full   ARGV: window, ttl, then (message_id, created_at, json) triples
+# Re-adding an id only updates its score, so trimming one copy never deletes the hash entries of another.
+_PUSH = """
+local complete = redis.call('EXISTS', KEYS[4]) == 1
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+for i = 3, #ARGV, 3 do
+  if complete or #oldest == 0 or tonumber(ARGV[i + 1]) >= tonumber(oldest[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i])
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 2])
+  end
+end
+local extra = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[1])
+if extra > 0 then
+  local old = redis.call('ZRANGE', KEYS[1], 0, extra - 1)
+  redis.call('ZREMRANGEBYRANK', KEYS[1], 0, extra - 1)
+  for _, mid in ipairs(old) do
+    redis.call('HDEL', KEYS[2], mid)
+    redis.call('HDEL', KEYS[3], mid)
+  end
+  redis.call('DEL', KEYS[4])
+end
+for i = 1, 4 do redis.call('EXPIRE', KEYS[i], ARGV[2]) end
+return 1
+"""
+
+# KEYS: ids, msgs, state, full   ARGV: ttl, complete flag, then (message_id, created_at, json, state) newest first.
+# Replaces the cached window with a Mongo page, but only if that loses nothing already cached.
+_BACKFILL = """
+local page = {}
+for i = 3, #ARGV, 4 do page[ARGV[i]] = true end
+for _, mid in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+  if not page[mid] then return 0 end
+end
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[4])
+for i = 3, #ARGV, 4 do
+  redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i])
+  redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 2])
+  if ARGV[i + 3] ~= '' and redis.call('HEXISTS', KEYS[3], ARGV[i]) == 0 then
+    redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 3])
+  end
+end
+if ARGV[2] == '1' then redis.call('SET', KEYS[4], '1') end
+for i = 1, 4 do redis.call('EXPIRE', KEYS[i], ARGV[1]) end
+return 1
+"""
+
+def _keys(conversation_id: str) -> List[str]:
+    base = f"conv:{{{conversation_id}}}:recent"
+    return [f"{base}:ids", f"{base}:msgs", f"{base}:state", f"{base}:full"]
+
+class RecentMessageCache:
+    def __init__(self):
+        self.enabled = os.getenv("RECENT_CACHE_ENABLED", "1") == "1"
+        self.window = int(os.getenv("RECENT_CACHE_WINDOW", "100"))
+        self.ttl = int(os.getenv("RECENT_CACHE_TTL", "3600"))
+        self._push = None
+        self._backfill = None
+
+    def _scripts(self):
+        if self._push is None:
+            self._push = db.redis.register_script(_PUSH)
+            self._backfill = db.redis.register_script(_BACKFILL)
+        return self._push, self._backfill
+
+    async def append(self, messages: List[dict]):
+        """Write-through for newly accepted messages; one script call per conversation.
+
+        Best effort: the messages are already persisted and produced, so a Redis error
+        is logged and counted, never raised. The affected windows are dropped so reads
+        fall back to Mongo instead of serving a window that misses these messages.
+        """
+        if not self.enabled or not messages:
+            return
+        by_conversation = {}
+        for m in messages:
+            by_conversation.setdefault(m["conversation_id"], []).append(m)
+        try:
+            push, _ = self._scripts()
+            pipe = db.redis.pipeline(transaction=False)
+            for cid, items in by_conversation.items():
+                args = [self.window, self.ttl]
+                for m in sorted(items, key=lambda m: (m["created_at"], m["message_id"])):
+                    args += [m["message_id"], m["created_at"], json.dumps({f: m.get(f) for f in CACHED_FIELDS})]
+                await push(keys=_keys(cid), args=args, client=pipe)
+            await pipe.execute()
+        except Exception as e:
+            RECENT_CACHE_ERRORS.labels(job=JOB).inc()
+            log.warning("recent cache write failed for %d conversations: %s", len(by_conversation), e)
+            await self.invalidate(by_conversation)
+
+    async def invalidate(self, conversation_ids):
+        """Drop the cached windows of these conversations (best effort)."""
+        try:
+            pipe = db.redis.pipeline(transaction=False)
+            for cid in conversation_ids:
+                # one DEL per conversation: the keys of different conversations live in different slots
+                pipe.delete(*_keys(cid))
+            await pipe.execute()
+        except Exception as e:
+            log.warning("recent cache invalidation failed: %s", e)
+
+    async def get_page(self, conversation_id: str, limit: int, cursor: Optional[str] = None):
+        """Serve a history page from the window; returns None when Mongo has to answer."""
+        if not self.enabled or limit > self.window:
+            return None
+        keys = _keys(conversation_id)
+        pipe = db.redis.pipeline(transaction=False)
+        pipe.hgetall(keys[1])
+        pipe.hgetall(keys[2])
+        pipe.exists(keys[3])
+        for k in keys:
+            pipe.expire(k, self.ttl)
+        docs, states, complete = (await pipe.execute())[:3]
+        messages = []
+        for mid, raw in docs.items():
+            m = json.loads(raw)
+            m["state"] = states.get(mid, "SENT")
+            messages.append(m)
+        messages.sort(key=lambda m: (m["created_at"], m["message_id"]), reverse=True)
+        if cursor:
+            created_at, message_id = decode_cursor(cursor)
+            messages = [m for m in messages if (m["created_at"], m["message_id"]) < (created_at, message_id)]
+        if len(messages) > limit:
+            RECENT_CACHE_LOOKUPS.labels(job=JOB, result="hit").inc()
+            return messages[:limit], encode_cursor(messages[limit - 1])
+        if complete:
+            RECENT_CACHE_LOOKUPS.labels(job=JOB, result="hit").inc()
+            return messages, None
+        RECENT_CACHE_LOOKUPS.labels(job=JOB, result="miss").inc()
+        return None
+
+    async def backfill(self, conversation_id: str, messages: List[dict], complete: bool):
+        """Seed the window from a first-page Mongo read (newest first)."""
+        if not self.enabled or not messages:
+            return
+        _, backfill = self._scripts()
+        complete = complete and len(messages) <= self.window
+        args = [self.ttl, "1" if complete else "0"]
+        for m in messages[:self.window]:
+            args += [m["message_id"], m["created_at"], json.dumps({f: m.get(f) for f in CACHED_FIELDS}), m.get("state") or ""]
+        await backfill(keys=_keys(conversation_id), args=args)
+
+recent_cache = RecentMessageCache()
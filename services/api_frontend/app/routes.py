@@ -1,15 +1,54 @@
-import os, uuid, time, asyncio
-from fastapi import APIRouter, WebSocket, Depends, HTTPException, UploadFile, BackgroundTasks
-from .models import SendMessageReq, SendMessageResp, InitUploadResp, HealthResp
+import os, uuid, time, asyncio, logging
+from fastapi import APIRouter, WebSocket, Depends, HTTPException, UploadFile, BackgroundTasks, Query
+from typing import Optional
+from .models import SendMessageReq, SendMessageResp, SendMessageBatchReq, SendMessageBatchResp, MessagePage, InitUploadResp, HealthResp
 from .auth import get_current_user, create_jwt
-from .db import messages_collection, file_uploads_collection, redis
+from . import db
 from .kafka_producer import kafka_producer
 from .websocket_mgr import ws_manager
-import boto3
-from botocore.client import Config
+from .storage import storage
+from .timing import span
+from .outbox_relay import outbox_enabled
+from . import history
+from .recent_cache import recent_cache
+from .lanes import lane_topic
+from .scheduler import scheduler
+
+log = logging.getLogger("api_frontend.routes")
 
 router = APIRouter()
 
+DEDUP_TTL = 60*60
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "500"))
+
+def _build_message(req: SendMessageReq) -> dict:
+    now = time.time()
+    message = {
+        "message_id": req.message_id or str(uuid.uuid4()),
+        "conversation_id": req.conversation_id,
+        "sender_id": req.sender_id,
+        "recipient_ids": req.recipient_ids,
+        "channel_hint": None,
+        "payload_type": "text",
+        "payload_ref": req.content,
+        "metadata": req.metadata or {},
+        "priority": req.priority,
+        "created_at": now,
+    }
+    if req.deliver_at and req.deliver_at > now:
+        message["deliver_at"] = req.deliver_at
+    return message
+
+async def _release_dedup(message_ids):
+    # best effort: a failure here must not hide the error that made us release the keys
+    try:
+        pipe = db.redis.pipeline(transaction=False)
+        for mid in message_ids:
+            pipe.delete(f"dedup:{mid}")
+        await pipe.execute()
+    except Exception as e:
+        log.warning("could not release %d dedup keys: %s", len(message_ids), e)
+
 # Health
 @router.get("/health", response_model=HealthResp)
 async def health():
@@ -24,46 +63,138 @@ def token_for(user_id: str):
 # send message
 @router.post("/messages", response_model=SendMessageResp)
 async def send_message(req: SendMessageReq, user: str = Depends(get_current_user)):
-    mid = req.message_id or str(uuid.uuid4())
-    message = {
-        "message_id": mid,
-        "conversation_id": req.conversation_id,
-        "sender_id": req.sender_id,
-        "recipient_ids": req.recipient_ids,
-        "channel_hint": None,
-        "payload_type": "text",
-        "payload_ref": req.content,
-        "metadata": req.metadata or {},
-        "created_at": time.time(),
-    }
-    # dedup: set NX with TTL
-    dedup_key = f"dedup:{mid}"
-    existed = await redis.set(dedup_key, "1", ex=60*60, nx=True)
-    if not existed:
-        # existed == False means key already there -> duplicate
-        raise HTTPException(status_code=409, detail="Duplicate message_id")
-
-    # persist minimal metadata
-    await messages_collection.insert_one({**message, "state": "SENT"})
-
-    # push to Kafka incoming.messages
-    await kafka_producer.send("incoming.messages", message["conversation_id"], message)
-
-    # optionally notify connected websocket recipients
-    for rid in req.recipient_ids:
-        await ws_manager.send_personal(rid, f"[new_message] {mid}")
+    message = _build_message(req)
+    mid = message["message_id"]
+    produce_now = "deliver_at" not in message and not outbox_enabled()
+    # a full producer window answers 503 before the dedup key or the document exist,
+    # so the client's retry after Retry-After is not taken for a duplicate
+    with kafka_producer.reserve(1 if produce_now else 0) as reservation:
+        # dedup: set NX with TTL
+        dedup_key = f"dedup:{mid}"
+        with span("redis_dedup"):
+            existed = await db.redis.set(dedup_key, "1", ex=DEDUP_TTL, nx=True)
+        if not existed:
+            # existed == False means key already there -> duplicate
+            raise HTTPException(status_code=409, detail="Duplicate message_id")
+
+        # persist minimal metadata
+        if "deliver_at" in message:
+            # held in the timer store; the scheduler publishes it once due
+            with span("mongo_insert"):
+                await db.messages_collection.insert_one({**message, "state": "SCHEDULED"})
+            with span("schedule"):
+                await scheduler.schedule_many([message])
+            return {"accepted": True, "message_id": mid}
+        elif not produce_now:
+            # single durable write; the outbox relay publishes to Kafka in bulk
+            with span("mongo_insert"):
+                await db.messages_collection.insert_one({**message, "state": "SENT", "outbox": "PENDING"})
+        else:
+            with span("mongo_insert"):
+                await db.messages_collection.insert_one({**message, "state": "SENT"})
+
+            # push to the incoming topic of the message's priority lane
+            with span("kafka_produce"):
+                await kafka_producer.send(lane_topic(message["priority"]), message["conversation_id"], message,
+                                          reservation=reservation)
+
+    with span("cache_write"):
+        await recent_cache.append([message])
+
+    # notify connected websocket recipients without waiting on their sockets
+    with span("ws_notify"):
+        ws_manager.notify((rid, f"[new_message] {mid}") for rid in req.recipient_ids)
 
     return {"accepted": True, "message_id": mid}
 
+# bulk ingest: one redis pipeline, one insert_many and one kafka batch for the whole request
+@router.post("/messages:batch", response_model=SendMessageBatchResp)
+async def send_message_batch(req: SendMessageBatchReq, user: str = Depends(get_current_user)):
+    if len(req.messages) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} messages")
+    messages = [_build_message(m) for m in req.messages]
+    if not messages:
+        return {"results": []}
+
+    use_outbox = outbox_enabled()
+    unscheduled = 0 if use_outbox else sum(1 for m in messages if "deliver_at" not in m)
+    # claim producer slots up front (see send_message); duplicates give theirs back on exit
+    with kafka_producer.reserve(unscheduled) as reservation:
+        # dedup all items in a single round trip; duplicates inside the batch lose the NX race too
+        pipe = db.redis.pipeline(transaction=False)
+        for message in messages:
+            pipe.set(f"dedup:{message['message_id']}", "1", ex=DEDUP_TTL, nx=True)
+        with span("redis_dedup"):
+            was_set = await pipe.execute()
+
+        claimed = [m for m, ok in zip(messages, was_set) if ok]
+        scheduled = [m for m in claimed if "deliver_at" in m]
+        accepted = [m for m in claimed if "deliver_at" not in m]
+        try:
+            if scheduled:
+                with span("mongo_insert"):
+                    await db.messages_collection.insert_many([{**m, "state": "SCHEDULED"} for m in scheduled], ordered=False)
+                with span("schedule"):
+                    await scheduler.schedule_many(scheduled)
+            if accepted:
+                extra = {"state": "SENT", "outbox": "PENDING"} if use_outbox else {"state": "SENT"}
+                with span("mongo_insert"):
+                    await db.messages_collection.insert_many([{**m, **extra} for m in accepted], ordered=False)
+                if not use_outbox:
+                    by_lane = {}
+                    for m in accepted:
+                        by_lane.setdefault(lane_topic(m["priority"]), []).append((m["conversation_id"], m))
+                    with span("kafka_produce"):
+                        await asyncio.gather(*(kafka_producer.send_batch(topic, records, reservation=reservation)
+                                               for topic, records in by_lane.items()))
+        except Exception:
+            # the client retries the whole batch; without this it would be told "duplicate"
+            # for every message that was never produced
+            await _release_dedup([m["message_id"] for m in claimed])
+            raise
+    if accepted:
+        with span("cache_write"):
+            await recent_cache.append(accepted)
+        with span("ws_notify"):
+            ws_manager.notify(
+                (rid, f"[new_message] {m['message_id']}")
+                for m in accepted for rid in m["recipient_ids"]
+            )
+
+    results = [
+        {"message_id": m["message_id"], "accepted": bool(ok), "duplicate": not ok}
+        for m, ok in zip(messages, was_set)
+    ]
+    return {"results": results}
+
+# conversation history, newest first, keyset-paginated
+@router.get("/conversations/{conversation_id}/messages", response_model=MessagePage)
+async def list_messages(conversation_id: str, limit: int = Query(50, ge=1, le=200), cursor: Optional[str] = None,
+                        user: str = Depends(get_current_user)):
+    try:
+        with span("cache_read"):
+            page = await recent_cache.get_page(conversation_id, limit, cursor)
+        if page is None:
+            with span("mongo_find"):
+                page = await history.fetch_page(conversation_id, limit, cursor)
+            if cursor is None:
+                # seed the recent window so the next "open conversation" is served from Redis
+                with span("cache_write"):
+                    await recent_cache.backfill(conversation_id, page[0], complete=page[1] is None)
+    except history.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    messages, next_cursor = page
+    return {"messages": messages, "next_cursor": next_cursor}
+
 # websocket endpoint for clients to receive events
 @router.websocket("/ws/{user_id}")
 async def websocket_endpoint(ws: WebSocket, user_id: str):
-    await ws_manager.connect(user_id, ws)
+    conn = await ws_manager.connect(user_id, ws)
     try:
         while True:
             data = await ws.receive_text()
-            # echo for now
-            await ws.send_text(f"echo: {data}")
+            # echo for now; goes through the connection queue so the writer task owns the socket
+            conn.enqueue(f"echo: {data}")
     except Exception:
         pass
     finally:
@@ -75,33 +206,11 @@ async def init_upload(owner_id: str, filename: str, user: str = Depends(get_curr
     upload_id = str(uuid.uuid4())
     key = f"{owner_id}/{upload_id}/{filename}"
 
-    s3_endpoint = os.getenv("MINIO_ENDPOINT", "http://localhost:9000")
-    access = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
-    secret = os.getenv("MINIO_SECRET_KEY", "minioadmin")
-    bucket = os.getenv("MINIO_BUCKET", "chat4all")
-
-    # ensure bucket exists (sync boto)
-    s3 = boto3.client(
-        "s3",
-        endpoint_url=s3_endpoint,
-        aws_access_key_id=access,
-        aws_secret_access_key=secret,
-        config=Config(signature_version="s3v4"),
-        region_name="us-east-1",
-    )
-    try:
-        s3.head_bucket(Bucket=bucket)
-    except Exception:
-        try:
-            s3.create_bucket(Bucket=bucket)
-        except Exception:
-            pass
-
-    # presigned post for browser/multipart part upload (for simple flow)
-    presigned = s3.generate_presigned_post(Bucket=bucket, Key=key, ExpiresIn=3600)
+    # presigned post for browser/multipart part upload (for simple flow); signed locally, no I/O
+    presigned = storage.presign_post(key)
 
     # store control doc
-    await file_uploads_collection.insert_one({
+    await db.file_uploads_collection.insert_one({
         "upload_id": upload_id,
         "owner_user_id": owner_id,
         "object_key": key,
@@ -0,0 +1,222 @@
+"""Scheduled delivery: messages with a future `deliver_at` wait in Redis until they are due.
+
+Layout (every key of a bucket shares a hash tag so the scripts stay single-slot):
+    sched:{B}:due        zset message_id -> deliver_at, for deliver_at in bucket B
+    sched:{B}:inflight   zset message_id -> lease expiry, popped but not yet published
+    sched:{B}:msgs       hash message_id -> message JSON
+    sched:buckets        zset of bucket ids that may still hold timers (score = B)
+
+B = floor(deliver_at / SCHEDULER_BUCKET_SECONDS). The scheduler only ever reads the
+index entries at or before the current bucket and pops due members from those, so
+the cost is proportional to what is due, not to how many timers are pending.
+
+A pop moves members to the bucket's inflight set under a lease in the same script,
+so concurrent scheduler replicas never get the same message; a replica that dies
+before acknowledging leaves the lease to expire and the message is popped again
+(at-least-once; the worker's dedup absorbs the rare republish). Runs inside the API
+(SCHEDULER_IN_PROCESS=1) or standalone via `python -m app.scheduler`.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import List
+from prometheus_client import Counter, Histogram
+from . import db
+from .kafka_producer import kafka_producer, ProducerBusyError
+from .lanes import lane_topic
+from .recent_cache import recent_cache
+from .websocket_mgr import ws_manager
+from .ws_cluster import ClusterRouter
+
+log = logging.getLogger("api_frontend.scheduler")
+
+JOB = "api_frontend"
+SCHEDULED_MESSAGES = Counter("api_scheduled_messages_total", "Messages accepted for scheduled delivery", ["job"])
+SCHEDULER_PUBLISHED = Counter("api_scheduler_published_total", "Scheduled messages published once due", ["job"])
+SCHEDULER_DELAY = Histogram(
+    "api_scheduler_delay_seconds", "How late a scheduled message was published after its deliver_at", ["job"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+
+BUCKET_INDEX = "sched:buckets"
+# a bucket that ended this long ago can no longer receive timers (see schedule_many)
+CLOCK_SKEW = 5.0
+
+# KEYS: due, inflight, msgs   ARGV: now, limit, lease_until
+# Returns {remaining, id1, json1, id2, json2, ...}; expired leases are handed out again first.
+_POP = """
+local limit = tonumber(ARGV[2])
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, limit)
+if #ids < limit then
+  local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, limit - #ids)
+  if #due > 0 then redis.call('ZREM', KEYS[1], unpack(due)) end
+  for _, id in ipairs(due) do table.insert(ids, id) end
+end
+local out = {redis.call('ZCARD', KEYS[1]) + redis.call('ZCARD', KEYS[2])}
+if #ids == 0 then return out end
+for _, id in ipairs(ids) do redis.call('ZADD', KEYS[2], ARGV[3], id) end
+local payloads = redis.call('HMGET', KEYS[3], unpack(ids))
+for i, id in ipairs(ids) do
+  table.insert(out, id)
+  table.insert(out, payloads[i] or '')
+end
+return out
+"""
+
+# KEYS: inflight, msgs   ARGV: message ids
+_ACK = """
+redis.call('ZREM', KEYS[1], unpack(ARGV))
+redis.call('HDEL', KEYS[2], unpack(ARGV))
+return #ARGV
+"""
+
+def _keys(bucket: int) -> List[str]:
+    base = f"sched:{{{bucket}}}"
+    return [f"{base}:due", f"{base}:inflight", f"{base}:msgs"]
+
+class Scheduler:
+    def __init__(self):
+        self.bucket_seconds = int(os.getenv("SCHEDULER_BUCKET_SECONDS", "60"))
+        self.batch_size = int(os.getenv("SCHEDULER_BATCH_SIZE", "500"))
+        self.poll_interval = float(os.getenv("SCHEDULER_POLL_INTERVAL", "0.5"))
+        self.lease_seconds = float(os.getenv("SCHEDULER_LEASE_SECONDS", "30"))
+        self.running = False
+        self.task = None
+        self._pop = None
+        self._ack = None
+
+    def bucket_of(self, ts: float) -> int:
+        return int(ts // self.bucket_seconds)
+
+    def _scripts(self):
+        if self._pop is None:
+            self._pop = db.redis.register_script(_POP)
+            self._ack = db.redis.register_script(_ACK)
+        return self._pop, self._ack
+
+    async def schedule_many(self, messages: List[dict]):
+        """Store timers for messages whose deliver_at lies in the future (checked by the caller)."""
+        if not messages:
+            return
+        pipe = db.redis.pipeline(transaction=False)
+        buckets = {}
+        for m in messages:
+            bucket = self.bucket_of(m["deliver_at"])
+            due, _, msgs = _keys(bucket)
+            pipe.zadd(due, {m["message_id"]: m["deliver_at"]})
+            pipe.hset(msgs, m["message_id"], json.dumps(m))
+            buckets[bucket] = bucket
+        # the index is written after the timers so the scheduler never drops a bucket that is being filled
+        pipe.zadd(BUCKET_INDEX, buckets)
+        await pipe.execute()
+        SCHEDULED_MESSAGES.labels(job=JOB).inc(len(messages))
+
+    async def start(self):
+        self.running = True
+        self.task = asyncio.create_task(self._run_loop())
+        log.info("scheduler started")
+
+    async def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run_loop(self):
+        while self.running:
+            try:
+                published = await self.run_once()
+            except ProducerBusyError:
+                published = 0
+            except Exception:
+                log.exception("scheduler pass failed")
+                published = 0
+            if published < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def run_once(self) -> int:
+        now = time.time()
+        due_buckets = await db.redis.zrangebyscore(BUCKET_INDEX, "-inf", self.bucket_of(now), start=0, num=100)
+        published = 0
+        for raw in due_buckets:
+            bucket = int(raw)
+            while True:
+                count, remaining = await self._drain_bucket(bucket, now)
+                published += count
+                if count < self.batch_size:
+                    break
+            if not remaining and (bucket + 1) * self.bucket_seconds < now - CLOCK_SKEW:
+                await db.redis.zrem(BUCKET_INDEX, bucket)
+        return published
+
+    async def _drain_bucket(self, bucket: int, now: float):
+        pop, ack = self._scripts()
+        keys = _keys(bucket)
+        out = await pop(keys=keys, args=[now, self.batch_size, now + self.lease_seconds])
+        remaining = int(out[0])
+        ids, messages = [], []
+        for i in range(1, len(out), 2):
+            ids.append(out[i])
+            if out[i + 1]:
+                messages.append(json.loads(out[i + 1]))
+        if not ids:
+            return 0, remaining
+
+        # dated by their release, not their accept: history and the recent window order by
+        # created_at, and the accept time would file them among messages sent long before
+        released_at = time.time()
+        for m in messages:
+            m["created_at"] = released_at
+        by_lane = {}
+        for m in messages:
+            by_lane.setdefault(lane_topic(m.get("priority")), []).append((m["conversation_id"], m))
+        await asyncio.gather(*(kafka_producer.send_batch(topic, records, wait=True) for topic, records in by_lane.items()))
+        await ack(keys=keys[1:], args=ids)
+
+        published_at = time.time()
+        if messages:
+            await db.messages_collection.update_many(
+                {"message_id": {"$in": [m["message_id"] for m in messages]}, "state": "SCHEDULED"},
+                {"$set": {"state": "SENT", "created_at": released_at}},
+            )
+            # scheduled messages join the recent-history window when they are actually sent
+            await recent_cache.append(messages)
+            # and recipients hear about them now, not when they were accepted
+            ws_manager.notify(
+                (rid, f"[new_message] {m['message_id']}")
+                for m in messages for rid in m.get("recipient_ids") or []
+            )
+        SCHEDULER_PUBLISHED.labels(job=JOB).inc(len(messages))
+        for m in messages:
+            SCHEDULER_DELAY.labels(job=JOB).observe(max(0.0, published_at - m["deliver_at"]))
+        return len(ids), remaining
+
+scheduler = Scheduler()
+
+async def _main():
+    os.environ.setdefault("KAFKA_BOOTSTRAP", "redpanda:9092")
+    os.environ.setdefault("MONGO_URI", "mongodb://mongo:27017")
+    os.environ.setdefault("REDIS_URI", "redis://redis:6379/0")
+    await db.init_db()
+    await kafka_producer.start()
+    # joins the websocket cluster without holding connections, to route [new_message] events
+    ws_manager.cluster = ClusterRouter(ws_manager)
+    await ws_manager.cluster.start(db.redis)
+    await scheduler.start()
+    try:
+        await scheduler.task
+    finally:
+        await scheduler.stop()
+        await ws_manager.cluster.stop()
+        await kafka_producer.stop()
+        await db.close_db()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,56 @@
+import os
+import asyncio
+import logging
+import boto3
+from botocore.client import Config
+
+log = logging.getLogger("api_frontend.storage")
+
+class S3Storage:
+    """Process-wide S3/MinIO client.
+
+    The boto3 client is thread-safe and keeps its own connection pool, so one
+    instance is shared by every request. Presigning is pure local signing and
+    never touches the network; the only blocking calls (bucket provisioning) run
+    once at startup in a worker thread.
+    """
+
+    def __init__(self):
+        self._client = None
+        self.bucket = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self.bucket = os.getenv("MINIO_BUCKET", "chat4all")
+            self._client = boto3.client(
+                "s3",
+                endpoint_url=os.getenv("MINIO_ENDPOINT", "http://localhost:9000"),
+                aws_access_key_id=os.getenv("MINIO_ACCESS_KEY", "minioadmin"),
+                aws_secret_access_key=os.getenv("MINIO_SECRET_KEY", "minioadmin"),
+                config=Config(
+                    signature_version="s3v4",
+                    max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50")),
+                ),
+                region_name="us-east-1",
+            )
+        return self._client
+
+    async def start(self):
+        await asyncio.to_thread(self._ensure_bucket)
+
+    def _ensure_bucket(self):
+        s3 = self.client
+        try:
+            s3.head_bucket(Bucket=self.bucket)
+        except Exception:
+            try:
+                s3.create_bucket(Bucket=self.bucket)
+            except Exception as e:
+                log.warning("could not provision bucket %s: %s", self.bucket, e)
+
+    def presign_post(self, key: str, expires_in: int = 3600) -> dict:
+        s3 = self.client
+        return s3.generate_presigned_post(Bucket=self.bucket, Key=key, ExpiresIn=expires_in)
+
+storage = S3Storage()
@@ -0,0 +1,48 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from prometheus_client import Histogram
+
+JOB = "api_frontend"
+STAGE_LATENCY = Histogram(
+    "api_stage_duration_seconds", "Latency of individual request stages", ["job", "route", "stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+class RequestTiming:
+    """Per-request collection of named stage durations (seconds)."""
+
+    def __init__(self):
+        self.spans: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def observe(self, route: str):
+        for stage, seconds in self.spans.items():
+            STAGE_LATENCY.labels(job=JOB, route=route, stage=stage).observe(seconds)
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.spans.items())
+
+_current: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+def begin_request() -> RequestTiming:
+    timing = RequestTiming()
+    _current.set(timing)
+    return timing
+
+def current_timing() -> Optional[RequestTiming]:
+    return _current.get()
+
+@contextmanager
+def span(stage: str):
+    """Time a block and attribute it to `stage` on the current request, if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing = _current.get()
+        if timing is not None:
+            timing.add(stage, time.perf_counter() - start)
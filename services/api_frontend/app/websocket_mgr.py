@@ -1,46 +1,185 @@
 from fastapi import WebSocket
-from typing import Dict, Set
+from typing import Dict, Iterable, Tuple
+from collections import deque
+import os
 import asyncio
+import logging
+from prometheus_client import Counter, Gauge
+
+log = logging.getLogger("api_frontend.ws")
+
+JOB = "api_frontend"
+WS_QUEUE_DEPTH = Gauge("api_ws_send_queue_depth", "Outbound websocket messages waiting in per-connection queues", ["job"])
+WS_DROPPED = Counter("api_ws_dropped_messages_total", "Outbound websocket messages dropped or coalesced on overflow", ["job", "policy"])
+WS_EVICTIONS = Counter("api_ws_evictions_total", "Websocket connections closed by the server", ["job", "reason"])
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+class _Connection:
+    """One websocket plus its bounded outbound queue and the writer task draining it."""
+
+    def __init__(self, manager: "WebSocketManager", user_id: str, ws: WebSocket):
+        self.manager = manager
+        self.user_id = user_id
+        self.ws = ws
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.evicting = False
+        self.task = asyncio.create_task(self._writer())
+
+    def enqueue(self, message: str):
+        if self.closed:
+            return
+        if len(self.queue) >= self.manager.queue_size:
+            policy = self.manager.overflow_policy
+            WS_DROPPED.labels(job=JOB, policy=policy).inc()
+            if policy == "disconnect":
+                self._evict("slow_consumer")
+                return
+            if policy == "coalesce":
+                # collapse the backlog into one marker; the client refetches state on [resync]
+                dropped = len(self.queue)
+                self.queue.clear()
+                WS_QUEUE_DEPTH.labels(job=JOB).dec(dropped)
+                self.queue.append(f"[resync] {dropped + 1}")
+                WS_QUEUE_DEPTH.labels(job=JOB).inc()
+                return
+            self.queue.popleft()
+            WS_QUEUE_DEPTH.labels(job=JOB).dec()
+        self.queue.append(message)
+        WS_QUEUE_DEPTH.labels(job=JOB).inc()
+        self.wakeup.set()
+
+    async def _writer(self):
+        try:
+            while True:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                message = self.queue.popleft()
+                WS_QUEUE_DEPTH.labels(job=JOB).dec()
+                await asyncio.wait_for(self.ws.send_text(message), self.manager.send_timeout)
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            self._evict("send_timeout")
+        except Exception:
+            self._evict("send_error")
+
+    def _evict(self, reason: str):
+        if self.closed or self.evicting:
+            return
+        self.evicting = True
+        WS_EVICTIONS.labels(job=JOB, reason=reason).inc()
+        log.info("evicting websocket of %s: %s", self.user_id, reason)
+        self.manager._spawn(self.manager.disconnect(self.user_id, self.ws, close=True))
+
+    async def close(self, close_socket: bool = False):
+        if self.closed:
+            return
+        self.closed = True
+        WS_QUEUE_DEPTH.labels(job=JOB).dec(len(self.queue))
+        self.queue.clear()
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+        if close_socket:
+            try:
+                await self.ws.close(code=1013)
+            except Exception:
+                pass
 
 class WebSocketManager:
     def __init__(self):
-        self.connections: Dict[str, Set[WebSocket]] = {}
+        self.connections: Dict[str, Dict[WebSocket, _Connection]] = {}
         self.lock = asyncio.Lock()
+        # set to a ClusterRouter at startup to reach users held by other nodes
+        self.cluster = None
+        self.queue_size = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+        self.send_timeout = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+        self.overflow_policy = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"WS_OVERFLOW_POLICY must be one of {OVERFLOW_POLICIES}")
+        self._background = set()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        task.add_done_callback(self._log_failure)
+        return task
 
-    async def connect(self, user_id: str, ws: WebSocket):
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error("websocket background task failed: %s", task.exception())
+
+    async def connect(self, user_id: str, ws: WebSocket) -> _Connection:
         await ws.accept()
+        conn = _Connection(self, user_id, ws)
         async with self.lock:
-            self.connections.setdefault(user_id, set()).add(ws)
+            first = user_id not in self.connections
+            self.connections.setdefault(user_id, {})[ws] = conn
+        if first and self.cluster:
+            await self.cluster.register(user_id)
+        return conn
 
-    async def disconnect(self, user_id: str, ws: WebSocket):
+    async def disconnect(self, user_id: str, ws: WebSocket, close: bool = False):
+        gone = False
+        conn = None
         async with self.lock:
             conns = self.connections.get(user_id)
             if conns and ws in conns:
-                conns.remove(ws)
+                conn = conns.pop(ws)
                 if not conns:
                     self.connections.pop(user_id, None)
+                    gone = True
+        if conn:
+            await conn.close(close_socket=close)
+        if gone and self.cluster:
+            await self.cluster.unregister(user_id)
+
+    def send_local(self, user_id: str, message: str) -> int:
+        """Enqueue message on every local connection of user_id; never waits on the network."""
+        conns = self.connections.get(user_id)
+        if not conns:
+            return 0
+        for conn in list(conns.values()):
+            conn.enqueue(message)
+        return len(conns)
 
     async def send_personal(self, user_id: str, message: str):
-        conns = self.connections.get(user_id, set()).copy()
-        for ws in conns:
-            try:
-                await ws.send_text(message)
-            except Exception:
-                await self.disconnect(user_id, ws)
+        if self.cluster:
+            await self.cluster.publish(user_id, message)
+        else:
+            self.send_local(user_id, message)
+
+    def notify(self, events: Iterable[Tuple[str, str]]):
+        """Fire-and-forget fan-out of (user_id, message) pairs for request handlers."""
+        events = list(events)
+        if not events:
+            return
+        if self.cluster:
+            self._spawn(self.cluster.publish_many(events))
+        else:
+            for user_id, message in events:
+                self.send_local(user_id, message)
 
     async def broadcast(self, message: str):
-        # naive broadcast
-        keys = list(self.connections.keys())
-        for k in keys:
-            await self.send_personal(k, message)
+        if self.cluster:
+            await self.cluster.broadcast(message)
+        else:
+            self.broadcast_local(message)
+
+    def broadcast_local(self, message: str):
+        for user_id in list(self.connections.keys()):
+            self.send_local(user_id, message)
 
     async def close_all(self):
         for conns in list(self.connections.values()):
-            for ws in list(conns):
-                try:
-                    await ws.close()
-                except:
-                    pass
+            for conn in list(conns.values()):
+                await conn.close(close_socket=True)
         self.connections.clear()
 
 ws_manager = WebSocketManager()
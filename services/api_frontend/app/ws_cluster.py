@@ -0,0 +1,133 @@
+import os, json, time, uuid, socket, asyncio, logging
+from prometheus_client import Counter
+
+log = logging.getLogger("api_frontend.ws_cluster")
+
+JOB = "api_frontend"
+WS_CLUSTER_PUBLISHED = Counter("api_ws_cluster_published_total", "WebSocket events routed to another node", ["job"])
+WS_CLUSTER_RECEIVED = Counter("api_ws_cluster_received_total", "WebSocket events received from other nodes", ["job"])
+
+# Key layout is shared with services/worker/app/ws_events.py; keep them in sync.
+# ws:presence:{user_id}  zset  member=node_id  score=expiry timestamp
+# ws:node:{node_id}      pub/sub channel carrying events for users held by that node
+# ws:broadcast           pub/sub channel every node subscribes to
+PRESENCE_KEY = "ws:presence:{}"
+NODE_CHANNEL = "ws:node:{}"
+BROADCAST_CHANNEL = "ws:broadcast"
+
+class ClusterRouter:
+    """Routes per-user WebSocket events to whichever api_frontend node holds the user.
+
+    Each node registers the users it holds in a Redis presence zset and subscribes
+    only to its own channel, so a node never sees traffic for users it does not
+    hold. Presence entries carry an expiry that a heartbeat keeps pushing forward,
+    which cleans up after nodes that die without unregistering.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.node_id = os.getenv("WS_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.presence_ttl = int(os.getenv("WS_PRESENCE_TTL", "30"))
+        self.redis = None
+        self._pubsub = None
+        self._tasks = []
+
+    @property
+    def channel(self) -> str:
+        return NODE_CHANNEL.format(self.node_id)
+
+    async def start(self, redis):
+        self.redis = redis
+        self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel, BROADCAST_CHANNEL)
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._heartbeat())]
+        log.info("ws cluster node %s listening on %s", self.node_id, self.channel)
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pubsub:
+            await self._pubsub.unsubscribe()
+            await self._pubsub.close()
+            self._pubsub = None
+        if self.redis and self.manager.connections:
+            pipe = self.redis.pipeline(transaction=False)
+            for user_id in list(self.manager.connections):
+                pipe.zrem(PRESENCE_KEY.format(user_id), self.node_id)
+            await pipe.execute()
+
+    async def register(self, user_id: str):
+        key = PRESENCE_KEY.format(user_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(key, {self.node_id: time.time() + self.presence_ttl})
+        pipe.expire(key, self.presence_ttl)
+        await pipe.execute()
+
+    async def unregister(self, user_id: str):
+        await self.redis.zrem(PRESENCE_KEY.format(user_id), self.node_id)
+
+    async def publish(self, user_id: str, message: str):
+        await self.publish_many([(user_id, message)])
+
+    async def publish_many(self, events):
+        """Route (user_id, message) pairs with one pipelined presence lookup and one publish pipeline."""
+        events = list(events)
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, _ in events:
+            pipe.zrangebyscore(PRESENCE_KEY.format(user_id), now, "+inf")
+        node_lists = await pipe.execute()
+        pipe = self.redis.pipeline(transaction=False)
+        remote = 0
+        for (user_id, message), nodes in zip(events, node_lists):
+            for node in nodes:
+                if node == self.node_id:
+                    self.manager.send_local(user_id, message)
+                    continue
+                pipe.publish(NODE_CHANNEL.format(node), json.dumps({"user_id": user_id, "message": message}))
+                remote += 1
+        if remote:
+            await pipe.execute()
+            WS_CLUSTER_PUBLISHED.labels(job=JOB).inc(remote)
+
+    async def broadcast(self, message: str):
+        await self.redis.publish(BROADCAST_CHANNEL, json.dumps({"message": message}))
+
+    async def _listen(self):
+        while True:
+            try:
+                async for item in self._pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    WS_CLUSTER_RECEIVED.labels(job=JOB).inc()
+                    data = json.loads(item["data"])
+                    if item["channel"] == BROADCAST_CHANNEL:
+                        self.manager.broadcast_local(data["message"])
+                    else:
+                        self.manager.send_local(data["user_id"], data["message"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("ws cluster listener failed, resubscribing")
+                await asyncio.sleep(1)
+
+    async def _heartbeat(self):
+        interval = max(1, self.presence_ttl // 3)
+        while True:
+            await asyncio.sleep(interval)
+            user_ids = list(self.manager.connections)
+            if not user_ids:
+                continue
+            try:
+                expiry = time.time() + self.presence_ttl
+                pipe = self.redis.pipeline(transaction=False)
+                for user_id in user_ids:
+                    key = PRESENCE_KEY.format(user_id)
+                    pipe.zadd(key, {self.node_id: expiry})
+                    pipe.zremrangebyscore(key, "-inf", time.time())
+                    pipe.expire(key, self.presence_ttl)
+                await pipe.execute()
+            except Exception:
+                log.exception("ws presence heartbeat failed")
@@ -1,42 +1,176 @@
 import asyncio
+import math
+import os
+import time
 import aiohttp
 import json
-from typing import Optional
+from typing import Awaitable, Callable, Dict, List, Optional
+from .resilience import OPEN, AdaptiveLimiter, CircuitBreaker
+from .routing import RoutingTable
 
 # Adapter contract:
 # Each adapter is an HTTP service with POST /send that accepts JSON:
 # { "message": {...}, "recipient_id": "..." }
 # and returns 200 on success, 4xx/5xx on failure.
+# Adapters may also expose POST /send_batch:
+# { "items": [{"message": {...}, "recipient_id": "..."}, ...] }
+# answering 200 with {"results": [{"recipient_id": "...", "status": "ok"|"error", "code": ..., "error": "..."}]}
+# in item order. Adapters without it answer 404 and get one /send per recipient instead.
 
 class AdapterError(Exception):
-    pass
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+class AdapterUnavailable(AdapterError):
+    """Raised without calling the adapter while its circuit breaker is open."""
+
+def _is_overload(error: Exception) -> bool:
+    # 4xx answers mean the adapter is healthy and rejected this request; only 429,
+    # 5xx, timeouts and connection errors count against the adapter
+    if isinstance(error, AdapterError):
+        return error.status is None or error.status == 429 or error.status >= 500
+    return True
 
 class AdapterClient:
     def __init__(self, http_session: aiohttp.ClientSession, timeout=10):
         self.session = http_session
         self.timeout = timeout
-        # resolver map can be env-driven; default examples:
-        # map 'whatsapp' -> http://connector_whatsapp:8000
-        self.adapter_map = {
-            "whatsapp": lambda rid: f"http://connector_whatsapp:8000",
-            "telegram": lambda rid: f"http://connector_telegram:8000",
-            "instagram": lambda rid: f"http://connector_instagram:8000",
-            "default": lambda rid: f"http://connector_mock:8000"
-        }
+        # recipients per /send_batch call; 1 disables batching
+        self.batch_size = int(os.getenv("ADAPTER_BATCH_SIZE", "50"))
+        # an adapter answers /send_batch once every item is done, sending BATCH_CONCURRENCY items
+        # at a time; an item may take its HTTP timeout plus the adapter's own retries
+        self.batch_concurrency = int(os.getenv("ADAPTER_BATCH_CONCURRENCY", "10"))
+        self.batch_item_timeout = float(os.getenv("ADAPTER_BATCH_ITEM_TIMEOUT", "30"))
+        self._no_batch = set()
+        # per adapter base: a circuit breaker and an AIMD concurrency limit, so a degraded
+        # provider fails fast and is sent less traffic without slowing the other channels
+        self.breaker_failures = int(os.getenv("ADAPTER_BREAKER_FAILURES", "5"))
+        self.breaker_open_seconds = float(os.getenv("ADAPTER_BREAKER_OPEN_SECONDS", "30"))
+        self.breaker_probes = int(os.getenv("ADAPTER_BREAKER_HALF_OPEN_PROBES", "1"))
+        self.limit_initial = int(os.getenv("ADAPTER_LIMIT_INITIAL", "20"))
+        self.limit_min = int(os.getenv("ADAPTER_LIMIT_MIN", "1"))
+        self.limit_max = int(os.getenv("ADAPTER_LIMIT_MAX", "200"))
+        self.latency_target = float(os.getenv("ADAPTER_LATENCY_TARGET_MS", "1000")) / 1000
+        self.limit_backoff = float(os.getenv("ADAPTER_LIMIT_BACKOFF", "0.5"))
+        self.breakers = {}
+        self.limiters = {}
+        # recipient -> channel -> endpoint, from ADAPTER_ROUTES_FILE (hot reloaded) or the built-in table
+        self.routing = RoutingTable(
+            path=os.getenv("ADAPTER_ROUTES_FILE") or None,
+            reload_interval=float(os.getenv("ADAPTER_ROUTES_RELOAD_SECONDS", "5")),
+            eject_failures=int(os.getenv("ADAPTER_EJECT_FAILURES", "3")),
+            eject_seconds=float(os.getenv("ADAPTER_EJECT_SECONDS", "30")),
+            is_open=lambda url: url in self.breakers and self.breakers[url].state == OPEN,
+        )
+
+    def breaker(self, url_base: str) -> CircuitBreaker:
+        breaker = self.breakers.get(url_base)
+        if breaker is None:
+            breaker = self.breakers[url_base] = CircuitBreaker(
+                url_base, self.breaker_failures, self.breaker_open_seconds, self.breaker_probes)
+        return breaker
+
+    def limiter(self, url_base: str) -> AdaptiveLimiter:
+        limiter = self.limiters.get(url_base)
+        if limiter is None:
+            limiter = self.limiters[url_base] = AdaptiveLimiter(
+                url_base, self.limit_initial, self.limit_min, self.limit_max,
+                self.latency_target, self.limit_backoff)
+        return limiter
+
+    def batch_timeout(self, items: int) -> float:
+        """Client-side timeout for a /send_batch of `items` recipients."""
+        waves = math.ceil(items / max(1, self.batch_concurrency))
+        return self.timeout + waves * self.batch_item_timeout
+
+    def resolve_channel(self, channel_hint: Optional[str], recipient_id: str) -> str:
+        return self.routing.channel_for(channel_hint, recipient_id)
 
     def resolve_adapter_base(self, channel_hint: Optional[str], recipient_id: str):
-        if channel_hint and channel_hint in self.adapter_map:
-            return self.adapter_map[channel_hint](recipient_id)
-        # simple resolver: if recipient prefix matches
-        if recipient_id.startswith("wa_"):
-            return self.adapter_map["whatsapp"](recipient_id)
-        if recipient_id.startswith("tg_"):
-            return self.adapter_map["telegram"](recipient_id)
-        if recipient_id.startswith("ig_"):
-            return self.adapter_map["instagram"](recipient_id)
-        return self.adapter_map["default"](recipient_id)
+        return self.routing.pick(self.resolve_channel(channel_hint, recipient_id))
 
     async def send_to_adapter(self, url_base: str, message: dict, recipient_id: str, timeout_override: int = None):
+        return await self._guarded(url_base, lambda: self._post_send(url_base, message, recipient_id, timeout_override))
+
+    async def send_batch(self, url_base: str, message: dict, recipient_ids: List[str], timeout_override: int = None) -> Dict[str, Optional[str]]:
+        """Deliver one message to up to batch_size recipients of one adapter.
+
+        Returns {recipient_id: None on success, else the error}. Falls back to one /send
+        per recipient for adapters that do not implement /send_batch.
+        """
+        if url_base not in self._no_batch:
+            try:
+                return await self._guarded(url_base, lambda: self._post_batch(url_base, message, recipient_ids, timeout_override))
+            except AdapterError as e:
+                if e.status not in (404, 405):
+                    return {rid: str(e) for rid in recipient_ids}
+                self._no_batch.add(url_base)
+            except Exception as e:
+                return {rid: str(e) for rid in recipient_ids}
+
+        async def one(rid):
+            try:
+                await self.send_to_adapter(url_base, message, rid, timeout_override)
+                return None
+            except Exception as e:
+                return str(e)
+        errors = await asyncio.gather(*(one(rid) for rid in recipient_ids))
+        return dict(zip(recipient_ids, errors))
+
+    async def _guarded(self, url_base: str, request: Callable[[], Awaitable]):
+        breaker = self.breaker(url_base)
+        if not breaker.allow():
+            raise AdapterUnavailable(f"Adapter {url_base} circuit open")
+        limiter = self.limiter(url_base)
+        # requests queued on the limiter count as outstanding for balancing
+        self.routing.started(url_base)
+        try:
+            await limiter.acquire()
+        except BaseException:
+            self.routing.finished(url_base, None)
+            breaker.record_cancelled()
+            raise
+        start = time.monotonic()
+        outcome = None
+        try:
+            result = await request()
+            outcome = "ok"
+            return result
+        except Exception as e:
+            outcome = "overload" if _is_overload(e) else "rejected"
+            raise
+        finally:
+            ok = None if outcome is None else outcome != "overload"
+            limiter.release(time.monotonic() - start, ok=ok)
+            self.routing.finished(url_base, ok)
+            if outcome == "overload":
+                breaker.record_failure()
+            elif outcome is None:
+                breaker.record_cancelled()
+            else:
+                breaker.record_success()
+
+    async def _post_batch(self, url_base: str, message: dict, recipient_ids: List[str], timeout_override: int = None):
+        url = f"{url_base.rstrip('/')}/send_batch"
+        payload = {"items": [{"message": message, "recipient_id": rid} for rid in recipient_ids]}
+        timeout = aiohttp.ClientTimeout(total=timeout_override or self.batch_timeout(len(recipient_ids)))
+        async with self.session.post(url, json=payload, timeout=timeout) as resp:
+            if not 200 <= resp.status < 300:
+                raise AdapterError(f"Adapter returned {resp.status}: {await resp.text()}", status=resp.status)
+            results = (await resp.json()).get("results") or []
+        errors = {rid: "missing from batch response" for rid in recipient_ids}
+        for item in results:
+            rid = item.get("recipient_id")
+            if rid in errors:
+                errors[rid] = None if item.get("status") == "ok" else (item.get("error") or f"code {item.get('code')}")
+        if recipient_ids and all(
+                item.get("status") != "ok" and (item.get("code") or 502) >= 500 for item in results):
+            # every item failed upstream: count the batch as an adapter failure
+            raise AdapterError(f"Adapter batch failed: {next(iter(errors.values()))}", status=502)
+        return errors
+
+    async def _post_send(self, url_base: str, message: dict, recipient_id: str, timeout_override: int = None):
         url = f"{url_base.rstrip('/')}/send"
         payload = {"message": message, "recipient_id": recipient_id}
         timeout = aiohttp.ClientTimeout(total=timeout_override or self.timeout)
@@ -48,4 +182,4 @@ class AdapterClient:
                 except:
                     return {"status": "ok", "raw": text}
             else:
-                raise AdapterError(f"Adapter returned {resp.status}: {text}")
+                raise AdapterError(f"Adapter returned {resp.status}: {text}", status=resp.status)
@@ -3,10 +3,18 @@ import json
 import os
 import time
 import math
-from aiokafka import AIOKafkaConsumer
+from aiokafka import AIOKafkaConsumer, ConsumerRebalanceListener, TopicPartition
 from .kafka_client import KafkaClient
-from .db import messages_collection, redis
+from . import db
+from .engine import ProcessingEngine
+from .lanes import LANES, TOPIC_LANES
+from .lag import LagExporter
+from .offsets import OffsetTracker
+from .retry_scheduler import RETRY_SCHEDULED, tier_for_attempt
+from .state_writer import StateWriter
 from .adapter_client import AdapterClient, AdapterError
+from .ws_events import publish_user_event
+from . import recent_cache
 
 # Prometheus metrics for worker
 from prometheus_client import Counter, Histogram
@@ -15,7 +23,51 @@ JOB = "worker"
 KAFKA_CONSUMED = Counter('kafka_consumed_messages_total', 'Consumed Kafka messages', ['job'])
 KAFKA_PRODUCED = Counter('kafka_produced_messages_total', 'Produced Kafka messages', ['job','topic'])
 WORKER_PROCESS_SECONDS = Histogram('worker_process_seconds', 'Worker processing time', ['job'])
+LANE_LATENCY = Histogram('worker_lane_latency_seconds', 'Time from release (see _released_at) to the end of processing, per priority lane', ['job', 'lane'],
+                         buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+QUEUE_WAIT = Histogram('worker_queue_wait_seconds', 'Time a record sat in Kafka before the worker read it', ['job', 'lane'],
+                       buckets=_LATENCY_BUCKETS)
+E2E_DELIVERY = Histogram('worker_e2e_delivery_seconds', 'Time from release (see _released_at) to adapter success, per recipient', ['job', 'channel'],
+                         buckets=_LATENCY_BUCKETS)
+ADAPTER_SECONDS = Histogram('worker_adapter_request_seconds', 'Duration of adapter calls (one per recipient or per batch)', ['job', 'channel', 'result'],
+                            buckets=_LATENCY_BUCKETS)
 DEDUP_HITS = Counter('redis_dedup_hits_total', 'Dedup hits (redis)', ['job'])
+OFFSET_COMMITS = Counter('worker_offset_commits_total', 'Manual Kafka offset commits', ['job', 'result'])
+
+def _released_at(message: dict):
+    """When the message entered the pipeline: API accept, its scheduled deliver_at, or a DLQ replay.
+
+    Latency is measured from here so a message scheduled for tomorrow, or replayed a
+    week after it failed, does not count the wait as pipeline latency.
+    """
+    stamps = [message.get(f) for f in ("created_at", "deliver_at", "replayed_at")]
+    return max((t for t in stamps if t), default=None)
+
+def _parse_limits(spec: str) -> dict:
+    limits = {}
+    for part in spec.split(","):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            limits[name.strip()] = int(value)
+    return limits
+
+class _DeliveredThenFailed(Exception):
+    """Processing failed after the adapters accepted the message for `delivered`."""
+
+    def __init__(self, delivered: list, cause: Exception):
+        super().__init__(f"{cause} (after delivering to {len(delivered)} recipients)")
+        self.delivered = delivered
+
+class _CommitOnRevoke(ConsumerRebalanceListener):
+    def __init__(self, worker: "WorkerConsumer"):
+        self.worker = worker
+
+    async def on_partitions_revoked(self, revoked):
+        await self.worker._on_revoked(revoked)
+
+    async def on_partitions_assigned(self, assigned):
+        pass
 
 class WorkerConsumer:
     def __init__(self, kafka_client: KafkaClient, http_session):
@@ -29,22 +81,99 @@ class WorkerConsumer:
         self.outgoing_topic = os.getenv("OUTGOING_TOPIC", "outgoing.messages")
         self.dlq_topic = os.getenv("DLQ_TOPIC", "deadletters")
         self.group_id = os.getenv("WORKER_GROUP_ID", "chat4all-router-group")
-        # retry policy
+        # retry policy: failed recipients go through up to MAX_RETRIES delay-tier rounds before the DLQ
         self.max_retries = int(os.getenv("MAX_RETRIES", "5"))
-        self.base_backoff = float(os.getenv("BASE_BACKOFF", "0.5"))  # seconds
+        # message state goes through a coalescing bulk writer
+        self.state_writer = StateWriter(
+            max_batch=int(os.getenv("STATE_FLUSH_MAX_BATCH", "500")),
+            flush_interval=float(os.getenv("STATE_FLUSH_INTERVAL_MS", "50")) / 1000,
+            max_attempts=int(os.getenv("STATE_FLUSH_MAX_ATTEMPTS", "5")),
+        )
+        # durability knobs: skip the intermediate PROCESSING write, and whether a message counts as
+        # done (and its offset committable) only once its final state is in Mongo
+        self.write_processing_state = os.getenv("STATE_WRITE_PROCESSING", "1") == "1"
+        self.wait_for_state = os.getenv("STATE_WAIT_FOR_FLUSH", "1") == "1"
+        # push delivery receipts to the sender's websocket through the api_frontend cluster
+        self.ws_events_enabled = os.getenv("WS_EVENTS_ENABLED", "1") == "1"
+        # processing engine: global concurrency cap, per-conversation ordering, partition backpressure
+        self.shutdown_timeout = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "30"))
+        self.engine = ProcessingEngine(
+            self._handle_message,
+            max_concurrency=int(os.getenv("WORKER_MAX_CONCURRENCY", "200")),
+            high_water=int(os.getenv("PARTITION_HIGH_WATER", "1000")),
+            low_water=int(os.getenv("PARTITION_LOW_WATER", "500")),
+            pause=lambda tp: self._set_paused(tp, "engine", True),
+            resume=lambda tp: self._set_paused(tp, "engine", False),
+            # priority lanes share the slots by weight; a few slots stay reserved for the first lane
+            lanes={lane.name: lane.weight for lane in LANES},
+            reserved=int(os.getenv("WORKER_LANE_RESERVED_SLOTS", "10")),
+        )
+        # manual mode commits, per partition, only offsets whose records have all finished
+        self.manual_commit = os.getenv("WORKER_COMMIT_MODE", "manual") == "manual"
+        self.commit_interval = float(os.getenv("COMMIT_INTERVAL_MS", "1000")) / 1000
+        self.max_uncommitted = int(os.getenv("MAX_UNCOMMITTED_SPAN", "5000"))
+        self.offsets = OffsetTracker()
+        self.commit_task = None
+        # records whose handler raised are parked on the retry tier before their offset completes
+        self.park_backoff_max = float(os.getenv("WORKER_PARK_MAX_BACKOFF", "30"))
+        self._parking = set()
+        self._pause_reasons = {}
+        # per-channel cap on concurrent adapter requests, e.g. "whatsapp=50,telegram=50,default=20"
+        self.channel_limits = _parse_limits(os.getenv("CHANNEL_CONCURRENCY", "whatsapp=50,telegram=50,instagram=20,default=20"))
+        self.channel_slots = {}
+        # batch mode polls with getmany and claims the whole batch's dedup keys in one pipeline
+        self.poll_mode = os.getenv("WORKER_POLL_MODE", "stream")
+        self.poll_max_records = int(os.getenv("WORKER_POLL_MAX_RECORDS", "500"))
+        self.poll_timeout_ms = int(os.getenv("WORKER_POLL_TIMEOUT_MS", "100"))
+        # the dedup key is an in-progress lease renewed while the message is handled, so a
+        # worker killed mid-message holds up the redelivered record for one lease at most
+        self.dedup_lease = int(os.getenv("WORKER_DEDUP_LEASE_SECONDS", "30"))
+        self._claimed = set()
+        self._dedup_releases = []
+        self._release_task = None
+        self.lag_interval = float(os.getenv("CONSUMER_LAG_INTERVAL", "15"))
+        self.lag_exporter = None
 
     async def start(self):
-        self.consumer = self.kafka_client.create_consumer([self.incoming_topic], group_id=self.group_id)
+        self.consumer = self.kafka_client.create_consumer(
+            [lane.topic for lane in LANES], group_id=self.group_id,
+            enable_auto_commit=not self.manual_commit,
+            listener=_CommitOnRevoke(self) if self.manual_commit else None,
+        )
         await self.consumer.start()
         self.kafka_client.consumer = self.consumer  # optionally expose
         self.running = True
-        self.task = asyncio.create_task(self._run_loop())
+        self.task = asyncio.create_task(self._run_batch_loop() if self.poll_mode == "batch" else self._run_loop())
+        if self.lag_interval > 0:
+            self.lag_exporter = LagExporter(self.consumer, self.lag_interval,
+                                            watermark=self.offsets.watermark if self.manual_commit else None)
+            self.lag_exporter.start()
+        if self.manual_commit:
+            self.commit_task = asyncio.create_task(self._commit_loop())
         print("WorkerConsumer started and listening for messages")
 
     async def stop(self):
         self.running = False
         if self.task:
-            await self.task
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.lag_exporter:
+            await self.lag_exporter.stop()
+        if not await self.engine.drain(self.shutdown_timeout):
+            print(f"shutdown timeout: {self.engine.pending} messages still in flight")
+            await self.engine.close()
+            await self._release_claims()
+        for task in list(self._parking):
+            # still unparked: the offset stays uncommitted and the record is replayed after restart
+            task.cancel()
+        await asyncio.gather(*self._parking, return_exceptions=True)
+        if self._release_task:
+            await asyncio.gather(self._release_task, return_exceptions=True)
+        await self.state_writer.stop()
+        if self.commit_task:
+            self.commit_task.cancel()
+            await asyncio.gather(self.commit_task, return_exceptions=True)
+            await self._commit()
         if self.consumer:
             await self.consumer.stop()
             self.consumer = None
@@ -53,13 +182,295 @@ class WorkerConsumer:
         async for msg in self.consumer:
             if not self.running:
                 break
+            self._observe_queue_wait(msg)
             try:
                 payload = json.loads(msg.value.decode())
             except Exception as e:
                 print("invalid message payload", e)
                 continue
-            # process in background to keep consumer loop responsive
-            asyncio.create_task(self._handle_message(payload))
+            # ordered per conversation; the engine pauses this partition when it falls behind
+            tp = TopicPartition(msg.topic, msg.partition)
+            key = payload.get("conversation_id") or payload.get("message_id")
+            self._submit(tp, msg.offset, key, payload)
+
+    async def _run_batch_loop(self):
+        backoff = 0.0
+        while self.running:
+            try:
+                await self._poll_batch()
+                backoff = 0.0
+            except Exception as e:
+                # keep consuming: a dead poll task would leave the process up but idle
+                backoff = min(backoff * 2 or 0.5, 10.0)
+                print(f"batch poll failed, retrying in {backoff}s", e)
+                await asyncio.sleep(backoff)
+
+    async def _poll_batch(self):
+        batches = await self.consumer.getmany(timeout_ms=self.poll_timeout_ms, max_records=self.poll_max_records)
+        records = []
+        for tp, msgs in batches.items():
+            for msg in msgs:
+                self._observe_queue_wait(msg)
+                try:
+                    records.append((tp, msg.offset, json.loads(msg.value.decode())))
+                except Exception as e:
+                    print("invalid message payload", e)
+                    self._skip(tp, msg.offset)
+        if not records:
+            return
+        ids = [payload.get("message_id") for _, _, payload in records]
+        pipe = db.redis.pipeline(transaction=False)
+        for msg_id in ids:
+            if msg_id:
+                pipe.set(f"worker:dedup:{msg_id}", "1", ex=self.dedup_lease, nx=True)
+        try:
+            claimed = iter(await pipe.execute())
+        except Exception as e:
+            # records are already consumed: submit them unclaimed and let each handler claim its own key
+            print("batch dedup claim failed, claiming per message", e)
+            claimed = None
+        seen = set()
+        for (tp, offset, payload), msg_id in zip(records, ids):
+            won = next(claimed) if msg_id and claimed is not None else False
+            if msg_id in seen:
+                # the same message twice in one poll: the first copy handles it
+                KAFKA_CONSUMED.labels(job=JOB).inc()
+                DEDUP_HITS.labels(job=JOB).inc()
+                self._skip(tp, offset)
+                continue
+            if msg_id:
+                seen.add(msg_id)
+            if won:
+                self._claimed.add(msg_id)
+            # a key held elsewhere is no proof of delivery: its handler waits for the lease
+            key = payload.get("conversation_id") or msg_id
+            self._submit(tp, offset, key, payload)
+
+    def _observe_queue_wait(self, msg):
+        # record timestamps are producer create time (the API's publish, or a retry's re-injection)
+        if msg.timestamp and msg.timestamp > 0:
+            lane = TOPIC_LANES.get(msg.topic) or LANES[0].name
+            QUEUE_WAIT.labels(job=JOB, lane=lane).observe(max(0.0, time.time() - msg.timestamp / 1000))
+
+    def _observe_delivered(self, message: dict, channel: str, count: int = 1):
+        released_at = _released_at(message)
+        if released_at:
+            elapsed = time.time() - released_at
+            for _ in range(count):
+                E2E_DELIVERY.labels(job=JOB, channel=channel).observe(elapsed)
+
+    def _skip(self, tp, offset):
+        # records that never reach the engine still have to move the commit point
+        if self.manual_commit:
+            self.offsets.track(tp, offset)
+            self.offsets.complete(tp, offset)
+
+    async def _wait_for_claim(self, dedup_key: str):
+        # a live holder releases the key when it finishes; a dead one stops renewing it
+        while not await db.redis.set(dedup_key, "1", ex=self.dedup_lease, nx=True):
+            await asyncio.sleep(self.dedup_lease / 10)
+
+    async def _renew_lease(self, dedup_key: str):
+        while True:
+            await asyncio.sleep(self.dedup_lease / 3)
+            try:
+                await db.redis.expire(dedup_key, self.dedup_lease)
+            except Exception as e:
+                print("failed to renew dedup lease", dedup_key, e)
+
+    async def _release_dedup(self, dedup_key: str):
+        if self.poll_mode != "batch":
+            await db.redis.delete(dedup_key)
+            return
+        # batch mode: keys released in the same loop iteration share one pipelined DEL
+        self._dedup_releases.append(dedup_key)
+        if self._release_task is None:
+            self._release_task = asyncio.create_task(self._flush_dedup_releases())
+
+    async def _flush_dedup_releases(self):
+        await asyncio.sleep(0)
+        keys, self._dedup_releases, self._release_task = self._dedup_releases, [], None
+        try:
+            await db.redis.delete(*keys)
+        except Exception as e:
+            print("failed to release dedup keys", e)
+
+    async def _release_claims(self):
+        # batch-mode claims of records the engine never started; left alone they would
+        # hold up the redelivery after restart until their lease runs out
+        keys = [f"worker:dedup:{msg_id}" for msg_id in self._claimed]
+        self._claimed.clear()
+        if keys:
+            try:
+                await db.redis.delete(*keys)
+            except Exception as e:
+                print("failed to release dedup claims", e)
+
+    def _submit(self, tp, offset, key, payload):
+        # the lane comes from the topic the record was read from, not from the payload
+        lane = TOPIC_LANES.get(tp.topic)
+        if not self.manual_commit:
+            self.engine.submit(tp, key, payload, lane=lane)
+            return
+        self.offsets.track(tp, offset)
+        if self.offsets.uncommitted_span(tp) >= self.max_uncommitted:
+            self._set_paused(tp, "uncommitted", True)
+        self.engine.submit(tp, key, payload, on_done=lambda: self.offsets.complete(tp, offset), lane=lane,
+                           on_failed=lambda error: self._park_failed(tp, offset, payload, error))
+
+    def _park_failed(self, tp, offset, message: dict, error: Exception):
+        task = asyncio.create_task(self._park_until_acked(tp, offset, message, error))
+        self._parking.add(task)
+        task.add_done_callback(self._parking.discard)
+
+    async def _park_until_acked(self, tp, offset, message: dict, error: Exception):
+        """Hand a record whose handler raised to the retry tier (or the DLQ), then complete its offset.
+
+        Until the broker acknowledges the parked copy the offset is held, so the commit
+        point never passes a record that was neither handled nor parked.
+        """
+        # recipients the adapters accepted before the failure are not sent the message again
+        delivered_to = set(getattr(error, "delivered", ()))
+        failures = [{"recipient": rid, "error": f"worker error: {error}"}
+                    for rid in message.get("recipient_ids") or [] if rid not in delivered_to]
+        delivered = int(message.get("delivered_before") or 0) + len(delivered_to)
+        backoff = 1.0
+        while True:
+            try:
+                # with nobody left to deliver to, the retry round only records the final state
+                if not failures or int(message.get("retry_attempt") or 0) < self.max_retries:
+                    fut = await self._schedule_retry(message, failures, delivered)
+                else:
+                    dlq_event = {"message_id": message.get("message_id"), "failures": failures, "original": message, "timestamp": time.time()}
+                    fut = await self.kafka_client.enqueue(self.dlq_topic, key=message.get("message_id") or "", value=dlq_event)
+                    KAFKA_PRODUCED.labels(job=JOB, topic=self.dlq_topic).inc()
+                await self.kafka_client.flush([fut])
+                break
+            except Exception as e:
+                print(f"could not park failed record {tp}@{offset}, retrying in {backoff:.0f}s", e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.park_backoff_max)
+        self.offsets.complete(tp, offset)
+
+    def _set_paused(self, tp, reason: str, paused: bool):
+        """Pause a partition while any reason holds; resume it once none do."""
+        reasons = self._pause_reasons.setdefault(tp, set())
+        was_paused = bool(reasons)
+        if paused:
+            reasons.add(reason)
+        else:
+            reasons.discard(reason)
+        if not reasons:
+            self._pause_reasons.pop(tp, None)
+        if bool(reasons) == was_paused or not self.consumer:
+            return
+        try:
+            if reasons:
+                self.consumer.pause(tp)
+            else:
+                self.consumer.resume(tp)
+        except Exception as e:
+            print(f"could not change pause state of {tp}: {e}")
+
+    async def _commit_loop(self):
+        while True:
+            await asyncio.sleep(self.commit_interval)
+            await self._commit()
+
+    async def _commit(self, partitions=None):
+        offsets = self.offsets.committable()
+        if partitions is not None:
+            offsets = {tp: o for tp, o in offsets.items() if tp in partitions}
+        if offsets and self.consumer:
+            try:
+                await self.consumer.commit(offsets)
+                self.offsets.mark_committed(offsets)
+                OFFSET_COMMITS.labels(job=JOB, result="ok").inc()
+            except Exception as e:
+                OFFSET_COMMITS.labels(job=JOB, result="error").inc()
+                print("offset commit failed", e)
+        for tp in list(self._pause_reasons):
+            if "uncommitted" in self._pause_reasons[tp] and self.offsets.uncommitted_span(tp) < self.max_uncommitted:
+                self._set_paused(tp, "uncommitted", False)
+
+    async def _on_revoked(self, revoked):
+        # commit whatever finished before the partitions move; unfinished records are replayed by the new owner
+        revoked = set(revoked)
+        await self._commit(revoked)
+        self.offsets.revoke(revoked)
+        self.engine.forget(revoked)
+        for tp in revoked:
+            self._pause_reasons.pop(tp, None)
+
+    def _channel_slot(self, channel: str) -> asyncio.Semaphore:
+        slot = self.channel_slots.get(channel)
+        if slot is None:
+            limit = self.channel_limits.get(channel, self.channel_limits.get("default", 20))
+            slot = self.channel_slots[channel] = asyncio.Semaphore(limit)
+        return slot
+
+    async def _deliver(self, message: dict, channel_hint, rid: str):
+        """One delivery attempt to one recipient; returns None on success or a failure record.
+
+        Failed recipients are not retried here: they are parked on a delay tier topic
+        (see retry_scheduler) so no task or memory is held while a provider recovers.
+        """
+        channel = "unknown"
+        try:
+            channel = self.adapter_client.resolve_channel(channel_hint, rid)
+            adapter_base = self.adapter_client.routing.pick(channel)
+            async with self._channel_slot(channel):
+                start = time.monotonic()
+                result = "error"
+                try:
+                    await self.adapter_client.send_to_adapter(adapter_base, message, rid)
+                    result = "ok"
+                finally:
+                    ADAPTER_SECONDS.labels(job=JOB, channel=channel, result=result).observe(time.monotonic() - start)
+            self._observe_delivered(message, channel)
+            return None
+        except AdapterError as e:
+            return {"recipient": rid, "error": str(e)}
+        except Exception as e:
+            return {"recipient": rid, "error": str(e)}
+
+    async def _deliver_batched(self, message: dict, channel_hint, recipients: list) -> list:
+        """Like _deliver for every recipient, but one /send_batch call per adapter chunk."""
+        by_channel = {}
+        for rid in recipients:
+            by_channel.setdefault(self.adapter_client.resolve_channel(channel_hint, rid), []).append(rid)
+        size = self.adapter_client.batch_size
+
+        async def send_chunk(channel, chunk):
+            async with self._channel_slot(channel):
+                adapter_base = self.adapter_client.routing.pick(channel)
+                start = time.monotonic()
+                errors = await self.adapter_client.send_batch(adapter_base, message, chunk)
+            ok = sum(1 for e in errors.values() if e is None)
+            ADAPTER_SECONDS.labels(job=JOB, channel=channel, result="ok" if ok else "error").observe(time.monotonic() - start)
+            self._observe_delivered(message, channel, ok)
+            return errors
+
+        chunks = [(channel, rids[i:i + size]) for channel, rids in by_channel.items() for i in range(0, len(rids), size)]
+        errors = {}
+        for result in await asyncio.gather(*(send_chunk(c, chunk) for c, chunk in chunks)):
+            errors.update(result)
+        return [None if errors.get(rid) is None else {"recipient": rid, "error": errors[rid]} for rid in recipients]
+
+    async def _schedule_retry(self, message: dict, failures: list, delivered: int) -> asyncio.Future:
+        attempt = int(message.get("retry_attempt") or 0) + 1
+        topic, delay = tier_for_attempt(attempt)
+        retry_message = {
+            **message,
+            "recipient_ids": [f["recipient"] for f in failures],
+            "retry_attempt": attempt,
+            "delivered_before": delivered,
+        }
+        parked = {"message": retry_message, "failures": failures, "due_at": time.time() + delay}
+        fut = await self.kafka_client.enqueue(topic, key=message.get("conversation_id") or "", value=parked)
+        KAFKA_PRODUCED.labels(job=JOB, topic=topic).inc()
+        RETRY_SCHEDULED.labels(job=JOB, tier=topic).inc()
+        return fut
 
     async def _handle_message(self, message: dict):
         msg_id = message.get("message_id")
@@ -71,58 +482,100 @@ class WorkerConsumer:
         KAFKA_CONSUMED.labels(job=JOB).inc()
 
         dedup_key = f"worker:dedup:{msg_id}"
-        was_set = await redis.set(dedup_key, "1", ex=60*60, nx=True)
-        if not was_set:
+        if msg_id in self._claimed:
+            # batch mode already claimed the key together with the rest of its poll
+            self._claimed.discard(msg_id)
+        elif not await db.redis.set(dedup_key, "1", ex=self.dedup_lease, nx=True):
+            # keys are released once a message is handled, so a held key means a copy still in
+            # progress, or one whose worker died mid-message; completing this record now would drop it
             DEDUP_HITS.labels(job=JOB).inc()
-            print(f"message {msg_id} already processed (dedup)")
-            return
+            print(f"message {msg_id} is claimed elsewhere (dedup), waiting for its lease")
+            await self._wait_for_claim(dedup_key)
+
+        heartbeat = asyncio.create_task(self._renew_lease(dedup_key))
+        try:
+            await self._process(message, msg_id, start_time)
+        finally:
+            heartbeat.cancel()
+            # cleanup dedup key (policy: allow replays later), also when processing failed so a
+            # redelivery or the parked retry is not dropped as a duplicate
+            try:
+                await self._release_dedup(dedup_key)
+            except Exception as e:
+                print("failed to release dedup key", dedup_key, e)
 
-        await messages_collection.update_one({"message_id": msg_id}, {"$set": {"state": "PROCESSING", "updated_at": time.time()}}, upsert=True)
+    async def _process(self, message: dict, msg_id: str, start_time: float):
+        if self.write_processing_state:
+            # not awaited: if the final state arrives before the flush, the two merge into one write
+            self.state_writer.update(msg_id, {"state": "PROCESSING", "updated_at": time.time()})
+            await self._set_cached_state(message, msg_id, "PROCESSING")
 
         recipients = message.get("recipient_ids") or []
         channel_hint = message.get("channel_hint")
-        successes = []
-        failures = []
-        for rid in recipients:
-            try:
-                adapter_base = self.adapter_client.resolve_adapter_base(channel_hint, rid)
-                attempt = 0
-                while True:
-                    try:
-                        attempt += 1
-                        await self.adapter_client.send_to_adapter(adapter_base, message, rid)
-                        successes.append(rid)
-                        break
-                    except AdapterError as e:
-                        if attempt > self.max_retries:
-                            failures.append({"recipient": rid, "error": str(e)})
-                            break
-                        backoff = self.base_backoff * (2 ** (attempt - 1)) * (1 + 0.1 * (attempt - 1))
-                        await asyncio.sleep(backoff)
-                    except Exception as e:
-                        if attempt > self.max_retries:
-                            failures.append({"recipient": rid, "error": str(e)})
-                            break
-                        backoff = self.base_backoff * (2 ** (attempt - 1))
-                        await asyncio.sleep(backoff)
-            except Exception as e:
-                failures.append({"recipient": rid, "error": str(e)})
+        # recipients are delivered concurrently; per-channel caps keep one group message from flooding a provider
+        if self.adapter_client.batch_size > 1 and len(recipients) > 1:
+            outcomes = await self._deliver_batched(message, channel_hint, recipients)
+        else:
+            outcomes = await asyncio.gather(*(self._deliver(message, channel_hint, rid) for rid in recipients))
+        successes = [rid for rid, failure in zip(recipients, outcomes) if failure is None]
+        failures = [failure for failure in outcomes if failure is not None]
+        try:
+            await self._record_outcome(message, msg_id, start_time, successes, failures)
+        except Exception as e:
+            # the successes already have the message; parking must not send it to them again
+            raise _DeliveredThenFailed(successes, e) from e
+
+    async def _set_cached_state(self, message: dict, msg_id: str, state: str):
+        # the recent window is a cache: failing here after the adapters succeeded would park
+        # the message and deliver it twice, while Mongo still gets the state
+        try:
+            await recent_cache.set_state(db.redis, message.get("conversation_id"), msg_id, state)
+        except Exception as e:
+            print("failed to update recent window state", msg_id, e)
 
-        new_state = "DELIVERED" if len(failures) == 0 else "PARTIAL" if len(successes) > 0 else "FAILED"
-        await messages_collection.update_one({"message_id": msg_id}, {"$set": {"state": new_state, "delivered_to": successes, "failed_to": failures, "updated_at": time.time()}}, upsert=True)
+    async def _record_outcome(self, message: dict, msg_id: str, start_time: float, successes: list, failures: list):
+        # recipients delivered in earlier retry rounds still count towards PARTIAL
+        delivered = len(successes) + int(message.get("delivered_before") or 0)
+        retrying = bool(failures) and int(message.get("retry_attempt") or 0) < self.max_retries
+        if retrying:
+            new_state = "RETRYING"
+        else:
+            new_state = "DELIVERED" if len(failures) == 0 else "PARTIAL" if delivered > 0 else "FAILED"
+        state_written = self.state_writer.update(
+            msg_id,
+            {"state": new_state, "failed_to": failures, "updated_at": time.time()},
+            add_to_set={"delivered_to": successes},
+        )
+        await self._set_cached_state(message, msg_id, new_state)
 
+        # every record for this message is buffered first and acked with a single flush below
+        produced = []
         for rid in successes:
             event = {"message_id": msg_id, "recipient_id": rid, "status": "delivered", "timestamp": time.time()}
-            await self.kafka_client.send(self.outgoing_topic, key=msg_id, value=event)
+            produced.append(await self.kafka_client.enqueue(self.outgoing_topic, key=msg_id, value=event))
             KAFKA_PRODUCED.labels(job=JOB, topic=self.outgoing_topic).inc()
 
-        if failures:
+        if self.ws_events_enabled and successes:
+            try:
+                await publish_user_event(db.redis, message.get("sender_id"), f"[delivered] {msg_id} {','.join(successes)}")
+            except Exception as e:
+                print("failed to push delivery event", e)
+
+        if retrying:
+            produced.append(await self._schedule_retry(message, failures, delivered))
+        elif failures:
             dlq_event = {"message_id": msg_id, "failures": failures, "original": message, "timestamp": time.time()}
-            await self.kafka_client.send(self.dlq_topic, key=msg_id, value=dlq_event)
+            produced.append(await self.kafka_client.enqueue(self.dlq_topic, key=msg_id, value=dlq_event))
             KAFKA_PRODUCED.labels(job=JOB, topic=self.dlq_topic).inc()
 
+        await self.kafka_client.flush(produced)
+
+        if self.wait_for_state:
+            await state_written
+
         duration = time.time() - start_time
         WORKER_PROCESS_SECONDS.labels(job=JOB).observe(duration)
+        released_at = _released_at(message)
+        if released_at:
+            LANE_LATENCY.labels(job=JOB, lane=message.get("priority") or LANES[0].name).observe(time.time() - released_at)
 
-        # cleanup dedup key (policy: allow replays later). Remove this to keep idempotency forever.
-        await redis.delete(dedup_key)
@@ -0,0 +1,199 @@
+"""Replays dead-lettered messages back into the pipeline.
+
+    python -m app.dlq_replay --channel whatsapp --since 2024-05-01T10:00 --rate 500 --failed-only
+
+Streams the DLQ topic, keeps the records that match every given filter, and
+re-injects the message into its lane's incoming topic (or --topic) at no more than
+--rate messages per second. A record matches when at least one of its failures
+matches the recipient filters (--channel, --error, --recipient-prefix) and its DLQ
+timestamp is inside --since/--until. With --failed-only only the matching failed
+recipients are re-sent; otherwise the message goes out again to every recipient it
+had when it was dead-lettered.
+
+Progress is checkpointed by committing offsets for --group after every produced
+batch, so a stopped replay resumes where it left off. By default the replay stops at
+the DLQ end offsets observed at start-up, so records dead-lettered during the replay
+are not picked up again. Use a new --group to replay the same range twice.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import datetime
+from aiokafka import AIOKafkaConsumer, TopicPartition
+from .kafka_client import KafkaClient
+from .lanes import lane_topic
+from .routing import RoutingTable
+
+def parse_time(value: str) -> float:
+    """Epoch seconds or an ISO 8601 timestamp (naive values are local time)."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions per second with bursts of up to one second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ReplayFilter:
+    def __init__(self, channel=None, error=None, recipient_prefix=None, since=None, until=None, routing=None):
+        self.channel = channel
+        self.error = re.compile(error) if error else None
+        self.recipient_prefix = recipient_prefix
+        self.since = since
+        self.until = until
+        self.routing = routing or RoutingTable(path=os.getenv("ADAPTER_ROUTES_FILE") or None)
+
+    def failure_matches(self, original: dict, failure: dict) -> bool:
+        rid = failure.get("recipient") or ""
+        if self.recipient_prefix and not rid.startswith(self.recipient_prefix):
+            return False
+        if self.error and not self.error.search(failure.get("error") or ""):
+            return False
+        if self.channel and self.routing.channel_for(original.get("channel_hint"), rid) != self.channel:
+            return False
+        return True
+
+    def select(self, record: dict):
+        """Failures of a DLQ record that match, or None when the record is filtered out."""
+        ts = record.get("timestamp") or 0
+        if (self.since is not None and ts < self.since) or (self.until is not None and ts >= self.until):
+            return None
+        original = record.get("original") or {}
+        matched = [f for f in record.get("failures") or [] if self.failure_matches(original, f)]
+        return matched or None
+
+def build_replay(record: dict, matched: list, failed_only: bool) -> dict:
+    original = record["original"]
+    message = {**original, "retry_attempt": 0, "replayed_at": time.time()}
+    if failed_only:
+        # recipients that did not fail in the last round were delivered and still count for PARTIAL
+        recipients = [f["recipient"] for f in matched]
+        delivered = len(original.get("recipient_ids") or []) - len(record.get("failures") or [])
+        message["recipient_ids"] = recipients
+        message["delivered_before"] = int(original.get("delivered_before") or 0) + max(0, delivered)
+    return message
+
+class DlqReplayer:
+    def __init__(self, args):
+        self.args = args
+        self.filter = ReplayFilter(args.channel, args.error, args.recipient_prefix,
+                                   parse_time(args.since) if args.since else None,
+                                   parse_time(args.until) if args.until else None)
+        self.limiter = RateLimiter(args.rate)
+        self.kafka_client = KafkaClient()
+        self.consumer = None
+        self.scanned = 0
+        self.replayed = 0
+
+    async def run(self):
+        self.consumer = AIOKafkaConsumer(
+            bootstrap_servers=self.kafka_client.bootstrap,
+            group_id=self.args.group,
+            enable_auto_commit=False,
+            auto_offset_reset="earliest",
+        )
+        await self.consumer.start()
+        if not self.args.dry_run:
+            await self.kafka_client.start()
+        try:
+            partitions = [TopicPartition(self.args.dlq_topic, p) for p in self.consumer.partitions_for_topic(self.args.dlq_topic) or ()]
+            if not partitions:
+                print("no partitions for", self.args.dlq_topic)
+                return
+            # explicit assignment: a replay is a single process, and commits under --group are its checkpoint
+            self.consumer.assign(partitions)
+            stop_at = await self.consumer.end_offsets(partitions) if not self.args.follow else {}
+            await self._replay(set(partitions), stop_at)
+        finally:
+            if not self.args.dry_run:
+                await self.kafka_client.stop()
+            await self.consumer.stop()
+        print(f"done: scanned {self.scanned}, replayed {self.replayed}")
+
+    async def _replay(self, active, stop_at):
+        last_report = time.monotonic()
+        while active:
+            for tp in list(active):
+                if tp in stop_at and await self.consumer.position(tp) >= stop_at[tp]:
+                    active.discard(tp)
+                    self.consumer.pause(tp)
+            if not active:
+                break
+            batches = await self.consumer.getmany(timeout_ms=1000, max_records=self.args.batch)
+            sends = []
+            commits = {}
+            for tp, records in batches.items():
+                for rec in records:
+                    if tp in stop_at and rec.offset >= stop_at[tp]:
+                        break
+                    commits[tp] = rec.offset + 1
+                    self.scanned += 1
+                    try:
+                        record = json.loads(rec.value.decode())
+                    except Exception as e:
+                        print("skipping undecodable DLQ record", tp, rec.offset, e)
+                        continue
+                    matched = self.filter.select(record)
+                    if not matched or not record.get("original"):
+                        continue
+                    message = build_replay(record, matched, self.args.failed_only)
+                    self.replayed += 1
+                    if self.args.dry_run:
+                        print("would replay", message.get("message_id"), message.get("recipient_ids"))
+                        continue
+                    await self.limiter.acquire()
+                    topic = self.args.topic or lane_topic(message.get("priority"))
+                    sends.append(await self.kafka_client.enqueue(topic, key=message.get("conversation_id") or "", value=message))
+            # checkpoint only once everything read so far is acknowledged by the broker
+            await self.kafka_client.flush(sends)
+            if commits and not self.args.dry_run:
+                await self.consumer.commit(commits)
+            if time.monotonic() - last_report >= 10:
+                last_report = time.monotonic()
+                print(f"progress: scanned {self.scanned}, replayed {self.replayed}")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.dlq_replay", description="Replay dead-lettered messages.")
+    parser.add_argument("--dlq-topic", default=os.getenv("DLQ_TOPIC", "deadletters"))
+    parser.add_argument("--group", default=os.getenv("DLQ_REPLAY_GROUP_ID", "chat4all-dlq-replay"),
+                        help="consumer group holding the replay checkpoint")
+    parser.add_argument("--topic", help="re-inject here instead of the message's lane topic")
+    parser.add_argument("--channel", help="only failures routed to this channel (whatsapp, telegram, ...)")
+    parser.add_argument("--error", help="only failures whose error matches this regular expression")
+    parser.add_argument("--recipient-prefix", help="only failures of recipients starting with this prefix")
+    parser.add_argument("--since", help="only records dead-lettered at or after this time (epoch or ISO 8601)")
+    parser.add_argument("--until", help="only records dead-lettered before this time (epoch or ISO 8601)")
+    parser.add_argument("--failed-only", action="store_true", help="re-send only the matching failed recipients")
+    parser.add_argument("--rate", type=float, default=float(os.getenv("DLQ_REPLAY_RATE", "200")),
+                        help="max messages re-injected per second (0 = unlimited)")
+    parser.add_argument("--batch", type=int, default=500, help="records read and checkpointed per batch")
+    parser.add_argument("--follow", action="store_true", help="keep replaying new DLQ records instead of stopping at the end")
+    parser.add_argument("--dry-run", action="store_true", help="print what would be replayed; produce and commit nothing")
+    return parser
+
+if __name__ == "__main__":
+    os.environ.setdefault("KAFKA_BOOTSTRAP", "redpanda:9092")
+    try:
+        asyncio.run(DlqReplayer(build_parser().parse_args()).run())
+    except KeyboardInterrupt:
+        pass
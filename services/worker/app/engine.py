@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+from prometheus_client import Counter, Gauge, Histogram
+
+log = logging.getLogger("worker.engine")
+
+JOB = "worker"
+# under the supervisor each process exports its own value; livesum reports the node total
+# and drops processes that have exited
+ENGINE_PENDING = Gauge('worker_pending_messages', 'Messages accepted by the engine and not yet finished', ['job'],
+                       multiprocess_mode='livesum')
+ENGINE_RUNNING = Gauge('worker_running_messages', 'Messages currently being handled', ['job'],
+                       multiprocess_mode='livesum')
+ENGINE_PAUSED_PARTITIONS = Gauge('worker_paused_partitions', 'Kafka partitions paused for backpressure', ['job'],
+                                 multiprocess_mode='livesum')
+ENGINE_PAUSES = Counter('worker_partition_pauses_total', 'Times a partition was paused for backpressure', ['job'])
+LANE_WAIT = Histogram('worker_lane_wait_seconds', 'Time a message waited for a processing slot, per priority lane', ['job', 'lane'],
+                      buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+class _Item:
+    __slots__ = ("partition", "payload", "on_done", "on_failed", "lane")
+
+    def __init__(self, partition, payload, on_done, on_failed=None, lane=None):
+        self.partition = partition
+        self.payload = payload
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.lane = lane
+
+class _LaneSlots:
+    """Concurrency slots shared by priority lanes with smooth weighted round robin.
+
+    While several lanes wait, freed slots go to them in proportion to their weights; a
+    lane alone gets every slot, so low-priority work fills whatever capacity is spare.
+    The last `reserved` slots are only handed to the first lane, keeping headroom for
+    it to start new work at once even when the others saturate the engine.
+    """
+
+    def __init__(self, capacity: int, weights: Dict[Hashable, int], reserved: int = 0):
+        self.free = capacity
+        self.weights = weights
+        self.first = next(iter(weights))
+        self.reserved = min(reserved, capacity - 1)
+        self._current = {lane: 0 for lane in weights}
+        self._waiters: Dict[Hashable, Deque[asyncio.Future]] = {lane: deque() for lane in weights}
+
+    def _allowed(self, lane) -> bool:
+        return self.free > (0 if lane == self.first else self.reserved)
+
+    async def acquire(self, lane):
+        waiters = self._waiters[lane]
+        if not waiters and self._allowed(lane):
+            self.free -= 1
+            return
+        fut = asyncio.get_event_loop().create_future()
+        waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(lane)
+            elif fut in waiters:
+                waiters.remove(fut)
+            raise
+
+    def release(self, lane):
+        self.free += 1
+        while True:
+            eligible = [l for l, w in self._waiters.items() if w and self._allowed(l)]
+            if not eligible:
+                return
+            total = 0
+            for l in eligible:
+                self._current[l] += self.weights[l]
+                total += self.weights[l]
+            chosen = max(eligible, key=self._current.get)
+            self._current[chosen] -= total
+            fut = self._waiters[chosen].popleft()
+            if not fut.done():
+                self.free -= 1
+                fut.set_result(None)
+
+class ProcessingEngine:
+    """Runs a handler over consumed records with bounded concurrency and per-key ordering.
+
+    Records sharing a key (conversation_id) are handled strictly one after another in
+    submission order; records with different keys run in parallel, capped globally by
+    max_concurrency. Every partition's unfinished work is counted: once it reaches
+    high_water the partition is paused through `pause`, and it is resumed through
+    `resume` when the count drains to low_water, so memory stays bounded however fast
+    Kafka can deliver. A record whose handler raises is finished through `on_failed`
+    (with the exception) instead of `on_done`, so its offset is never completed by
+    accident. With `lanes` ({lane: weight}, highest priority first) the slots
+    are shared between priority lanes by weight (see _LaneSlots).
+    """
+
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], max_concurrency: int = 200,
+                 high_water: int = 1000, low_water: int = 500,
+                 pause: Optional[Callable[[Hashable], None]] = None,
+                 resume: Optional[Callable[[Hashable], None]] = None,
+                 lanes: Optional[Dict[Hashable, int]] = None, reserved: int = 0):
+        self.handler = handler
+        self.max_concurrency = max_concurrency
+        self.high_water = high_water
+        self.low_water = min(low_water, high_water)
+        self._pause = pause
+        self._resume = resume
+        self._slots = _LaneSlots(max_concurrency, lanes or {None: 1}, reserved)
+        self._keys: Dict[Hashable, Deque[_Item]] = {}
+        self._pending: Dict[Hashable, int] = {}
+        self._paused = set()
+        self._tasks = set()
+        self._total = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def pending(self) -> int:
+        return self._total
+
+    def is_paused(self, partition) -> bool:
+        return partition in self._paused
+
+    def submit(self, partition, key, payload, on_done: Optional[Callable[[], None]] = None, lane=None,
+               on_failed: Optional[Callable[[Exception], None]] = None):
+        if lane not in self._slots.weights:
+            lane = self._slots.first
+        item = _Item(partition, payload, on_done, on_failed, lane)
+        count = self._pending.get(partition, 0) + 1
+        self._pending[partition] = count
+        self._total += 1
+        self._idle.clear()
+        ENGINE_PENDING.labels(job=JOB).inc()
+        if count >= self.high_water and partition not in self._paused:
+            self._set_paused(partition, True)
+
+        queue = self._keys.get(key)
+        if queue is not None:
+            queue.append(item)
+            return
+        self._keys[key] = deque([item])
+        task = asyncio.create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key):
+        queue = self._keys[key]
+        while queue:
+            item = queue[0]
+            waited = time.monotonic()
+            await self._slots.acquire(item.lane)
+            LANE_WAIT.labels(job=JOB, lane=item.lane or "default").observe(time.monotonic() - waited)
+            ENGINE_RUNNING.labels(job=JOB).inc()
+            error = None
+            try:
+                await self.handler(item.payload)
+            except Exception as e:
+                log.exception("message handler failed")
+                error = e
+            finally:
+                ENGINE_RUNNING.labels(job=JOB).dec()
+                self._slots.release(item.lane)
+            queue.popleft()
+            self._finish(item, error)
+        del self._keys[key]
+
+    def _finish(self, item: _Item, error: Optional[Exception] = None):
+        count = self._pending[item.partition] - 1
+        if count:
+            self._pending[item.partition] = count
+        else:
+            del self._pending[item.partition]
+        self._total -= 1
+        ENGINE_PENDING.labels(job=JOB).dec()
+        if item.partition in self._paused and count <= self.low_water:
+            self._set_paused(item.partition, False)
+        try:
+            if error is None:
+                if item.on_done is not None:
+                    item.on_done()
+            elif item.on_failed is not None:
+                item.on_failed(error)
+        except Exception:
+            log.exception("completion callback failed")
+        if not self._total:
+            self._idle.set()
+
+    def _set_paused(self, partition, paused: bool):
+        callback = self._pause if paused else self._resume
+        if paused:
+            self._paused.add(partition)
+            ENGINE_PAUSES.labels(job=JOB).inc()
+        else:
+            self._paused.discard(partition)
+        ENGINE_PAUSED_PARTITIONS.labels(job=JOB).set(len(self._paused))
+        if callback is not None:
+            try:
+                callback(partition)
+            except Exception as e:
+                # partition may have been revoked in the meantime
+                log.warning("could not %s partition %s: %s", "pause" if paused else "resume", partition, e)
+
+    def forget(self, partitions):
+        """Drop backpressure state for revoked partitions (their queued work still runs)."""
+        for partition in partitions:
+            self._paused.discard(partition)
+        ENGINE_PAUSED_PARTITIONS.labels(job=JOB).set(len(self._paused))
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every submitted record has finished; returns False on timeout."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 from aiokafka import AIOKafkaConsumer, AIOKafkaProducer
 
 class KafkaClient:
@@ -7,10 +8,21 @@ class KafkaClient:
         self.bootstrap = os.getenv("KAFKA_BOOTSTRAP", "localhost:9092")
         self.consumer = None
         self.producer = None
+        # producer batching: records linger briefly so per-recipient events share produce requests
+        self.linger_ms = int(os.getenv("KAFKA_LINGER_MS", "10"))
+        self.max_batch_bytes = int(os.getenv("KAFKA_MAX_BATCH_BYTES", "131072"))
+        self.compression = os.getenv("KAFKA_COMPRESSION") or None  # gzip, snappy, lz4, zstd
+        self.acks = os.getenv("KAFKA_ACKS", "1")
 
     async def start(self):
         # consumer created in WorkerConsumer to allow custom group_id and topics
-        self.producer = AIOKafkaProducer(bootstrap_servers=self.bootstrap)
+        self.producer = AIOKafkaProducer(
+            bootstrap_servers=self.bootstrap,
+            linger_ms=self.linger_ms,
+            max_batch_size=self.max_batch_bytes,
+            compression_type=self.compression,
+            acks="all" if self.acks == "all" else int(self.acks),
+        )
         await self.producer.start()
 
     async def stop(self):
@@ -22,17 +34,26 @@ class KafkaClient:
             self.consumer = None
 
     async def send(self, topic: str, key: str, value: dict):
+        await (await self.enqueue(topic, key, value))
+
+    async def enqueue(self, topic: str, key: str, value: dict) -> asyncio.Future:
+        """Buffer a record without waiting for the broker; returns its ack future."""
         if not self.producer:
             raise RuntimeError("Producer not started")
-        await self.producer.send_and_wait(topic, json.dumps(value).encode(), key=(key or "").encode())
+        return await self.producer.send(topic, json.dumps(value).encode(), key=(key or "").encode())
+
+    async def flush(self, futures):
+        """Wait for the acks of records buffered with enqueue()."""
+        if futures:
+            await asyncio.gather(*futures)
 
     # helper to create a consumer externally (used by WorkerConsumer)
-    def create_consumer(self, topics, group_id):
-        return AIOKafkaConsumer(
-            *topics,
-            loop=None,
+    def create_consumer(self, topics, group_id, enable_auto_commit=True, listener=None):
+        consumer = AIOKafkaConsumer(
             bootstrap_servers=self.bootstrap,
             group_id=group_id,
-            enable_auto_commit=True,
+            enable_auto_commit=enable_auto_commit,
             auto_offset_reset="earliest"
         )
+        consumer.subscribe(topics=list(topics), listener=listener)
+        return consumer
@@ -0,0 +1,82 @@
+import asyncio
+from typing import Callable, Optional
+from prometheus_client import Gauge
+
+JOB = "worker"
+# each partition is assigned to one process at a time, so under the supervisor the
+# per-process values add up to the group's lag and exited processes drop out
+CONSUMER_LAG = Gauge('worker_consumer_lag', 'Records between the log end offset and the next record not yet handled', ['job', 'topic', 'partition'],
+                     multiprocess_mode='livesum')
+FETCH_LAG = Gauge('worker_consumer_fetch_lag', 'Records between the log end offset and the consumer fetch position', ['job', 'topic', 'partition'],
+                  multiprocess_mode='livesum')
+
+class LagExporter:
+    """Periodically exports, for every assigned partition, how far the worker is behind the log end.
+
+    worker_consumer_lag counts from the point below which every record is handled: the
+    `watermark` callback (the OffsetTracker in manual commit mode) or else the group's
+    committed offset. Records fetched and still buffered in the engine count as lag
+    there; worker_consumer_fetch_lag only shows how far the fetcher itself is behind.
+    """
+
+    def __init__(self, consumer, interval: float = 15.0, watermark: Optional[Callable[[object], Optional[int]]] = None):
+        self.consumer = consumer
+        self.interval = interval
+        self.watermark = watermark
+        self.task = None
+        self._exported = set()
+
+    def start(self):
+        self.task = asyncio.create_task(self._run_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self._forget(self._exported)
+
+    async def _run_loop(self):
+        while True:
+            try:
+                await self.export_once()
+            except Exception as e:
+                print("consumer lag export failed", e)
+            await asyncio.sleep(self.interval)
+
+    async def _handled_up_to(self, tp, position: int) -> int:
+        offset = self.watermark(tp) if self.watermark else None
+        if offset is None:
+            offset = await self.consumer.committed(tp)
+        # nothing handled or committed yet: the fetch position is the best we know
+        return position if offset is None else offset
+
+    async def export_once(self):
+        assigned = set(self.consumer.assignment())
+        self._forget(self._exported - assigned)
+        if not assigned:
+            return
+        end_offsets = await self.consumer.end_offsets(list(assigned))
+        for tp in assigned:
+            try:
+                position = await self.consumer.position(tp)
+                handled = await self._handled_up_to(tp, position)
+            except Exception:
+                # revoked while we were looking
+                continue
+            labels = dict(job=JOB, topic=tp.topic, partition=str(tp.partition))
+            CONSUMER_LAG.labels(**labels).set(max(0, end_offsets[tp] - handled))
+            FETCH_LAG.labels(**labels).set(max(0, end_offsets[tp] - position))
+            self._exported.add(tp)
+
+    def _forget(self, partitions):
+        for tp in list(partitions):
+            for gauge in (CONSUMER_LAG, FETCH_LAG):
+                # in multiprocess mode remove() only warns and the value stays in this process's
+                # file, where livesum would add it to the new owner's lag; zero it first
+                gauge.labels(job=JOB, topic=tp.topic, partition=str(tp.partition)).set(0)
+                try:
+                    gauge.remove(JOB, tp.topic, str(tp.partition))
+                except KeyError:
+                    pass
+            self._exported.discard(tp)
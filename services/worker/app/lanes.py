@@ -0,0 +1,30 @@
+import os
+from typing import Dict, List, NamedTuple, Optional
+
+class Lane(NamedTuple):
+    name: str
+    topic: str
+    weight: int
+
+def parse_lanes(spec: str) -> List[Lane]:
+    """"interactive=incoming.messages:8,bulk=incoming.messages.bulk:1" -> [Lane, ...], highest priority first."""
+    lanes = []
+    for part in (p.strip() for p in spec.split(",")):
+        if not part:
+            continue
+        name, rest = part.split("=", 1)
+        topic, _, weight = rest.partition(":")
+        lanes.append(Lane(name.strip(), topic.strip(), int(weight or 1)))
+    return lanes
+
+# must match the api_frontend lane topics (services/api_frontend/app/lanes.py)
+LANES = parse_lanes(os.getenv(
+    "WORKER_LANES",
+    f"interactive={os.getenv('INCOMING_TOPIC', 'incoming.messages')}:8,bulk=incoming.messages.bulk:1",
+))
+TOPIC_LANES: Dict[str, str] = {lane.topic: lane.name for lane in LANES}
+LANE_TOPICS: Dict[str, str] = {lane.name: lane.topic for lane in LANES}
+
+def lane_topic(priority: Optional[str]) -> str:
+    """Incoming topic for a message's priority; unknown priorities use the first lane."""
+    return LANE_TOPICS.get(priority or "", LANES[0].topic)
@@ -1,19 +1,17 @@
 import asyncio
 import os
+import signal
 from .consumer import WorkerConsumer
 from .kafka_client import KafkaClient
+from .retry_scheduler import RetryScheduler
 from .db import init_db, close_db
 from aiohttp import ClientSession, web
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, Counter, Histogram
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
-# Prometheus metrics helpers for worker (counters/histogram)
-JOB = "worker"
-KAFKA_CONSUMED = Counter('kafka_consumed_messages_total', 'Consumed Kafka messages', ['job'])
-KAFKA_PRODUCED = Counter('kafka_produced_messages_total', 'Produced Kafka messages', ['job','topic'])
-WORKER_PROCESS_SECONDS = Histogram('worker_process_seconds', 'Worker processing time', ['job'])
-DEDUP_HITS = Counter('redis_dedup_hits_total', 'Dedup hits (redis)', ['job'])
+# worker metrics are defined next to the code that updates them (consumer, engine, ...)
 
 worker = None
+retry_scheduler = None
 kafka_client = None
 http_session = None
 
@@ -21,7 +19,7 @@ async def metrics_handler(request):
     return web.Response(body=generate_latest(), content_type=CONTENT_TYPE_LATEST)
 
 async def startup():
-    global worker, kafka_client, http_session
+    global worker, retry_scheduler, kafka_client, http_session
     os.environ.setdefault("KAFKA_BOOTSTRAP", "redpanda:9092")
     os.environ.setdefault("MONGO_URI", "mongodb://mongo:27017")
     os.environ.setdefault("REDIS_URI", "redis://redis:6379/0")
@@ -33,7 +31,13 @@ async def startup():
     # pass metric objects into WorkerConsumer via environment or direct import; our consumer imports same names
     worker = WorkerConsumer(kafka_client=kafka_client, http_session=http_session)
     await worker.start()
+    if os.getenv("RETRY_SCHEDULER_ENABLED", "1") == "1":
+        retry_scheduler = RetryScheduler(kafka_client)
+        await retry_scheduler.start()
 
+    # under the supervisor, children write multiprocess metric files and the supervisor serves /metrics
+    if os.getenv("WORKER_METRICS_SERVER", "1") != "1":
+        return
     # start a small aiohttp server to expose /metrics
     metrics_app = web.Application()
     metrics_app.router.add_get('/metrics', metrics_handler)
@@ -44,7 +48,9 @@ async def startup():
     print("Worker metrics server started on port", os.getenv("WORKER_METRICS_PORT", "8000"))
 
 async def shutdown():
-    global worker, kafka_client, http_session
+    global worker, retry_scheduler, kafka_client, http_session
+    if retry_scheduler:
+        await retry_scheduler.stop()
     if worker:
         await worker.stop()
     if kafka_client:
@@ -55,6 +61,8 @@ async def shutdown():
 
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()
+    # SIGTERM (docker stop, supervisor shutdown) drains in-flight messages and commits before exit
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
     try:
         loop.run_until_complete(startup())
         loop.run_forever()
@@ -0,0 +1,78 @@
+from collections import deque
+from typing import Deque, Dict, Hashable, Iterable, Set
+
+class _PartitionOffsets:
+    __slots__ = ("outstanding", "pending", "done", "watermark", "committed", "start", "highest")
+
+    def __init__(self):
+        self.outstanding: Deque[int] = deque()  # tracked offsets in consumption order
+        self.pending: Set[int] = set()
+        self.done: Set[int] = set()
+        self.watermark = None   # next offset to consume once everything below it is done
+        self.committed = None   # last watermark acknowledged by a commit
+        self.start = None       # first offset tracked since assignment
+        self.highest = None
+
+class OffsetTracker:
+    """Tracks, per partition, the offset below which every record has been handled.
+
+    Records complete out of order (different conversations run concurrently), so a
+    partition's commit point is the lowest offset still in progress, never simply the
+    latest completed one. Committing that watermark gives at-least-once delivery: a
+    crash replays only records that had not finished.
+    """
+
+    def __init__(self):
+        self._partitions: Dict[Hashable, _PartitionOffsets] = {}
+
+    def track(self, partition, offset: int):
+        state = self._partitions.get(partition)
+        if state is None:
+            state = self._partitions[partition] = _PartitionOffsets()
+        state.outstanding.append(offset)
+        state.pending.add(offset)
+        state.highest = offset
+        if state.start is None:
+            state.start = state.watermark = offset
+
+    def complete(self, partition, offset: int):
+        state = self._partitions.get(partition)
+        if state is None or offset not in state.pending:
+            # partition was revoked (or reassigned) since this record was handed out
+            return
+        state.pending.discard(offset)
+        state.done.add(offset)
+        while state.outstanding and state.outstanding[0] in state.done:
+            head = state.outstanding.popleft()
+            state.done.discard(head)
+            state.watermark = head + 1
+
+    def committable(self) -> Dict[Hashable, int]:
+        """Watermarks that moved since the last commit, as {partition: next offset}."""
+        return {
+            p: s.watermark for p, s in self._partitions.items()
+            if s.watermark is not None and s.watermark != (s.committed if s.committed is not None else s.start)
+        }
+
+    def mark_committed(self, offsets: Dict[Hashable, int]):
+        for partition, offset in offsets.items():
+            state = self._partitions.get(partition)
+            if state is not None:
+                state.committed = offset
+
+    def watermark(self, partition):
+        """Next offset to handle once everything before it is done, or None if nothing was tracked."""
+        state = self._partitions.get(partition)
+        return state.watermark if state is not None else None
+
+    def uncommitted_span(self, partition) -> int:
+        """How many offsets past the committed point this partition has been consumed."""
+        state = self._partitions.get(partition)
+        if state is None or state.highest is None:
+            return 0
+        base = state.committed if state.committed is not None else state.start
+        return state.highest + 1 - base
+
+    def revoke(self, partitions: Iterable[Hashable]):
+        for partition in partitions:
+            self._partitions.pop(partition, None)
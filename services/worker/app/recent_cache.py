@@ -0,0 +1,25 @@
+import os
+
+# Mirrors the key layout documented in services/api_frontend/app/recent_cache.py; keep them in sync.
+# Only records the state of messages that are still inside the cached window.
+_SET_STATE = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+  redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+  return 1
+end
+return 0
+"""
+
+RECENT_CACHE_ENABLED = os.getenv("RECENT_CACHE_ENABLED", "1") == "1"
+
+_script = None
+
+async def set_state(redis, conversation_id: str, message_id: str, state: str):
+    """Write a state change through to the api_frontend recent-message cache."""
+    global _script
+    if not RECENT_CACHE_ENABLED or not conversation_id:
+        return
+    if _script is None:
+        _script = redis.register_script(_SET_STATE)
+    base = f"conv:{{{conversation_id}}}:recent"
+    await _script(keys=[f"{base}:msgs", f"{base}:state"], args=[message_id, state])
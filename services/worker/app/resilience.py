@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+from prometheus_client import Counter, Gauge
+
+JOB = "worker"
+# every worker process has its own breaker and limiter per adapter: the node reports the
+# worst breaker state and the summed limit / in-flight count of its live processes
+BREAKER_STATE = Gauge('worker_adapter_breaker_state', 'Adapter circuit breaker state (0 closed, 1 half-open, 2 open)', ['job', 'adapter'],
+                      multiprocess_mode='livemax')
+BREAKER_REJECTED = Counter('worker_adapter_breaker_rejected_total', 'Adapter requests failed fast by an open breaker', ['job', 'adapter'])
+ADAPTER_LIMIT = Gauge('worker_adapter_concurrency_limit', 'Current adaptive concurrency limit per adapter', ['job', 'adapter'],
+                      multiprocess_mode='livesum')
+ADAPTER_IN_FLIGHT = Gauge('worker_adapter_in_flight', 'Adapter requests currently in flight', ['job', 'adapter'],
+                          multiprocess_mode='livesum')
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over consecutive failures of one adapter.
+
+    After failure_threshold failures in a row the breaker opens and every call fails
+    fast for open_seconds. It then lets half_open_probes requests through: one success
+    closes it again, one failure re-opens it for another open_seconds.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, open_seconds: float = 30.0,
+                 half_open_probes: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self._state = CLOSED
+        BREAKER_STATE.labels(job=JOB, adapter=name).set(0)
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self.clock() - self.opened_at >= self.open_seconds:
+            self._set_state(HALF_OPEN)
+        return self._state
+
+    def _set_state(self, state: str):
+        self._state = state
+        if state == OPEN:
+            self.opened_at = self.clock()
+        self.probes = 0
+        BREAKER_STATE.labels(job=JOB, adapter=self.name).set(_STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self.probes < self.half_open_probes:
+            self.probes += 1
+            return True
+        BREAKER_REJECTED.labels(job=JOB, adapter=self.name).inc()
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        if self._state != CLOSED:
+            self._set_state(CLOSED)
+
+    def record_cancelled(self):
+        # a probe that never got an answer must not keep the breaker half-open forever
+        if self._state == HALF_OPEN and self.probes:
+            self.probes -= 1
+
+    def record_failure(self):
+        self.failures += 1
+        if self._state == HALF_OPEN or (self._state == CLOSED and self.failures >= self.failure_threshold):
+            self._set_state(OPEN)
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for one adapter.
+
+    Every request that succeeds within latency_target grows the limit by 1/limit, so a
+    healthy adapter gains about one slot per limit's worth of requests. An error,
+    timeout or slow response multiplies it by backoff, at most once per cooldown so a
+    burst of failures from the same window counts as one signal.
+    """
+
+    def __init__(self, name: str, initial: int = 20, min_limit: int = 1, max_limit: int = 200,
+                 latency_target: float = 1.0, backoff: float = 0.5, cooldown: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.clock = clock
+        self.in_flight = 0
+        self._last_decrease = None
+        self._waiters: Deque[asyncio.Future] = deque()
+        ADAPTER_LIMIT.labels(job=JOB, adapter=name).set(self.limit)
+
+    async def acquire(self):
+        if self.in_flight >= int(self.limit) or self._waiters:
+            fut = asyncio.get_event_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # slot was handed to us after cancellation; pass it on
+                    self.in_flight -= 1
+                    self._wake()
+                elif fut in self._waiters:
+                    self._waiters.remove(fut)
+                raise
+        else:
+            self.in_flight += 1
+        ADAPTER_IN_FLIGHT.labels(job=JOB, adapter=self.name).set(self.in_flight)
+
+    def release(self, latency: float, ok: Optional[bool]):
+        """Return a slot; ok=None (cancelled request) leaves the limit unchanged."""
+        self.in_flight -= 1
+        if ok is None:
+            pass
+        elif ok and latency <= self.latency_target:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        else:
+            now = self.clock()
+            if self._last_decrease is None or now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+        ADAPTER_LIMIT.labels(job=JOB, adapter=self.name).set(self.limit)
+        ADAPTER_IN_FLIGHT.labels(job=JOB, adapter=self.name).set(self.in_flight)
+        self._wake()
+
+    def _wake(self):
+        # slots are handed over directly so a newcomer cannot overtake a waiter
+        while self._waiters and self.in_flight < int(self.limit):
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_flight += 1
+                fut.set_result(None)
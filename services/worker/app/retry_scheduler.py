@@ -0,0 +1,134 @@
+import asyncio
+import json
+import os
+import time
+from aiokafka import TopicPartition
+from prometheus_client import Counter, Histogram
+from .kafka_client import KafkaClient
+from .lanes import lane_topic
+
+JOB = "worker"
+RETRY_SCHEDULED = Counter('worker_retry_scheduled_total', 'Deliveries parked on a delay tier', ['job', 'tier'])
+RETRY_REINJECTED = Counter('worker_retry_reinjected_total', 'Delayed deliveries re-injected into their lane topic', ['job', 'tier'])
+RETRY_DELAY_SKEW = Histogram('worker_retry_delay_skew_seconds', 'How late a delayed delivery was re-injected', ['job'],
+                             buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+def parse_tiers(spec: str):
+    """"5s,30s,5m" -> [("retry.5s", 5.0), ("retry.30s", 30.0), ("retry.5m", 300.0)]"""
+    tiers = []
+    for label in (p.strip() for p in spec.split(",")):
+        if not label:
+            continue
+        unit = label[-1]
+        seconds = float(label[:-1]) * _UNITS[unit] if unit in _UNITS else float(label)
+        tiers.append((f"retry.{label}", seconds))
+    return tiers
+
+RETRY_TIERS = parse_tiers(os.getenv("RETRY_TIERS", "5s,30s,5m"))
+
+def tier_for_attempt(attempt: int):
+    """Tier used for the n-th retry (1-based); attempts past the last tier stay on it."""
+    return RETRY_TIERS[min(attempt, len(RETRY_TIERS)) - 1]
+
+class RetryScheduler:
+    """Re-injects parked deliveries from the delay-tier topics once they are due.
+
+    Every tier has a fixed delay, so records in a tier partition are already ordered by
+    due time: the scheduler only has to look at the head of each partition. A partition
+    whose head is not due yet is rewound to that record and paused until the due time,
+    so waiting costs no memory and no polling, and a restart resumes from the last
+    committed record.
+    """
+
+    def __init__(self, kafka_client: KafkaClient):
+        self.kafka_client = kafka_client
+        self.group_id = os.getenv("RETRY_SCHEDULER_GROUP_ID", "chat4all-retry-scheduler")
+        self.max_records = int(os.getenv("RETRY_SCHEDULER_MAX_RECORDS", "500"))
+        self.consumer = None
+        self.task = None
+        self._timers = {}
+
+    async def start(self):
+        topics = [topic for topic, _ in RETRY_TIERS]
+        self.consumer = self.kafka_client.create_consumer(topics, group_id=self.group_id, enable_auto_commit=False)
+        await self.consumer.start()
+        self.task = asyncio.create_task(self._run_loop())
+        print("RetryScheduler started on", ", ".join(topics))
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if self.consumer:
+            await self.consumer.stop()
+            self.consumer = None
+
+    def _resume_later(self, tp: TopicPartition, delay: float):
+        def resume():
+            self._timers.pop(tp, None)
+            if self.consumer and tp in self.consumer.assignment():
+                self.consumer.resume(tp)
+        if tp in self._timers:
+            self._timers[tp].cancel()
+        self._timers[tp] = asyncio.get_event_loop().call_later(delay, resume)
+
+    async def _run_loop(self):
+        backoff = 1.0
+        while True:
+            try:
+                await self.run_once()
+                backoff = 1.0
+            except Exception as e:
+                # keep the task alive: a dead loop would leave every parked retry stranded
+                print(f"retry scheduler batch failed, retrying in {backoff:.0f}s", e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    async def run_once(self):
+        batches = await self.consumer.getmany(timeout_ms=1000, max_records=self.max_records)
+        if not batches:
+            return
+        try:
+            await self._reinject(batches)
+        except Exception:
+            # the position already moved past this batch; rewind so nothing is skipped
+            # (records re-injected before the failure go out again: at-least-once)
+            for tp, records in batches.items():
+                if records and tp in self.consumer.assignment():
+                    self.consumer.seek(tp, records[0].offset)
+            raise
+
+    async def _reinject(self, batches):
+        now = time.time()
+        sends = []
+        commits = {}
+        for tp, records in batches.items():
+            for record in records:
+                try:
+                    parked = json.loads(record.value.decode())
+                except Exception as e:
+                    print("invalid retry record", e)
+                    commits[tp] = record.offset + 1
+                    continue
+                due_at = parked.get("due_at", 0)
+                if due_at > now:
+                    # head of this partition is not due: rewind to it and sleep on the partition
+                    self.consumer.seek(tp, record.offset)
+                    self.consumer.pause(tp)
+                    self._resume_later(tp, due_at - now)
+                    break
+                message = parked["message"]
+                # back onto the lane it came from, so bulk retries do not jump the interactive queue
+                topic = lane_topic(message.get("priority"))
+                sends.append(await self.kafka_client.enqueue(topic, key=message.get("conversation_id") or "", value=message))
+                RETRY_REINJECTED.labels(job=JOB, tier=tp.topic).inc()
+                RETRY_DELAY_SKEW.labels(job=JOB).observe(now - due_at)
+                commits[tp] = record.offset + 1
+        await self.kafka_client.flush(sends)
+        if commits:
+            await self.consumer.commit(commits)
@@ -0,0 +1,161 @@
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional
+from prometheus_client import Counter, Gauge
+
+JOB = "worker"
+# per-process values under the supervisor: outstanding requests add up, an endpoint counts
+# as ejected while any live process has ejected it
+ENDPOINT_OUTSTANDING = Gauge('worker_adapter_endpoint_outstanding', 'Requests in flight per adapter endpoint', ['job', 'endpoint'],
+                             multiprocess_mode='livesum')
+ENDPOINT_EJECTED = Gauge('worker_adapter_endpoint_ejected', 'Whether an adapter endpoint is ejected from balancing (1) or not (0)', ['job', 'endpoint'],
+                         multiprocess_mode='livemax')
+ROUTES_RELOADS = Counter('worker_adapter_routes_reloads_total', 'Adapter routing table reloads', ['job', 'result'])
+
+# Routing config (ADAPTER_ROUTES_FILE), e.g.
+# {
+#   "channels": {"whatsapp": ["http://connector_whatsapp:8000", "http://connector_whatsapp_2:8000"],
+#                "default": ["http://connector_mock:8000"]},
+#   "prefixes": {"wa_": "whatsapp", "tg_": "telegram"}
+# }
+# A recipient goes to the channel of its longest matching prefix, or "default".
+DEFAULT_ROUTES = {
+    "channels": {
+        "whatsapp": ["http://connector_whatsapp:8000"],
+        "telegram": ["http://connector_telegram:8000"],
+        "instagram": ["http://connector_instagram:8000"],
+        "default": ["http://connector_mock:8000"],
+    },
+    "prefixes": {"wa_": "whatsapp", "tg_": "telegram", "ig_": "instagram"},
+}
+
+class Endpoint:
+    __slots__ = ("url", "outstanding", "failures", "ejected_until")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+class RoutingTable:
+    """Maps recipients to channels and channels to a balanced set of adapter endpoints.
+
+    Prefix rules are stored per prefix length, so a lookup is one dict probe per
+    distinct length (a handful) whatever the number of rules. Each channel picks the
+    endpoint with the fewest outstanding requests among those that are healthy: not
+    ejected after eject_failures consecutive failures, and not behind an open breaker
+    (is_open). When every endpoint is unhealthy the least loaded one is used anyway so
+    its breaker can probe. The config file is re-read when its mtime changes, checked
+    at most every reload_interval seconds; endpoint state survives reloads.
+    """
+
+    def __init__(self, path: Optional[str] = None, reload_interval: float = 5.0,
+                 eject_failures: int = 3, eject_seconds: float = 30.0,
+                 is_open: Optional[Callable[[str], bool]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.is_open = is_open
+        self.clock = clock
+        self._mtime = None
+        self._checked_at = clock()
+        self._endpoints: Dict[str, Endpoint] = {}
+        self._channels: Dict[str, List[Endpoint]] = {}
+        self._prefixes: Dict[int, Dict[str, str]] = {}
+        self._lengths: List[int] = []
+        self.apply(self._read() if path else DEFAULT_ROUTES)
+
+    def _read(self) -> dict:
+        self._mtime = os.stat(self.path).st_mtime
+        with open(self.path) as f:
+            return json.load(f)
+
+    def apply(self, config: dict):
+        channels = config.get("channels") or {}
+        if not channels.get("default"):
+            raise ValueError("routing config needs a non-empty 'default' channel")
+        table = {}
+        for channel, urls in channels.items():
+            if isinstance(urls, str):
+                urls = [urls]
+            table[channel] = [self._endpoints.get(u) or self._endpoints.setdefault(u, Endpoint(u)) for u in urls]
+        prefixes = {}
+        for prefix, channel in (config.get("prefixes") or {}).items():
+            if channel not in table:
+                raise ValueError(f"prefix {prefix!r} routes to unknown channel {channel!r}")
+            prefixes.setdefault(len(prefix), {})[prefix] = channel
+        self._channels = table
+        self._prefixes = prefixes
+        self._lengths = sorted(prefixes, reverse=True)
+
+    def maybe_reload(self):
+        if not self.path:
+            return
+        now = self.clock()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            if os.stat(self.path).st_mtime == self._mtime:
+                return
+            self.apply(self._read())
+            ROUTES_RELOADS.labels(job=JOB, result="ok").inc()
+            print("adapter routes reloaded from", self.path)
+        except Exception as e:
+            # keep serving the previous table until the file is fixed
+            ROUTES_RELOADS.labels(job=JOB, result="error").inc()
+            print("adapter routes reload failed", e)
+
+    def channel_for(self, channel_hint: Optional[str], recipient_id: str) -> str:
+        self.maybe_reload()
+        if channel_hint and channel_hint in self._channels:
+            return channel_hint
+        for length in self._lengths:
+            channel = self._prefixes[length].get(recipient_id[:length])
+            if channel is not None:
+                return channel
+        return "default"
+
+    def _healthy(self, endpoint: Endpoint, now: float) -> bool:
+        if endpoint.ejected_until > now:
+            return False
+        return not (self.is_open and self.is_open(endpoint.url))
+
+    def pick(self, channel: str) -> str:
+        endpoints = self._channels.get(channel) or self._channels["default"]
+        if len(endpoints) == 1:
+            return endpoints[0].url
+        now = self.clock()
+        healthy = [e for e in endpoints if self._healthy(e, now)]
+        return min(healthy or endpoints, key=lambda e: e.outstanding).url
+
+    def started(self, url: str):
+        endpoint = self._endpoints.get(url)
+        if endpoint is not None:
+            endpoint.outstanding += 1
+            ENDPOINT_OUTSTANDING.labels(job=JOB, endpoint=url).set(endpoint.outstanding)
+
+    def finished(self, url: str, ok: Optional[bool]):
+        """ok=False counts towards ejection, ok=None (cancelled) only frees the slot."""
+        endpoint = self._endpoints.get(url)
+        if endpoint is None:
+            return
+        endpoint.outstanding -= 1
+        ENDPOINT_OUTSTANDING.labels(job=JOB, endpoint=url).set(endpoint.outstanding)
+        if ok is None:
+            return
+        if ok:
+            endpoint.failures = 0
+            if endpoint.ejected_until:
+                endpoint.ejected_until = 0.0
+                ENDPOINT_EJECTED.labels(job=JOB, endpoint=url).set(0)
+            return
+        endpoint.failures += 1
+        if endpoint.failures >= self.eject_failures:
+            endpoint.failures = 0
+            endpoint.ejected_until = self.clock() + self.eject_seconds
+            ENDPOINT_EJECTED.labels(job=JOB, endpoint=url).set(1)
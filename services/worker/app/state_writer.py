@@ -0,0 +1,161 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+from pymongo import UpdateOne
+from prometheus_client import Counter, Histogram
+from . import db
+
+JOB = "worker"
+STATE_FLUSH_SECONDS = Histogram('worker_state_flush_seconds', 'Latency of one state bulk_write', ['job'],
+                                buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+STATE_FLUSH_BATCH = Histogram('worker_state_flush_batch_size', 'Documents per state bulk_write', ['job'],
+                              buckets=(1, 10, 50, 100, 250, 500, 1000, 2500))
+STATE_UPDATES_MERGED = Counter('worker_state_updates_merged_total', 'State updates folded into a pending update for the same message', ['job'])
+STATE_FLUSH_ERRORS = Counter('worker_state_flush_errors_total', 'Failed state bulk_writes', ['job'])
+STATE_UPDATES_DROPPED = Counter('worker_state_updates_dropped_total', 'State updates given up after every flush attempt failed', ['job'])
+
+class _PendingUpdate:
+    __slots__ = ("set_fields", "add_to_set", "waiters", "attempts")
+
+    def __init__(self):
+        self.set_fields: Dict = {}
+        self.add_to_set: Dict[str, List] = {}
+        self.waiters: List[asyncio.Future] = []
+        self.attempts = 0
+
+    def merge(self, set_fields: Dict, add_to_set: Optional[Dict[str, List]]):
+        # later $set values supersede earlier ones (PROCESSING -> DELIVERED collapses to one write)
+        self.set_fields.update(set_fields)
+        for field, values in (add_to_set or {}).items():
+            current = self.add_to_set.setdefault(field, [])
+            current.extend(v for v in values if v not in current)
+
+    def to_update(self) -> Dict:
+        update = {"$set": self.set_fields}
+        if self.add_to_set:
+            update["$addToSet"] = {f: {"$each": v} for f, v in self.add_to_set.items()}
+        return update
+
+class StateWriter:
+    """Buffers message state updates per message_id and writes them with unordered bulk_writes.
+
+    Updates for the same message merge while they wait, so a message that finishes
+    within one flush window costs a single document write. A buffer is flushed when it
+    reaches max_batch documents or flush_interval seconds after its first update,
+    whichever comes first. Flushes run one at a time, so updates for one message reach
+    Mongo in the order they were made.
+
+    When a bulk_write fails its updates go back into the buffer, under any newer
+    update for the same message, and the next flush is delayed with exponential
+    backoff. Their futures fail only after max_attempts failed flushes.
+    """
+
+    def __init__(self, max_batch: int = 500, flush_interval: float = 0.05,
+                 max_attempts: int = 5, retry_backoff: float = 0.2, max_backoff: float = 5.0):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self._failed_flushes = 0
+        self._buffer: Dict[str, _PendingUpdate] = {}
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task = None
+
+    def update(self, message_id: str, set_fields: Dict, add_to_set: Optional[Dict[str, List]] = None) -> asyncio.Future:
+        """Queue an upsert for message_id; the returned future resolves once it is in Mongo."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_loop())
+        pending = self._buffer.get(message_id)
+        if pending is None:
+            pending = self._buffer[message_id] = _PendingUpdate()
+        else:
+            STATE_UPDATES_MERGED.labels(job=JOB).inc()
+        pending.merge(set_fields, add_to_set)
+        fut = asyncio.get_event_loop().create_future()
+        # callers may fire and forget; mark failures as retrieved so they are not reported twice
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        pending.waiters.append(fut)
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+        return fut
+
+    async def _run_loop(self):
+        while not self._closing:
+            if not self._buffer:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if len(self._buffer) < self.max_batch:
+                # let the batch fill up for one interval unless it is already full
+                try:
+                    self._wakeup.clear()
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+            if self._failed_flushes:
+                await asyncio.sleep(min(self.max_backoff, self.retry_backoff * 2 ** (self._failed_flushes - 1)))
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, {}
+        ops = [UpdateOne({"message_id": mid}, p.to_update(), upsert=True) for mid, p in batch.items()]
+        start = time.time()
+        error = None
+        try:
+            await db.messages_collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            error = e
+            STATE_FLUSH_ERRORS.labels(job=JOB).inc()
+            print("state bulk_write failed", e)
+        STATE_FLUSH_SECONDS.labels(job=JOB).observe(time.time() - start)
+        STATE_FLUSH_BATCH.labels(job=JOB).observe(len(ops))
+        if error is None:
+            self._failed_flushes = 0
+            for pending in batch.values():
+                self._settle(pending, None)
+            return
+        self._failed_flushes += 1
+        # $set/$addToSet are idempotent, so re-writing the part of an unordered batch that did land is harmless
+        for mid, pending in batch.items():
+            pending.attempts += 1
+            if pending.attempts >= self.max_attempts:
+                STATE_UPDATES_DROPPED.labels(job=JOB).inc()
+                self._settle(pending, error)
+            else:
+                self._requeue(mid, pending)
+
+    def _requeue(self, message_id: str, pending: _PendingUpdate):
+        # updates made while the failed write was in flight are newer and win
+        newer = self._buffer.get(message_id)
+        if newer is not None:
+            pending.merge(newer.set_fields, newer.add_to_set)
+            pending.waiters.extend(newer.waiters)
+        self._buffer[message_id] = pending
+
+    @staticmethod
+    def _settle(pending: _PendingUpdate, error: Optional[Exception]):
+        for fut in pending.waiters:
+            if fut.done():
+                continue
+            if error is None:
+                fut.set_result(None)
+            else:
+                fut.set_exception(error)
+
+    async def stop(self):
+        # let an in-progress flush finish, then write whatever is left
+        self._closing = True
+        self._wakeup.set()
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        # whatever a failing final flush put back cannot wait for another round
+        leftover, self._buffer = self._buffer, {}
+        for pending in leftover.values():
+            self._settle(pending, RuntimeError("state writer stopped before the update was written"))
+        self._closing = False
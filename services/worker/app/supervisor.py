@@ -0,0 +1,114 @@
+"""Runs N worker processes on one node and serves their metrics on a single port.
+
+    python -m app.supervisor
+
+Every child is a normal `python -m app.main` in the same consumer group, so Kafka
+spreads the partitions across them. Children write Prometheus multiprocess files
+into PROMETHEUS_MULTIPROC_DIR and the supervisor aggregates them on
+WORKER_METRICS_PORT. A child that dies is restarted with exponential backoff. On
+SIGTERM/SIGINT the children are asked to stop (each drains its in-flight messages and
+commits offsets) and are killed only after WORKER_SUPERVISOR_GRACE seconds.
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+class _Child:
+    __slots__ = ("slot", "proc", "started_at", "backoff", "restart_at")
+
+    def __init__(self, slot: int):
+        self.slot = slot
+        self.proc = None
+        self.started_at = 0.0
+        self.backoff = 1.0
+        self.restart_at = 0.0
+
+class Supervisor:
+    def __init__(self):
+        self.processes = int(os.getenv("WORKER_PROCESSES", "0")) or os.cpu_count() or 1
+        self.metrics_port = int(os.getenv("WORKER_METRICS_PORT", "8000"))
+        self.grace = float(os.getenv("WORKER_SUPERVISOR_GRACE", "45"))
+        self.max_backoff = float(os.getenv("WORKER_RESTART_MAX_BACKOFF", "30"))
+        self.children = [_Child(i) for i in range(self.processes)]
+        self.stopping = False
+        self.metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR") or tempfile.mkdtemp(prefix="worker-metrics-")
+
+    def _prepare_metrics_dir(self):
+        # files left by a previous run would be summed into the new one
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        os.makedirs(self.metrics_dir)
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = self.metrics_dir
+
+    def _serve_metrics(self):
+        # imported after PROMETHEUS_MULTIPROC_DIR is set, as prometheus_client requires
+        from prometheus_client import CollectorRegistry, start_http_server
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(self.metrics_port, registry=registry)
+        print("Supervisor metrics server started on port", self.metrics_port)
+
+    def _spawn(self, child: _Child):
+        env = dict(os.environ, WORKER_METRICS_SERVER="0", WORKER_PROCESS_SLOT=str(child.slot))
+        child.proc = subprocess.Popen([sys.executable, "-u", "-m", "app.main"], env=env)
+        child.started_at = time.monotonic()
+        print(f"worker slot {child.slot} started (pid {child.proc.pid})")
+
+    def _reap(self, child: _Child):
+        from prometheus_client import multiprocess
+        code = child.proc.returncode
+        multiprocess.mark_process_dead(child.proc.pid)
+        child.proc = None
+        if self.stopping:
+            return
+        # a child that ran for a while gets a fresh backoff; crash loops slow down
+        if time.monotonic() - child.started_at > 60:
+            child.backoff = 1.0
+        child.restart_at = time.monotonic() + child.backoff
+        print(f"worker slot {child.slot} exited with {code}, restarting in {child.backoff:.0f}s")
+        child.backoff = min(child.backoff * 2, self.max_backoff)
+
+    def _stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        print("supervisor stopping, draining workers")
+        for child in self.children:
+            if child.proc and child.proc.poll() is None:
+                child.proc.send_signal(signal.SIGTERM)
+
+    def run(self):
+        self._prepare_metrics_dir()
+        self._serve_metrics()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for child in self.children:
+            self._spawn(child)
+
+        while not self.stopping:
+            now = time.monotonic()
+            for child in self.children:
+                if child.proc is not None and child.proc.poll() is not None:
+                    self._reap(child)
+                if child.proc is None and not self.stopping and now >= child.restart_at:
+                    self._spawn(child)
+            time.sleep(0.5)
+
+        deadline = time.monotonic() + self.grace
+        for child in self.children:
+            if child.proc is None:
+                continue
+            try:
+                child.proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                print(f"worker slot {child.slot} did not drain in time, killing it")
+                child.proc.kill()
+                child.proc.wait()
+            self._reap(child)
+
+if __name__ == "__main__":
+    Supervisor().run()
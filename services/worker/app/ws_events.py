@@ -0,0 +1,23 @@
+import json
+import time
+
+# Mirrors the key layout of services/api_frontend/app/ws_cluster.py; keep them in sync.
+PRESENCE_KEY = "ws:presence:{}"
+NODE_CHANNEL = "ws:node:{}"
+
+async def publish_user_event(redis, user_id: str, message: str) -> int:
+    """Push a WebSocket event to every api_frontend node currently holding user_id.
+
+    Returns the number of nodes the event was routed to (0 when the user is offline).
+    """
+    if not user_id:
+        return 0
+    nodes = await redis.zrangebyscore(PRESENCE_KEY.format(user_id), time.time(), "+inf")
+    if not nodes:
+        return 0
+    payload = json.dumps({"user_id": user_id, "message": message})
+    pipe = redis.pipeline(transaction=False)
+    for node in nodes:
+        pipe.publish(NODE_CHANNEL.format(node), payload)
+    await pipe.execute()
+    return len(nodes)
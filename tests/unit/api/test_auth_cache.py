@@ -0,0 +1,84 @@
+import math
+import time
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from api_frontend.app import auth
+
+
+def test_token_cache_expires_and_evicts_lru():
+    cache = auth.VerifiedTokenCache(max_size=2)
+    cache.put("a", "alice", exp=100, now=0)
+    cache.put("b", "bob", exp=100, now=0)
+    assert cache.get("a", now=1) == "alice"
+    cache.put("c", "carol", exp=100, now=1)
+    # "b" was least recently used
+    assert cache.get("b", now=1) is None
+    assert cache.get("a", now=1) == "alice"
+    assert cache.get("a", now=100) is None
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_uses_cache_and_revocations(monkeypatch):
+    calls = []
+    real_decode = auth.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(True)
+        return real_decode(*args, **kwargs)
+
+    monkeypatch.setattr(auth, "_token_cache", auth.VerifiedTokenCache(max_size=10))
+    monkeypatch.setattr(auth.jwt, "decode", counting_decode)
+    token = auth.create_jwt("u1")
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    assert await auth.get_current_user(creds) == "u1"
+    assert await auth.get_current_user(creds) == "u1"
+    assert len(calls) == 1
+
+    monkeypatch.setattr(auth.revocation_list, "revoked", {auth.token_digest(token)})
+    with pytest.raises(HTTPException):
+        await auth.get_current_user(creds)
+
+
+class FakeRevocationRedis:
+    def __init__(self):
+        self.zset = {}
+        self.version = 0
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def zadd(self, key, mapping):
+        self.zset.update(mapping)
+
+    def incr(self, key):
+        self.version += 1
+
+    async def execute(self):
+        pass
+
+    async def get(self, key):
+        return self.version
+
+    async def zremrangebyscore(self, key, low, high):
+        for digest in [d for d, score in self.zset.items() if score <= high]:
+            del self.zset[digest]
+
+    async def zrangebyscore(self, key, low, high):
+        return [d for d, score in self.zset.items() if score >= low]
+
+
+@pytest.mark.asyncio
+async def test_revocation_of_a_token_without_exp_never_ages_out(monkeypatch):
+    redis = FakeRevocationRedis()
+    token = auth.jwt.encode({"sub": "u1"}, auth._signing_key, algorithm=auth._algo)
+    await auth.revoke_token(redis, token)
+    assert redis.zset[auth.token_digest(token)] == math.inf
+
+    revocations = auth.RevocationList()
+    revocations.redis = redis
+    years_later = time.time() + 10 * 365 * 86400
+    monkeypatch.setattr(auth.time, "time", lambda: years_later)
+    await revocations.refresh()
+    assert auth.token_digest(token) in revocations.revoked
@@ -0,0 +1,73 @@
+import pytest
+from api_frontend.app import history
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        for key, direction in reversed(keys):
+            self.docs.sort(key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, n):
+        return self.docs[:n]
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection):
+        def match(d):
+            if d["conversation_id"] != query["conversation_id"]:
+                return False
+            if "state" in query and d.get("state") == query["state"]["$ne"]:
+                return False
+            if "$or" not in query:
+                return True
+            older, same = query["$or"]
+            return d["created_at"] < older["created_at"]["$lt"] or (
+                d["created_at"] == same["created_at"] and d["message_id"] < same["message_id"]["$lt"])
+        return FakeCursor([d for d in self.docs if match(d)])
+
+
+def test_cursor_round_trip():
+    cursor = history.encode_cursor({"created_at": 12.5, "message_id": "m-1"})
+    assert history.decode_cursor(cursor) == (12.5, "m-1")
+    with pytest.raises(history.InvalidCursor):
+        history.decode_cursor("not-a-cursor")
+
+
+@pytest.mark.asyncio
+async def test_fetch_page_walks_backwards(monkeypatch):
+    docs = [{"conversation_id": "c1", "created_at": float(i // 2), "message_id": f"m{i}"} for i in range(5)]
+    monkeypatch.setattr("api_frontend.app.db.messages_collection", FakeCollection(docs))
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = await history.fetch_page("c1", 2, cursor)
+        seen.extend(m["message_id"] for m in page)
+        if not cursor:
+            break
+    assert seen == ["m4", "m3", "m2", "m1", "m0"]
+
+
+@pytest.mark.asyncio
+async def test_fetch_page_hides_scheduled_messages(monkeypatch):
+    docs = [
+        {"conversation_id": "c1", "created_at": 1.0, "message_id": "m-1", "state": "DELIVERED"},
+        {"conversation_id": "c1", "created_at": 2.0, "message_id": "m-2", "state": "SCHEDULED"},
+        {"conversation_id": "c1", "created_at": 3.0, "message_id": "m-3", "state": "SENT"},
+    ]
+    monkeypatch.setattr(history.db, "messages_collection", FakeCollection(docs), raising=False)
+
+    page, cursor = await history.fetch_page("c1", 10)
+    assert [d["message_id"] for d in page] == ["m-3", "m-1"]
+    assert cursor is None
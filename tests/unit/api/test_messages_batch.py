@@ -0,0 +1,102 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+from api_frontend.app.main import app
+from api_frontend.app.auth import get_current_user
+
+
+class FakePipeline:
+    def __init__(self, store):
+        self.store = store
+        self.ops = []
+
+    def set(self, key, value, ex=None, nx=False):
+        self.ops.append(("set", key))
+
+    def delete(self, key):
+        self.ops.append(("delete", key))
+
+    async def execute(self):
+        results = []
+        for op, key in self.ops:
+            if op == "delete":
+                results.append(int(self.store.pop(key, None) is not None))
+            elif key in self.store:
+                results.append(None)
+            else:
+                self.store[key] = "1"
+                results.append(True)
+        return results
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {"dedup:m-dup": "1"}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.store)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_many(self, docs, ordered=True):
+        self.docs.extend(docs)
+
+
+@pytest.mark.asyncio
+async def test_send_message_batch(monkeypatch):
+    produced = []
+
+    async def mock_send_batch(topic, records, **kwargs):
+        assert topic == "incoming.messages"
+        produced.extend(records)
+
+    collection = FakeCollection()
+    monkeypatch.setattr("api_frontend.app.db.redis", FakeRedis())
+    monkeypatch.setattr("api_frontend.app.db.messages_collection", collection)
+    monkeypatch.setattr("api_frontend.app.kafka_producer.kafka_producer.send_batch", mock_send_batch)
+    app.dependency_overrides[get_current_user] = lambda: "u1"
+
+    item = {"conversation_id": "conv1", "sender_id": "u1", "recipient_ids": ["u2"], "content": "hello"}
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            r = await ac.post("/v1/messages:batch", json={"messages": [
+                {**item, "message_id": "m-1"},
+                {**item, "message_id": "m-dup"},
+                {**item, "message_id": "m-1"},
+            ]})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert r.status_code == 200
+    results = r.json()["results"]
+    assert [x["accepted"] for x in results] == [True, False, False]
+    assert [x["duplicate"] for x in results] == [False, True, True]
+    assert len(collection.docs) == 1
+    assert len(produced) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_releases_its_dedup_keys(monkeypatch):
+    async def broker_down(topic, records, **kwargs):
+        raise ConnectionError("broker down")
+
+    redis = FakeRedis()
+    monkeypatch.setattr("api_frontend.app.db.redis", redis)
+    monkeypatch.setattr("api_frontend.app.db.messages_collection", FakeCollection())
+    monkeypatch.setattr("api_frontend.app.kafka_producer.kafka_producer.send_batch", broker_down)
+    app.dependency_overrides[get_current_user] = lambda: "u1"
+
+    item = {"conversation_id": "conv1", "sender_id": "u1", "recipient_ids": ["u2"], "content": "hello"}
+    batch = {"messages": [{**item, "message_id": "m-1"}, {**item, "message_id": "m-2"}, {**item, "message_id": "m-dup"}]}
+    transport = ASGITransport(app=app, raise_app_exceptions=False)
+    try:
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            r = await ac.post("/v1/messages:batch", json=batch)
+    finally:
+        app.dependency_overrides.clear()
+
+    assert r.status_code == 500
+    # the retry can claim m-1 and m-2 again; the key this request did not set is left alone
+    assert redis.store == {"dedup:m-dup": "1"}
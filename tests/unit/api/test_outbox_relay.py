@@ -0,0 +1,146 @@
+import pytest
+from api_frontend.app import outbox_relay as relay_mod
+from api_frontend.app.outbox_relay import OutboxRelay
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(_matches(doc, q) for q in cond):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(cond, dict):
+            if "$in" in cond and value not in cond["$in"]:
+                return False
+            if "$exists" in cond and (key in doc) != cond["$exists"]:
+                return False
+            if "$lt" in cond and not (key in doc and value < cond["$lt"]):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs.sort(key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, n):
+        return self.docs[:n]
+
+
+class FakeResult:
+    def __init__(self, modified_count):
+        self.modified_count = modified_count
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.before_update = None
+
+    def find(self, query, projection):
+        return FakeCursor([dict(d) for d in self.docs if _matches(d, query)])
+
+    async def update_many(self, query, update):
+        if self.before_update:
+            hook, self.before_update = self.before_update, None
+            hook()
+        hit = [d for d in self.docs if _matches(d, query)]
+        for d in hit:
+            d.update(update.get("$set", {}))
+            for key in update.get("$unset", {}):
+                d.pop(key, None)
+        return FakeResult(len(hit))
+
+
+class FakeProducer:
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+
+    async def send_batch(self, topic, records, wait=False):
+        if self.error:
+            raise self.error
+        self.sent.append((topic, [r[1]["message_id"] for r in records]))
+
+
+def _row(i, **extra):
+    return {"_id": i, "message_id": f"m-{i}", "conversation_id": "c1", "created_at": float(i),
+            "priority": "interactive", "outbox": "PENDING", **extra}
+
+
+@pytest.fixture
+def relay(monkeypatch):
+    monkeypatch.setattr(relay_mod.time, "time", lambda: 1000.0)
+    r = OutboxRelay()
+    r.relay_id = "relay-a"
+    return r
+
+
+@pytest.mark.asyncio
+async def test_publishes_claimable_rows_and_skips_live_leases(monkeypatch, relay):
+    coll = FakeCollection([
+        _row(1),
+        _row(2, outbox_owner="relay-b", outbox_lease_until=1010.0),
+        _row(3, outbox_owner="relay-b", outbox_lease_until=990.0),
+        _row(4, outbox="SENT"),
+    ])
+    producer = FakeProducer()
+    monkeypatch.setattr(relay_mod.db, "messages_collection", coll, raising=False)
+    monkeypatch.setattr(relay_mod, "kafka_producer", producer)
+
+    assert await relay.run_once("interactive") == 2
+    assert [ids for _, ids in producer.sent] == [["m-1", "m-3"]]
+    by_id = {d["_id"]: d for d in coll.docs}
+    for i in (1, 3):
+        assert by_id[i]["outbox"] == "SENT"
+        assert "outbox_owner" not in by_id[i] and "outbox_lease_until" not in by_id[i]
+    assert by_id[2]["outbox"] == "PENDING" and by_id[2]["outbox_owner"] == "relay-b"
+
+
+@pytest.mark.asyncio
+async def test_rows_taken_by_another_relay_are_not_published(monkeypatch, relay):
+    coll = FakeCollection([_row(1), _row(2)])
+    producer = FakeProducer()
+    monkeypatch.setattr(relay_mod.db, "messages_collection", coll, raising=False)
+    monkeypatch.setattr(relay_mod, "kafka_producer", producer)
+
+    def steal():
+        coll.docs[0].update(outbox_owner="relay-b", outbox_lease_until=1030.0)
+    coll.before_update = steal
+
+    assert await relay.run_once("interactive") == 1
+    assert [ids for _, ids in producer.sent] == [["m-2"]]
+    assert coll.docs[0]["outbox"] == "PENDING" and coll.docs[0]["outbox_owner"] == "relay-b"
+
+
+@pytest.mark.asyncio
+async def test_failed_publish_keeps_rows_pending_until_the_lease_expires(monkeypatch, relay):
+    coll = FakeCollection([_row(1)])
+    monkeypatch.setattr(relay_mod.db, "messages_collection", coll, raising=False)
+    monkeypatch.setattr(relay_mod, "kafka_producer", FakeProducer(error=RuntimeError("broker down")))
+
+    with pytest.raises(RuntimeError):
+        await relay.run_once("interactive")
+    assert coll.docs[0]["outbox"] == "PENDING"
+    assert coll.docs[0]["outbox_lease_until"] == 1000.0 + relay.lease_seconds
+
+    # still leased: nobody can claim it yet
+    producer = FakeProducer()
+    monkeypatch.setattr(relay_mod, "kafka_producer", producer)
+    assert await relay.run_once("interactive") == 0
+
+    # once the lease runs out the row is relayed again
+    monkeypatch.setattr(relay_mod.time, "time", lambda: 1000.0 + relay.lease_seconds + 1)
+    assert await relay.run_once("interactive") == 1
+    assert coll.docs[0]["outbox"] == "SENT"
@@ -0,0 +1,84 @@
+import pytest
+from fastapi import HTTPException
+from api_frontend.app import routes
+from api_frontend.app.kafka_producer import KafkaProducer, ProducerBusyError
+from api_frontend.app.models import SendMessageReq
+
+
+class FakeRedis:
+    def __init__(self, keys=()):
+        self.keys = set(keys)
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.keys:
+            return None
+        self.keys.add(key)
+        return True
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+
+class FakeBuffer:
+    async def send(self, topic, value, key=None):
+        raise ConnectionError("broker unreachable")
+
+
+@pytest.fixture
+def api(monkeypatch):
+    producer = KafkaProducer()
+    producer.max_in_flight = 1
+    redis, collection = FakeRedis({"dedup:m-dup"}), FakeCollection()
+    monkeypatch.setattr(routes, "kafka_producer", producer)
+    monkeypatch.setattr(routes.db, "redis", redis, raising=False)
+    monkeypatch.setattr(routes.db, "messages_collection", collection, raising=False)
+    monkeypatch.delenv("MESSAGE_OUTBOX_ENABLED", raising=False)
+    return producer, redis, collection
+
+
+def _req(message_id):
+    return SendMessageReq(message_id=message_id, conversation_id="c1", sender_id="u1", recipient_ids=["u2"], content="hi")
+
+
+def test_producer_window_is_bounded():
+    producer = KafkaProducer()
+    producer.max_in_flight = 2
+    with producer.reserve(2):
+        with pytest.raises(ProducerBusyError):
+            with producer.reserve(1):
+                pass
+    assert producer.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_busy_producer_rejects_before_dedup_and_insert(api):
+    producer, redis, collection = api
+    with producer.reserve(1):
+        with pytest.raises(ProducerBusyError):
+            await routes.send_message(_req("m-1"), user="u1")
+    assert "dedup:m-1" not in redis.keys
+    assert collection.docs == []
+    assert producer.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_duplicate_gives_back_its_reserved_slot(api):
+    producer, _, _ = api
+    with pytest.raises(HTTPException) as exc:
+        await routes.send_message(_req("m-dup"), user="u1")
+    assert exc.value.status_code == 409
+    assert producer.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_reserved_slot_is_released_when_produce_fails(api):
+    producer, _, _ = api
+    producer._producer = FakeBuffer()
+    with pytest.raises(ConnectionError):
+        await routes.send_message(_req("m-2"), user="u1")
+    assert producer.in_flight == 0
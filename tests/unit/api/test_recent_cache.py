@@ -0,0 +1,169 @@
+import json
+import pytest
+from api_frontend.app import recent_cache as recent_cache_module
+from api_frontend.app.recent_cache import RecentMessageCache, _keys
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    def hgetall(self, key):
+        self.ops.append(lambda: dict(self.redis.hashes.get(key, {})))
+
+    def exists(self, key):
+        self.ops.append(lambda: int(key in self.redis.strings))
+
+    def expire(self, key, ttl):
+        self.ops.append(lambda: 1)
+
+    def delete(self, *keys):
+        self.ops.append(lambda: self.redis.deleted.extend(keys))
+
+    async def execute(self):
+        if self.redis.down:
+            raise ConnectionError("redis down")
+        return [op() for op in self.ops]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.strings = set()
+        self.deleted = []
+        self.down = False
+        self.script_error = None
+        self.script_calls = []
+
+    def register_script(self, source):
+        async def call(keys, args, client=None):
+            if self.script_error:
+                raise self.script_error
+            self.script_calls.append((keys, args))
+        return call
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(recent_cache_module.db, "redis", fake, raising=False)
+    return fake
+
+
+def _msg(mid, created_at, cid="c1"):
+    return {"message_id": mid, "conversation_id": cid, "sender_id": "u1", "recipient_ids": ["u2"],
+            "payload_type": "text", "payload_ref": "hi", "metadata": {}, "created_at": created_at}
+
+
+@pytest.mark.asyncio
+async def test_append_pushes_one_script_call_per_conversation_oldest_first(redis):
+    cache = RecentMessageCache()
+    await cache.append([_msg("m2", 2.0), _msg("m1", 1.0), _msg("x1", 1.5, cid="c2")])
+    by_keys = {keys[0]: args for keys, args in redis.script_calls}
+    assert by_keys["conv:{c1}:recent:ids"][2::3] == ["m1", "m2"]
+    assert by_keys["conv:{c1}:recent:ids"][3::3] == [1.0, 2.0]
+    assert by_keys["conv:{c2}:recent:ids"][2::3] == ["x1"]
+
+
+@pytest.mark.asyncio
+async def test_failed_append_is_swallowed_and_invalidates_the_window(redis):
+    cache = RecentMessageCache()
+    redis.down = True
+    await cache.append([_msg("m1", 1.0)])  # must not raise
+    assert redis.deleted == []  # invalidation is best effort too
+
+    redis.down = False
+    redis.script_error = ConnectionError("script failed")
+    await cache.append([_msg("m1", 1.0)])
+    assert redis.deleted == _keys("c1")
+
+
+@pytest.mark.asyncio
+async def test_page_is_served_from_window_with_worker_states(redis):
+    cache = RecentMessageCache()
+    keys = _keys("c1")
+    redis.hashes[keys[1]] = {m["message_id"]: json.dumps(m) for m in (_msg("m1", 1.0), _msg("m2", 2.0), _msg("m3", 3.0))}
+    redis.hashes[keys[2]] = {"m3": "DELIVERED"}
+
+    messages, cursor = await cache.get_page("c1", 2)
+    assert [(m["message_id"], m["state"]) for m in messages] == [("m3", "DELIVERED"), ("m2", "SENT")]
+    # the last page is only answered from Redis when the window holds the whole conversation
+    assert await cache.get_page("c1", 2, cursor) is None
+    redis.strings.add(keys[3])
+    messages, cursor = await cache.get_page("c1", 2, cursor)
+    assert [m["message_id"] for m in messages] == ["m1"] and cursor is None
+
+
+class WindowRedis(FakeRedis):
+    """Runs the _PUSH script's rules over in-memory keys."""
+
+    def __init__(self):
+        super().__init__()
+        self.zsets = {}
+
+    def register_script(self, source):
+        async def push(keys, args, client=None):
+            ids, msgs, state, full = keys
+            window, zset, hashes = args[0], self.zsets.setdefault(ids, {}), self.hashes.setdefault(msgs, {})
+            complete = full in self.strings
+            oldest = min(zset.items(), key=lambda kv: (kv[1], kv[0]), default=None)
+            for i in range(2, len(args), 3):
+                mid, score, doc = args[i:i + 3]
+                if complete or oldest is None or score >= oldest[1]:
+                    zset[mid] = score
+                    hashes[mid] = doc
+            ranked = sorted(zset, key=lambda mid: (zset[mid], mid))
+            for mid in ranked[:max(0, len(ranked) - window)]:
+                del zset[mid]
+                hashes.pop(mid, None)
+                self.hashes.get(state, {}).pop(mid, None)
+                self.strings.discard(full)
+        return push
+
+
+async def _read_all(cache, limit):
+    seen, cursor = [], None
+    while True:
+        page = await cache.get_page("c1", limit, cursor)
+        if page is None:
+            return seen, "mongo"
+        messages, cursor = page
+        seen.extend(m["message_id"] for m in messages)
+        if cursor is None:
+            return seen, "done"
+
+
+@pytest.mark.asyncio
+async def test_out_of_order_appends_never_leave_a_gap_in_the_window(monkeypatch):
+    redis = WindowRedis()
+    monkeypatch.setattr(recent_cache_module.db, "redis", redis, raising=False)
+    cache = RecentMessageCache()
+    cache.window = 3
+    for i in range(1, 6):
+        await cache.append([_msg(f"m{i}", float(i))])
+    # the window is m3..m5; two messages dated before it arrive late
+    await cache.append([_msg("s1", 1.5), _msg("s2", 2.5)])
+    # and one that belongs inside it
+    await cache.append([_msg("m4b", 4.5)])
+
+    assert set(redis.zsets[_keys("c1")[0]]) == {"m4", "m4b", "m5"}
+    seen, end = await _read_all(cache, 1)
+    # pages walk the window newest first and hand over to Mongo without skipping anything
+    assert seen == ["m5", "m4b"] and end == "mongo"
+
+
+@pytest.mark.asyncio
+async def test_a_complete_window_takes_late_messages_of_any_date(monkeypatch):
+    redis = WindowRedis()
+    monkeypatch.setattr(recent_cache_module.db, "redis", redis, raising=False)
+    cache = RecentMessageCache()
+    cache.window = 10
+    await cache.append([_msg("m2", 2.0), _msg("m3", 3.0)])
+    redis.strings.add(_keys("c1")[3])
+
+    await cache.append([_msg("s1", 1.0)])
+    assert await _read_all(cache, 1) == (["m3", "m2", "s1"], "done")
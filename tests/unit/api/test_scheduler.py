@@ -0,0 +1,77 @@
+import json
+import time
+import pytest
+from api_frontend.app import scheduler as scheduler_module
+from api_frontend.app.models import SendMessageReq
+from api_frontend.app.routes import _build_message
+from api_frontend.app.scheduler import Scheduler, _keys
+
+
+def _req(**kw):
+    return SendMessageReq(conversation_id="c1", sender_id="alice", recipient_ids=["bob"], content="hi", **kw)
+
+
+def test_only_future_deliver_at_schedules():
+    assert "deliver_at" not in _build_message(_req())
+    assert "deliver_at" not in _build_message(_req(deliver_at=time.time() - 10))
+    later = time.time() + 3600
+    assert _build_message(_req(deliver_at=later))["deliver_at"] == later
+
+
+def test_bucket_keys_share_a_hash_tag():
+    scheduler = Scheduler()
+    scheduler.bucket_seconds = 60
+    bucket = scheduler.bucket_of(1200.5)
+    assert bucket == 20
+    assert _keys(bucket) == ["sched:{20}:due", "sched:{20}:inflight", "sched:{20}:msgs"]
+
+
+
+class FakeCollection:
+    def __init__(self):
+        self.updates = []
+
+    async def update_many(self, query, update):
+        self.updates.append((query, update))
+
+
+class FakeProducer:
+    def __init__(self):
+        self.sent = []
+
+    async def send_batch(self, topic, records, wait=None):
+        self.sent.extend((topic, key) for key, _ in records)
+
+
+@pytest.mark.asyncio
+async def test_drained_messages_are_published_cached_and_announced(monkeypatch):
+    due = {"message_id": "m1", "conversation_id": "c1", "recipient_ids": ["bob", "carol"],
+           "priority": "bulk", "created_at": 1.0, "deliver_at": 2.0}
+    acked, cached, notified = [], [], []
+
+    async def pop(keys, args):
+        return [0, "m1", json.dumps(due)]
+
+    async def ack(keys, args):
+        acked.extend(args)
+
+    async def append(messages):
+        cached.extend((m["message_id"], m["created_at"]) for m in messages)
+
+    producer, collection = FakeProducer(), FakeCollection()
+    monkeypatch.setattr(scheduler_module, "kafka_producer", producer)
+    monkeypatch.setattr(scheduler_module.db, "messages_collection", collection, raising=False)
+    monkeypatch.setattr(scheduler_module.recent_cache, "append", append)
+    monkeypatch.setattr(scheduler_module.ws_manager, "notify", lambda events: notified.extend(events))
+    scheduler = Scheduler()
+    scheduler._pop, scheduler._ack = pop, ack
+
+    before = time.time()
+    assert await scheduler._drain_bucket(0, before) == (1, 0)
+    assert producer.sent == [("incoming.messages.bulk", "c1")]
+    assert acked == ["m1"]
+    # re-dated to the release in Mongo and in the recent window alike
+    update = collection.updates[0][1]["$set"]
+    assert update["state"] == "SENT" and update["created_at"] >= before
+    assert cached == [("m1", update["created_at"])]
+    assert notified == [("bob", "[new_message] m1"), ("carol", "[new_message] m1")]
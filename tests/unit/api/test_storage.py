@@ -0,0 +1,59 @@
+import pytest
+from api_frontend.app import storage as storage_module
+from api_frontend.app.storage import S3Storage
+
+
+class FakeS3:
+    def __init__(self, has_bucket=True, can_create=True):
+        self.has_bucket = has_bucket
+        self.can_create = can_create
+        self.created = []
+
+    def head_bucket(self, Bucket):
+        if not self.has_bucket:
+            raise RuntimeError("404")
+
+    def create_bucket(self, Bucket):
+        if not self.can_create:
+            raise RuntimeError("access denied")
+        self.created.append(Bucket)
+
+    def generate_presigned_post(self, Bucket, Key, ExpiresIn):
+        return {"url": f"http://minio/{Bucket}", "fields": {"key": Key}}
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    made, s3 = [], FakeS3(has_bucket=False)
+
+    def client(*args, **kwargs):
+        made.append(kwargs)
+        return s3
+    monkeypatch.setattr(storage_module.boto3, "client", client)
+    monkeypatch.setenv("MINIO_BUCKET", "uploads")
+    return made, s3
+
+
+def test_one_pooled_client_is_shared(clients):
+    made, _ = clients
+    storage = S3Storage()
+    first = storage.presign_post("a/b.png")
+    second = storage.presign_post("a/c.png")
+    assert len(made) == 1
+    assert made[0]["config"].max_pool_connections == 50
+    assert first["fields"]["key"] == "a/b.png" and second["url"] == "http://minio/uploads"
+
+
+@pytest.mark.asyncio
+async def test_start_provisions_a_missing_bucket(clients):
+    _, s3 = clients
+    await S3Storage().start()
+    assert s3.created == ["uploads"]
+
+
+@pytest.mark.asyncio
+async def test_start_survives_a_bucket_it_cannot_create(clients):
+    _, s3 = clients
+    s3.can_create = False
+    await S3Storage().start()
+    assert s3.created == []
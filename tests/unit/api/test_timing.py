@@ -0,0 +1,33 @@
+from starlette.requests import Request
+from api_frontend.app import timing
+from api_frontend.app.main import _route_template
+
+
+def test_spans_accumulate_per_stage_and_render_server_timing():
+    t = timing.begin_request()
+    with timing.span("mongo_insert"):
+        pass
+    with timing.span("kafka_produce"):
+        pass
+    with timing.span("mongo_insert"):
+        pass
+    assert timing.current_timing() is t
+    assert list(t.spans) == ["mongo_insert", "kafka_produce"]
+    header = t.server_timing()
+    assert header.startswith("mongo_insert;dur=") and ", kafka_produce;dur=" in header
+
+
+def test_span_outside_a_request_is_a_noop():
+    timing._current.set(None)
+    with timing.span("redis_dedup"):
+        pass
+    assert timing.current_timing() is None
+
+
+def _request(method, path):
+    return Request({"type": "http", "method": method, "path": path, "root_path": "", "query_string": b"", "headers": []})
+
+
+def test_metrics_are_labelled_with_the_route_template():
+    assert _route_template(_request("GET", "/v1/conversations/c-123/messages")) == "/v1/conversations/{conversation_id}/messages"
+    assert _route_template(_request("GET", "/nope/really")) == "unmatched"
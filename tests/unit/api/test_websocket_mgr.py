@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from api_frontend.app.websocket_mgr import WebSocketManager
+
+
+class FakeWebSocket:
+    def __init__(self, blocked=True):
+        self.sent = []
+        self.closed_with = None
+        self.gate = asyncio.Event()
+        if not blocked:
+            self.gate.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        await self.gate.wait()
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def _manager(policy, queue_size=2, send_timeout=10.0):
+    manager = WebSocketManager()
+    manager.overflow_policy = policy
+    manager.queue_size = queue_size
+    manager.send_timeout = send_timeout
+    return manager
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_keeps_the_newest_messages():
+    manager = _manager("drop_oldest")
+    ws = FakeWebSocket()
+    conn = await manager.connect("alice", ws)
+    for n in range(3):
+        manager.send_local("alice", f"m{n}")
+    assert list(conn.queue) == ["m1", "m2"]
+
+    ws.gate.set()
+    await asyncio.sleep(0.01)
+    assert ws.sent == ["m1", "m2"]
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_coalesce_collapses_the_backlog_into_a_resync_marker():
+    manager = _manager("coalesce")
+    conn = await manager.connect("alice", FakeWebSocket())
+    for n in range(3):
+        manager.send_local("alice", f"m{n}")
+    assert list(conn.queue) == ["[resync] 3"]
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_is_disconnected_without_blocking_the_sender():
+    manager = _manager("disconnect")
+    ws = FakeWebSocket()
+    await manager.connect("alice", ws)
+    for n in range(3):
+        manager.send_local("alice", f"m{n}")
+    await asyncio.sleep(0.01)
+    assert "alice" not in manager.connections
+    assert ws.closed_with == 1013
+
+
+@pytest.mark.asyncio
+async def test_send_timeout_evicts_the_connection():
+    manager = _manager("drop_oldest", send_timeout=0.01)
+    ws = FakeWebSocket()
+    await manager.connect("alice", ws)
+    manager.send_local("alice", "m0")
+    await asyncio.sleep(0.1)
+    assert "alice" not in manager.connections
+    assert ws.closed_with == 1013
@@ -0,0 +1,78 @@
+import json
+import time
+import pytest
+from api_frontend.app.ws_cluster import ClusterRouter, PRESENCE_KEY
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    def zadd(self, key, mapping):
+        self.ops.append(lambda: self.redis.zsets.setdefault(key, {}).update(mapping))
+
+    def expire(self, key, ttl):
+        self.ops.append(lambda: True)
+
+    def zrangebyscore(self, key, low, high):
+        self.ops.append(lambda: [m for m, score in self.redis.zsets.get(key, {}).items() if score >= low])
+
+    def publish(self, channel, payload):
+        self.ops.append(lambda: self.redis.published.append((channel, json.loads(payload))))
+
+    async def execute(self):
+        return [op() for op in self.ops]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.zsets = {}
+        self.published = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+
+class FakeManager:
+    def __init__(self):
+        self.connections = {}
+        self.local = []
+
+    def send_local(self, user_id, message):
+        self.local.append((user_id, message))
+        return 1
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setenv("WS_NODE_ID", "node-a")
+    router = ClusterRouter(FakeManager())
+    router.redis = FakeRedis()
+    return router
+
+
+@pytest.mark.asyncio
+async def test_register_and_unregister_presence(router):
+    await router.register("alice")
+    assert router.redis.zsets[PRESENCE_KEY.format("alice")]["node-a"] > time.time()
+    await router.unregister("alice")
+    assert router.redis.zsets[PRESENCE_KEY.format("alice")] == {}
+
+
+@pytest.mark.asyncio
+async def test_events_go_only_to_the_nodes_holding_the_user(router):
+    now = time.time()
+    router.redis.zsets = {
+        PRESENCE_KEY.format("alice"): {"node-a": now + 30},
+        PRESENCE_KEY.format("bob"): {"node-b": now + 30, "node-dead": now - 1},
+    }
+    await router.publish_many([("alice", "hi alice"), ("bob", "hi bob"), ("carol", "hi carol")])
+
+    # alice is held here: no round trip through pub/sub
+    assert router.manager.local == [("alice", "hi alice")]
+    # expired presence entries are ignored; offline users produce nothing
+    assert router.redis.published == [("ws:node:node-b", {"user_id": "bob", "message": "hi bob"})]
@@ -0,0 +1,73 @@
+import pytest
+from services.worker.app.adapter_client import AdapterClient
+
+
+class FakeResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def text(self):
+        return str(self.body)
+
+    async def json(self):
+        return self.body
+
+
+class FakeSession:
+    def __init__(self, batch_supported=True):
+        self.batch_supported = batch_supported
+        self.calls = []
+        self.timeouts = []
+
+    def post(self, url, json=None, timeout=None):
+        self.calls.append(url)
+        self.timeouts.append(timeout.total if timeout else None)
+        if url.endswith("/send_batch"):
+            if not self.batch_supported:
+                return FakeResponse(404, "not found")
+            results = [
+                {"recipient_id": item["recipient_id"], "status": "error", "code": 400, "error": "blocked"}
+                if item["recipient_id"].endswith("x") else
+                {"recipient_id": item["recipient_id"], "status": "ok", "code": 200}
+                for item in json["items"]
+            ]
+            return FakeResponse(200, {"results": results})
+        return FakeResponse(200, {"status": "ok"})
+
+
+@pytest.mark.asyncio
+async def test_send_batch_maps_per_item_results():
+    session = FakeSession()
+    client = AdapterClient(session)
+    errors = await client.send_batch("http://tg", {"payload_ref": "hi"}, ["tg_1", "tg_2x"])
+    assert errors == {"tg_1": None, "tg_2x": "blocked"}
+    assert session.calls == ["http://tg/send_batch"]
+
+
+@pytest.mark.asyncio
+async def test_send_batch_falls_back_to_single_sends_on_404():
+    session = FakeSession(batch_supported=False)
+    client = AdapterClient(session)
+    errors = await client.send_batch("http://mock", {"payload_ref": "hi"}, ["a", "b"])
+    assert errors == {"a": None, "b": None}
+    await client.send_batch("http://mock", {"payload_ref": "hi"}, ["c"])
+    assert session.calls.count("http://mock/send_batch") == 1
+    assert session.calls.count("http://mock/send") == 3
+
+
+@pytest.mark.asyncio
+async def test_batch_timeout_grows_with_chunk_size():
+    session = FakeSession()
+    client = AdapterClient(session, timeout=10)
+    client.batch_concurrency, client.batch_item_timeout = 10, 30
+    await client.send_batch("http://tg", {"payload_ref": "hi"}, [f"tg_{i}" for i in range(25)])
+    # three waves of 10 concurrent items on the adapter side
+    assert session.timeouts == [10 + 3 * 30]
+    assert client.batch_timeout(1) == 40
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from services.worker.app.consumer import WorkerConsumer
+
+
+class FakeRouting:
+    def pick(self, channel):
+        return f"http://{channel}-adapter"
+
+
+class FakeAdapterClient:
+    """Channel is the recipient id's prefix; recipients named in `fail` raise."""
+
+    def __init__(self, fail=()):
+        self.routing = FakeRouting()
+        self.batch_size = 1
+        self.fail = dict(fail)
+        self.in_flight = {}
+        self.peak = {}
+        self.gate = asyncio.Event()
+
+    def resolve_channel(self, channel_hint, rid):
+        return rid.split(":")[0]
+
+    async def send_to_adapter(self, adapter_base, message, rid):
+        channel = self.resolve_channel(None, rid)
+        self.in_flight[channel] = self.in_flight.get(channel, 0) + 1
+        self.peak[channel] = max(self.peak.get(channel, 0), self.in_flight[channel])
+        try:
+            await self.gate.wait()
+            if rid in self.fail:
+                raise self.fail[rid]
+        finally:
+            self.in_flight[channel] -= 1
+
+
+@pytest.fixture
+def worker():
+    w = WorkerConsumer(kafka_client=None, http_session=None)
+    w.channel_limits = {"whatsapp": 2, "default": 5}
+    w.channel_slots = {}
+    return w
+
+
+async def _deliver_all(worker, recipients):
+    message = {"message_id": "m1", "created_at": None}
+    return await asyncio.gather(*(worker._deliver(message, None, rid) for rid in recipients))
+
+
+@pytest.mark.asyncio
+async def test_recipients_run_concurrently_within_each_channel_cap(worker):
+    worker.adapter_client = adapter = FakeAdapterClient()
+    recipients = [f"whatsapp:{i}" for i in range(6)] + [f"telegram:{i}" for i in range(4)]
+
+    delivery = asyncio.create_task(_deliver_all(worker, recipients))
+    await asyncio.sleep(0.01)
+    # a saturated channel does not hold back the other one
+    assert adapter.in_flight == {"whatsapp": 2, "telegram": 4}
+    adapter.gate.set()
+
+    assert await delivery == [None] * len(recipients)
+    assert adapter.peak == {"whatsapp": 2, "telegram": 4}
+
+
+@pytest.mark.asyncio
+async def test_failed_recipients_are_reported_and_free_their_slot(worker):
+    worker.adapter_client = adapter = FakeAdapterClient(fail={
+        "whatsapp:1": RuntimeError("provider 500"),
+        "whatsapp:2": asyncio.TimeoutError(),
+    })
+    adapter.gate.set()
+
+    outcomes = await _deliver_all(worker, ["whatsapp:0", "whatsapp:1", "whatsapp:2", "whatsapp:3"])
+    assert outcomes[0] is None and outcomes[3] is None
+    assert outcomes[1] == {"recipient": "whatsapp:1", "error": "provider 500"}
+    assert outcomes[2]["recipient"] == "whatsapp:2"
+    # every slot came back, so later messages are not starved by earlier failures
+    assert worker.channel_slots["whatsapp"]._value == 2
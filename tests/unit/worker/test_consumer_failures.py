@@ -0,0 +1,274 @@
+import asyncio
+import pytest
+from aiokafka import TopicPartition
+from services.worker.app import consumer as consumer_module
+from services.worker.app.consumer import WorkerConsumer
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    def set(self, key, value, ex=None, nx=False):
+        self.ops.append((key, value, nx))
+
+    async def execute(self):
+        if self.redis.pipeline_error:
+            raise self.redis.pipeline_error
+        return [await self.redis.set(key, value, nx=nx) for key, value, nx in self.ops]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.keys = {}
+        self.pipeline_error = None
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.keys:
+            return None
+        self.keys[key] = value
+        return True
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.keys.pop(key, None)
+        return len(keys)
+
+    async def expire(self, key, seconds):
+        return key in self.keys
+
+
+class FakeKafka:
+    def __init__(self):
+        self.sent = []
+        self.acked = asyncio.Event()
+        self.acked.set()
+
+    async def enqueue(self, topic, key, value):
+        self.sent.append((topic, value))
+        fut = asyncio.get_event_loop().create_future()
+        fut.set_result(None)
+        return fut
+
+    async def flush(self, futures):
+        await self.acked.wait()
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    monkeypatch.setattr(consumer_module.db, "redis", FakeRedis(), raising=False)
+    return WorkerConsumer(FakeKafka(), http_session=None)
+
+
+@pytest.mark.asyncio
+async def test_failed_message_releases_its_dedup_key(worker):
+    async def fail(*args):
+        raise RuntimeError("adapter exploded")
+    worker._process = fail
+
+    with pytest.raises(RuntimeError):
+        await worker._handle_message({"message_id": "m1", "recipient_ids": ["u1"]})
+    assert "worker:dedup:m1" not in consumer_module.db.redis.keys
+
+
+@pytest.mark.asyncio
+async def test_redelivery_after_a_crash_waits_out_the_stale_lease(worker):
+    # a worker killed mid-message left its claim behind
+    redis = consumer_module.db.redis
+    await redis.set("worker:dedup:m1", "1")
+    worker.dedup_lease = 0.05
+    processed = []
+
+    async def process(message, msg_id, start_time):
+        processed.append(msg_id)
+    worker._process = process
+
+    handler = asyncio.create_task(worker._handle_message({"message_id": "m1", "recipient_ids": ["u1"]}))
+    await asyncio.sleep(0.02)
+    assert processed == [] and not handler.done()
+
+    # the dead worker never renews it, so the lease runs out
+    del redis.keys["worker:dedup:m1"]
+    await asyncio.wait_for(handler, timeout=1)
+    assert processed == ["m1"]
+    assert "worker:dedup:m1" not in redis.keys
+
+
+@pytest.mark.asyncio
+async def test_failure_after_delivery_parks_only_undelivered_recipients(worker):
+    tp = TopicPartition("incoming.messages", 0)
+    worker.offsets.track(tp, 3)
+    message = {"message_id": "m1", "recipient_ids": ["u1", "u2", "u3"], "delivered_before": 1}
+    error = consumer_module._DeliveredThenFailed(["u1", "u3"], RuntimeError("flush failed"))
+
+    worker._park_failed(tp, 3, message, error)
+    await asyncio.gather(*worker._parking)
+    _, parked = worker.kafka_client.sent[0]
+    assert parked["message"]["recipient_ids"] == ["u2"]
+    assert parked["message"]["delivered_before"] == 3
+    assert worker.offsets.committable() == {tp: 4}
+
+
+@pytest.mark.asyncio
+async def test_failure_after_full_delivery_only_retries_the_bookkeeping(worker):
+    tp = TopicPartition("incoming.messages", 0)
+    worker.offsets.track(tp, 0)
+    message = {"message_id": "m1", "recipient_ids": ["u1"], "retry_attempt": worker.max_retries}
+    error = consumer_module._DeliveredThenFailed(["u1"], RuntimeError("state write failed"))
+
+    worker._park_failed(tp, 0, message, error)
+    await asyncio.gather(*worker._parking)
+    topic, parked = worker.kafka_client.sent[0]
+    # nobody left to deliver to: a retry round writes the final state instead of a DLQ entry
+    assert topic.startswith("retry.")
+    assert parked["message"]["recipient_ids"] == []
+    assert parked["message"]["delivered_before"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_record_offset_completes_only_once_parked(worker):
+    tp = TopicPartition("incoming.messages", 0)
+    worker.offsets.track(tp, 7)
+    worker.kafka_client.acked.clear()
+
+    worker._park_failed(tp, 7, {"message_id": "m1", "recipient_ids": ["u1", "u2"]}, RuntimeError("mongo down"))
+    await asyncio.sleep(0.01)
+    assert worker.offsets.committable() == {}
+
+    worker.kafka_client.acked.set()
+    await asyncio.gather(*worker._parking)
+    assert worker.offsets.committable() == {tp: 8}
+    topic, parked = worker.kafka_client.sent[0]
+    assert topic.startswith("retry.")
+    assert parked["message"]["retry_attempt"] == 1
+    assert [f["recipient"] for f in parked["failures"]] == ["u1", "u2"]
+
+
+class Record:
+    def __init__(self, offset, message_id):
+        self.topic = "incoming.messages"
+        self.partition = 0
+        self.offset = offset
+        self.timestamp = None
+        self.value = ('{"message_id": "%s", "conversation_id": "c1"}' % message_id).encode()
+
+
+class FakeConsumer:
+    def __init__(self, polls):
+        self.polls = list(polls)
+
+    async def getmany(self, timeout_ms=None, max_records=None):
+        poll = self.polls.pop(0)
+        if isinstance(poll, Exception):
+            raise poll
+        return poll
+
+
+def batch_worker(worker, polls):
+    worker.poll_mode = "batch"
+    worker.consumer = FakeConsumer(polls)
+    submitted = []
+    worker._submit = lambda tp, offset, key, payload: submitted.append(payload["message_id"])
+    return submitted
+
+
+@pytest.mark.asyncio
+async def test_batch_poll_skips_duplicates_within_the_poll(worker):
+    tp = TopicPartition("incoming.messages", 0)
+    submitted = batch_worker(worker, [{tp: [Record(0, "m1"), Record(1, "m2"), Record(2, "m1")]}])
+
+    await worker._poll_batch()
+    assert submitted == ["m1", "m2"]
+    assert worker._claimed == {"m1", "m2"}
+
+
+@pytest.mark.asyncio
+async def test_batch_poll_leaves_keys_held_elsewhere_to_the_handler(worker):
+    tp = TopicPartition("incoming.messages", 0)
+    await consumer_module.db.redis.set("worker:dedup:m2", "1")
+    submitted = batch_worker(worker, [{tp: [Record(0, "m1"), Record(1, "m2")]}])
+
+    await worker._poll_batch()
+    # m2 is submitted unclaimed: its handler waits for the holder's lease instead of dropping it
+    assert submitted == ["m1", "m2"]
+    assert worker._claimed == {"m1"}
+
+
+@pytest.mark.asyncio
+async def test_batch_poll_submits_unclaimed_when_redis_fails(worker):
+    tp = TopicPartition("incoming.messages", 0)
+    consumer_module.db.redis.pipeline_error = ConnectionError("redis down")
+    submitted = batch_worker(worker, [{tp: [Record(0, "m1"), Record(1, "m2")]}])
+
+    await worker._poll_batch()
+    assert submitted == ["m1", "m2"]
+    assert worker._claimed == set()
+
+
+@pytest.mark.asyncio
+async def test_batch_loop_survives_poll_errors(worker):
+    tp = TopicPartition("incoming.messages", 0)
+    submitted = batch_worker(worker, [ConnectionError("broker gone"), {tp: [Record(0, "m1")]}])
+    worker.running = True
+    original = worker._poll_batch
+
+    async def poll_then_stop():
+        try:
+            await original()
+        finally:
+            if not worker.consumer.polls:
+                worker.running = False
+    worker._poll_batch = poll_then_stop
+
+    await asyncio.wait_for(worker._run_batch_loop(), timeout=5)
+    assert submitted == ["m1"]
+
+
+@pytest.mark.asyncio
+async def test_unstarted_claims_are_released_on_shutdown(worker):
+    await consumer_module.db.redis.set("worker:dedup:m1", "1")
+    worker._claimed.add("m1")
+    await worker._release_claims()
+    assert consumer_module.db.redis.keys == {}
+    assert worker._claimed == set()
+
+
+def test_latency_is_measured_from_release_not_accept():
+    released_at = consumer_module._released_at
+    assert released_at({"created_at": 10.0}) == 10.0
+    # scheduled for later, or replayed from the DLQ long after it was accepted
+    assert released_at({"created_at": 10.0, "deliver_at": 3600.0}) == 3600.0
+    assert released_at({"created_at": 10.0, "replayed_at": 86400.0}) == 86400.0
+    assert released_at({}) is None
+
+
+class FakeStateWriter:
+    def __init__(self):
+        self.updates = []
+
+    def update(self, msg_id, fields, add_to_set=None):
+        self.updates.append((msg_id, fields["state"]))
+        fut = asyncio.get_event_loop().create_future()
+        fut.set_result(None)
+        return fut
+
+
+@pytest.mark.asyncio
+async def test_recent_window_errors_do_not_fail_a_delivered_message(worker, monkeypatch):
+    async def redis_down(*args):
+        raise ConnectionError("redis down")
+    monkeypatch.setattr(consumer_module.recent_cache, "set_state", redis_down)
+
+    async def deliver(message, channel_hint, rid):
+        return None
+    worker._deliver = deliver
+    worker.state_writer = FakeStateWriter()
+    worker.ws_events_enabled = False
+
+    await worker._process({"message_id": "m1", "conversation_id": "c1", "recipient_ids": ["u1"]}, "m1", 0.0)
+    assert worker.state_writer.updates == [("m1", "PROCESSING"), ("m1", "DELIVERED")]
+    assert [topic for topic, _ in worker.kafka_client.sent] == [worker.outgoing_topic]
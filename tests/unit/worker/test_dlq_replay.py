@@ -0,0 +1,36 @@
+from services.worker.app.dlq_replay import ReplayFilter, build_replay, parse_time
+
+
+RECORD = {
+    "message_id": "m1",
+    "timestamp": 1000.0,
+    "failures": [
+        {"recipient": "wa_1", "error": "Adapter returned 503: down"},
+        {"recipient": "tg_2", "error": "Adapter returned 400: blocked"},
+    ],
+    "original": {"message_id": "m1", "recipient_ids": ["wa_1", "tg_2", "wa_3"], "retry_attempt": 5, "delivered_before": 1},
+}
+
+
+def test_filters_by_channel_error_prefix_and_time():
+    assert ReplayFilter(channel="whatsapp").select(RECORD) == [RECORD["failures"][0]]
+    assert ReplayFilter(error=r" 5\d\d:").select(RECORD) == [RECORD["failures"][0]]
+    assert ReplayFilter(recipient_prefix="tg_").select(RECORD) == [RECORD["failures"][1]]
+    assert ReplayFilter(channel="telegram", error="503").select(RECORD) is None
+    assert ReplayFilter(since=1000.0, until=1001.0).select(RECORD) == RECORD["failures"]
+    assert ReplayFilter(until=1000.0).select(RECORD) is None
+
+
+def test_failed_only_replay_keeps_delivered_count():
+    message = build_replay(RECORD, [RECORD["failures"][0]], failed_only=True)
+    assert message["recipient_ids"] == ["wa_1"]
+    assert message["retry_attempt"] == 0
+    assert message["delivered_before"] == 2
+
+    full = build_replay(RECORD, [RECORD["failures"][0]], failed_only=False)
+    assert full["recipient_ids"] == ["wa_1", "tg_2", "wa_3"]
+
+
+def test_parse_time_accepts_epoch_and_iso():
+    assert parse_time("1700000000") == 1700000000.0
+    assert parse_time("2024-01-01T00:00:00+00:00") == 1704067200.0
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import pytest
+from services.worker.app import kafka_client as kafka_module
+from services.worker.app.kafka_client import KafkaClient
+
+
+class FakeProducer:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.sent = []
+        self.acks = []
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def send(self, topic, value, key=None):
+        self.sent.append((topic, key, value))
+        fut = asyncio.get_event_loop().create_future()
+        self.acks.append(fut)
+        return fut
+
+
+@pytest.fixture
+def fake_producer(monkeypatch):
+    monkeypatch.setattr(kafka_module, "AIOKafkaProducer", FakeProducer)
+
+
+@pytest.mark.asyncio
+async def test_producer_batching_settings_come_from_env(monkeypatch, fake_producer):
+    monkeypatch.setenv("KAFKA_LINGER_MS", "25")
+    monkeypatch.setenv("KAFKA_MAX_BATCH_BYTES", "65536")
+    monkeypatch.setenv("KAFKA_COMPRESSION", "lz4")
+    monkeypatch.setenv("KAFKA_ACKS", "all")
+    client = KafkaClient()
+    await client.start()
+    kwargs = client.producer.kwargs
+    assert kwargs["linger_ms"] == 25
+    assert kwargs["max_batch_size"] == 65536
+    assert kwargs["compression_type"] == "lz4"
+    assert kwargs["acks"] == "all"
+
+
+@pytest.mark.asyncio
+async def test_defaults_leave_compression_off(monkeypatch, fake_producer):
+    for name in ("KAFKA_LINGER_MS", "KAFKA_MAX_BATCH_BYTES", "KAFKA_COMPRESSION", "KAFKA_ACKS"):
+        monkeypatch.delenv(name, raising=False)
+    client = KafkaClient()
+    await client.start()
+    assert client.producer.kwargs["compression_type"] is None
+    assert client.producer.kwargs["acks"] == 1
+
+
+@pytest.mark.asyncio
+async def test_enqueue_buffers_and_flush_waits_for_every_ack(fake_producer):
+    client = KafkaClient()
+    await client.start()
+    futures = [await client.enqueue("outgoing.messages", key="m1", value={"n": i}) for i in range(3)]
+    assert [(t, k, json.loads(v)) for t, k, v in client.producer.sent] == [
+        ("outgoing.messages", b"m1", {"n": i}) for i in range(3)]
+
+    flush = asyncio.create_task(client.flush(futures))
+    for fut in futures[:2]:
+        fut.set_result(None)
+    await asyncio.sleep(0)
+    assert not flush.done()
+    futures[2].set_result(None)
+    await flush
+
+
+@pytest.mark.asyncio
+async def test_flush_raises_when_a_record_is_not_acked(fake_producer):
+    client = KafkaClient()
+    await client.start()
+    futures = [await client.enqueue("deadletters", key="m1", value={}) for _ in range(2)]
+    futures[0].set_result(None)
+    futures[1].set_exception(RuntimeError("broker unavailable"))
+    with pytest.raises(RuntimeError):
+        await client.flush(futures)
+
+
+@pytest.mark.asyncio
+async def test_enqueue_before_start_fails():
+    with pytest.raises(RuntimeError):
+        await KafkaClient().enqueue("outgoing.messages", key="m1", value={})
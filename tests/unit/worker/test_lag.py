@@ -0,0 +1,72 @@
+import pytest
+from aiokafka import TopicPartition
+from services.worker.app.lag import CONSUMER_LAG, FETCH_LAG, LagExporter
+from services.worker.app.offsets import OffsetTracker
+
+
+class FakeConsumer:
+    def __init__(self, positions, ends, committed=None):
+        self.positions = positions
+        self.ends = ends
+        self.commits = committed or {}
+
+    def assignment(self):
+        return set(self.positions)
+
+    async def end_offsets(self, partitions):
+        return {tp: self.ends[tp] for tp in partitions}
+
+    async def position(self, tp):
+        return self.positions[tp]
+
+    async def committed(self, tp):
+        return self.commits.get(tp)
+
+
+def _lag(tp, gauge=CONSUMER_LAG):
+    return gauge.labels(job="worker", topic=tp.topic, partition=str(tp.partition))._value.get()
+
+
+@pytest.mark.asyncio
+async def test_exports_lag_and_drops_revoked_partitions():
+    p0, p1 = TopicPartition("incoming.messages", 0), TopicPartition("incoming.messages", 1)
+    consumer = FakeConsumer({p0: 90, p1: 10}, {p0: 100, p1: 10})
+    exporter = LagExporter(consumer)
+    await exporter.export_once()
+    assert _lag(p0) == 10
+    assert _lag(p1) == 0
+
+    del consumer.positions[p1]
+    await exporter.export_once()
+    assert exporter._exported == {p0}
+
+
+@pytest.mark.asyncio
+async def test_revoked_partition_is_zeroed_when_remove_is_a_noop(monkeypatch):
+    # prometheus_client's multiprocess mode cannot remove series; the last value must not linger
+    monkeypatch.setattr(CONSUMER_LAG, "remove", lambda *labels: None)
+    p2 = TopicPartition("incoming.messages", 2)
+    consumer = FakeConsumer({p2: 50}, {p2: 80})
+    exporter = LagExporter(consumer)
+    await exporter.export_once()
+    assert _lag(p2) == 30
+
+    del consumer.positions[p2]
+    await exporter.export_once()
+    assert _lag(p2) == 0
+
+
+@pytest.mark.asyncio
+async def test_records_buffered_in_the_engine_count_as_lag():
+    p3, p4 = TopicPartition("incoming.messages", 3), TopicPartition("incoming.messages", 4)
+    # everything up to 1000 fetched, but only records before 400 handled
+    offsets = OffsetTracker()
+    for offset in range(400, 1000):
+        offsets.track(p3, offset)
+    consumer = FakeConsumer({p3: 1000, p4: 500}, {p3: 1010, p4: 510}, committed={p3: 350, p4: 200})
+    exporter = LagExporter(consumer, watermark=offsets.watermark)
+    await exporter.export_once()
+    assert _lag(p3) == 610
+    assert _lag(p3, FETCH_LAG) == 10
+    # nothing tracked on p4 yet: the group's committed offset is used
+    assert _lag(p4) == 310
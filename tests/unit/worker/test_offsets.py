@@ -0,0 +1,32 @@
+from services.worker.app.offsets import OffsetTracker
+
+
+def test_watermark_waits_for_lowest_outstanding_offset():
+    tracker = OffsetTracker()
+    for offset in (10, 11, 12):
+        tracker.track("p0", offset)
+    assert tracker.committable() == {}
+
+    tracker.complete("p0", 12)
+    tracker.complete("p0", 11)
+    assert tracker.committable() == {}
+
+    tracker.complete("p0", 10)
+    assert tracker.committable() == {"p0": 13}
+    tracker.mark_committed({"p0": 13})
+    assert tracker.committable() == {}
+
+
+def test_uncommitted_span_and_revoke():
+    tracker = OffsetTracker()
+    for offset in range(5):
+        tracker.track("p0", offset)
+    assert tracker.uncommitted_span("p0") == 5
+    tracker.complete("p0", 0)
+    tracker.mark_committed(tracker.committable())
+    assert tracker.uncommitted_span("p0") == 4
+
+    tracker.revoke(["p0"])
+    tracker.complete("p0", 1)
+    assert tracker.committable() == {}
+    assert tracker.uncommitted_span("p0") == 0
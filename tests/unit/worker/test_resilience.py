@@ -0,0 +1,56 @@
+import pytest
+import asyncio
+from services.worker.app.resilience import AdaptiveLimiter, CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_then_probes_and_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker("http://a", failure_threshold=2, open_seconds=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_limiter_grows_on_fast_success_and_backs_off_once_per_cooldown():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter("http://a", initial=10, latency_target=1.0, backoff=0.5, cooldown=1.0, clock=clock)
+    limiter.in_flight = 3
+    limiter.release(0.1, ok=True)
+    assert limiter.limit == pytest.approx(10.1)
+    limiter.release(0.1, ok=False)
+    limiter.release(5.0, ok=True)  # slow response in the same cooldown window
+    assert limiter.limit == pytest.approx(5.05)
+
+
+@pytest.mark.asyncio
+async def test_limiter_queues_callers_beyond_the_limit():
+    limiter = AdaptiveLimiter("http://a", initial=1)
+    await limiter.acquire()
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    limiter.release(0.01, ok=True)
+    await asyncio.wait_for(waiter, 1)
+    assert limiter.in_flight == 1
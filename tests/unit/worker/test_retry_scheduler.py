@@ -0,0 +1,111 @@
+import asyncio
+import json
+import time
+import pytest
+from aiokafka import TopicPartition
+from services.worker.app.retry_scheduler import RetryScheduler, parse_tiers, tier_for_attempt
+
+
+class Record:
+    def __init__(self, offset, due_at, priority=None):
+        self.offset = offset
+        self.value = json.dumps({"due_at": due_at, "message": {"message_id": f"m{offset}", "conversation_id": "c1",
+                                                               "priority": priority}}).encode()
+
+
+class FakeConsumer:
+    def __init__(self, batches):
+        self.batches = batches
+        self.seeks, self.paused, self.commits = [], [], []
+
+    def assignment(self):
+        return set(self.batches)
+
+    async def getmany(self, timeout_ms=None, max_records=None):
+        return self.batches
+
+    def seek(self, tp, offset):
+        self.seeks.append((tp, offset))
+
+    def pause(self, tp):
+        self.paused.append(tp)
+
+    def resume(self, tp):
+        pass
+
+    async def commit(self, offsets):
+        self.commits.append(offsets)
+
+    async def stop(self):
+        pass
+
+
+class FakeKafka:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    async def enqueue(self, topic, key, value):
+        self.sent.append((topic, value["message_id"]))
+        fut = asyncio.get_event_loop().create_future()
+        fut.set_result(None)
+        return fut
+
+    async def flush(self, futures):
+        if self.fail:
+            raise ConnectionError("broker unreachable")
+
+
+def test_tiers_and_attempts():
+    assert parse_tiers("5s,30s,5m") == [("retry.5s", 5.0), ("retry.30s", 30.0), ("retry.5m", 300.0)]
+    assert tier_for_attempt(1)[0] == "retry.5s"
+    assert tier_for_attempt(99)[0] == "retry.5m"
+
+
+@pytest.mark.asyncio
+async def test_reinjects_due_records_and_sleeps_on_the_first_pending_one():
+    tp = TopicPartition("retry.5s", 0)
+    now = time.time()
+    consumer = FakeConsumer({tp: [Record(0, now - 1), Record(1, now - 1, "bulk"), Record(2, now + 60), Record(3, now - 1)]})
+    scheduler = RetryScheduler(FakeKafka())
+    scheduler.consumer = consumer
+
+    await scheduler.run_once()
+    assert scheduler.kafka_client.sent == [("incoming.messages", "m0"), ("incoming.messages.bulk", "m1")]
+    assert consumer.seeks == [(tp, 2)] and consumer.paused == [tp]
+    assert consumer.commits == [{tp: 2}]
+    assert tp in scheduler._timers
+    await scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_rewinds_instead_of_skipping():
+    tp = TopicPartition("retry.5s", 0)
+    consumer = FakeConsumer({tp: [Record(7, 0), Record(8, 0)]})
+    scheduler = RetryScheduler(FakeKafka(fail=True))
+    scheduler.consumer = consumer
+
+    with pytest.raises(ConnectionError):
+        await scheduler.run_once()
+    assert consumer.commits == []
+    assert consumer.seeks == [(tp, 7)]
+
+
+@pytest.mark.asyncio
+async def test_loop_keeps_running_after_a_failed_batch():
+    scheduler = RetryScheduler(FakeKafka())
+    calls = []
+    recovered = asyncio.Event()
+
+    async def run_once():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("broker unreachable")
+        recovered.set()
+        await asyncio.sleep(0.01)  # getmany waits up to its timeout
+    scheduler.run_once = run_once
+
+    task = asyncio.create_task(scheduler._run_loop())
+    await asyncio.wait_for(recovered.wait(), timeout=5)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,63 @@
+import json
+import os
+from services.worker.app.routing import RoutingTable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_longest_prefix_wins_and_hint_overrides():
+    table = RoutingTable()
+    table.apply({
+        "channels": {"whatsapp": ["http://wa"], "wa_biz": ["http://wab"], "default": ["http://mock"]},
+        "prefixes": {"wa_": "whatsapp", "wa_b_": "wa_biz"},
+    })
+    assert table.channel_for(None, "wa_123") == "whatsapp"
+    assert table.channel_for(None, "wa_b_123") == "wa_biz"
+    assert table.channel_for(None, "xx_1") == "default"
+    assert table.channel_for("whatsapp", "xx_1") == "whatsapp"
+
+
+def test_least_outstanding_and_ejection():
+    clock = FakeClock()
+    table = RoutingTable(eject_failures=2, eject_seconds=10, clock=clock)
+    table.apply({"channels": {"default": ["http://a", "http://b"]}})
+    table.started("http://a")
+    assert table.pick("default") == "http://b"
+
+    table.started("http://b")
+    table.started("http://b")
+    table.finished("http://b", False)
+    table.finished("http://b", False)
+    table.finished("http://a", True)
+    assert table.pick("default") == "http://a"
+    table.started("http://a")
+    assert table.pick("default") == "http://a"  # b is ejected despite being idle
+
+    clock.now = 10
+    assert table.pick("default") == "http://b"
+
+
+def test_hot_reload_on_mtime_change(tmp_path):
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps({"channels": {"default": ["http://a"]}}))
+    clock = FakeClock()
+    table = RoutingTable(path=str(path), reload_interval=1, clock=clock)
+    assert table.pick("default") == "http://a"
+
+    path.write_text(json.dumps({"channels": {"default": ["http://b"]}, "prefixes": {"tg_": "default"}}))
+    os.utime(path, (1, 1))
+    clock.now = 1
+    table.maybe_reload()
+    assert table.pick("default") == "http://b"
+
+    path.write_text("{not json")
+    os.utime(path, (2, 2))
+    clock.now = 2
+    table.maybe_reload()
+    assert table.pick("default") == "http://b"
@@ -0,0 +1,62 @@
+import pytest
+from services.worker.app import state_writer as state_writer_module
+from services.worker.app.state_writer import StateWriter
+
+
+class FakeCollection:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.writes = []
+
+    async def bulk_write(self, ops, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("mongo unavailable")
+        self.writes.append({op._filter["message_id"]: op._doc for op in ops})
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    coll = FakeCollection()
+    monkeypatch.setattr(state_writer_module.db, "messages_collection", coll, raising=False)
+    return coll
+
+
+@pytest.mark.asyncio
+async def test_updates_for_one_message_coalesce_into_one_write(collection):
+    writer = StateWriter(max_batch=100, flush_interval=10)
+    first = writer.update("m1", {"state": "PROCESSING"})
+    second = writer.update("m1", {"state": "DELIVERED"}, add_to_set={"delivered_to": ["u1"]})
+    await writer.flush()
+
+    assert first.done() and second.done()
+    assert collection.writes == [{"m1": {"$set": {"state": "DELIVERED"}, "$addToSet": {"delivered_to": {"$each": ["u1"]}}}}]
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_is_rebuffered_under_newer_updates(collection):
+    collection.failures = 1
+    writer = StateWriter(max_batch=100, flush_interval=10)
+    first = writer.update("m1", {"state": "PROCESSING"}, add_to_set={"delivered_to": ["u1"]})
+    await writer.flush()
+    assert not first.done()
+
+    second = writer.update("m1", {"state": "DELIVERED"}, add_to_set={"delivered_to": ["u2"]})
+    await writer.flush()
+    assert first.done() and second.done() and first.exception() is None
+    assert collection.writes == [{"m1": {"$set": {"state": "DELIVERED"}, "$addToSet": {"delivered_to": {"$each": ["u1", "u2"]}}}}]
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_update_fails_after_max_attempts(collection):
+    collection.failures = 2
+    writer = StateWriter(max_batch=100, flush_interval=10, max_attempts=2)
+    fut = writer.update("m1", {"state": "DELIVERED"})
+    await writer.flush()
+    await writer.flush()
+
+    assert isinstance(fut.exception(), ConnectionError)
+    assert collection.writes == []
+    await writer.stop()
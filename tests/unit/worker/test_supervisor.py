@@ -0,0 +1,106 @@
+import os
+import signal
+import types
+import pytest
+from prometheus_client import multiprocess
+from services.worker.app import supervisor as supervisor_module
+from services.worker.app.supervisor import Supervisor
+from services.worker.app.engine import ENGINE_PENDING, ENGINE_RUNNING, ENGINE_PAUSED_PARTITIONS
+from services.worker.app.lag import CONSUMER_LAG
+from services.worker.app.resilience import BREAKER_STATE
+
+
+class FakeProc:
+    def __init__(self, pid, returncode=None):
+        self.pid = pid
+        self.returncode = returncode
+        self.signals = []
+
+    def poll(self):
+        return self.returncode
+
+    def send_signal(self, signum):
+        self.signals.append(signum)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(supervisor_module, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def dead(monkeypatch):
+    pids = []
+    monkeypatch.setattr(multiprocess, "mark_process_dead", pids.append)
+    return pids
+
+
+@pytest.fixture
+def supervisor(monkeypatch, tmp_path):
+    monkeypatch.setenv("WORKER_PROCESSES", "2")
+    monkeypatch.setenv("WORKER_RESTART_MAX_BACKOFF", "8")
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path / "metrics"))
+    return Supervisor()
+
+
+def test_crash_loop_backs_off_exponentially_up_to_the_cap(supervisor, clock, dead):
+    child = supervisor.children[0]
+    delays = []
+    for pid in range(5):
+        child.proc = FakeProc(pid, returncode=1)
+        child.started_at = clock.now
+        clock.now += 1
+        supervisor._reap(child)
+        delays.append(child.restart_at - clock.now)
+    assert delays == [1, 2, 4, 8, 8]
+    assert child.proc is None
+    # the dead child's gauge files stop counting towards live* aggregates
+    assert dead == [0, 1, 2, 3, 4]
+
+
+def test_long_running_child_gets_a_fresh_backoff(supervisor, clock, dead):
+    child = supervisor.children[0]
+    child.backoff = 8.0
+    child.started_at = clock.now
+    clock.now += 120
+    child.proc = FakeProc(42, returncode=1)
+    supervisor._reap(child)
+    assert child.restart_at == clock.now + 1
+    assert child.backoff == 2
+
+
+def test_no_restart_is_scheduled_while_stopping(supervisor, clock, dead):
+    child = supervisor.children[0]
+    child.proc = FakeProc(42, returncode=0)
+    supervisor.stopping = True
+    supervisor._reap(child)
+    assert child.proc is None and child.restart_at == 0.0
+    assert dead == [42]
+
+
+def test_stop_signals_only_live_children_once(supervisor):
+    live, exited = FakeProc(1), FakeProc(2, returncode=0)
+    supervisor.children[0].proc = live
+    supervisor.children[1].proc = exited
+    supervisor._stop(signal.SIGTERM, None)
+    supervisor._stop(signal.SIGTERM, None)
+    assert supervisor.stopping
+    assert live.signals == [signal.SIGTERM]
+    assert exited.signals == []
+
+
+def test_metrics_dir_is_wiped_on_start(supervisor):
+    os.makedirs(supervisor.metrics_dir)
+    stale = os.path.join(supervisor.metrics_dir, "gauge_livesum_123.db")
+    open(stale, "w").close()
+    supervisor._prepare_metrics_dir()
+    assert os.listdir(supervisor.metrics_dir) == []
+    assert os.environ["PROMETHEUS_MULTIPROC_DIR"] == supervisor.metrics_dir
+
+
+def test_gauges_aggregate_across_live_processes():
+    for gauge in (ENGINE_PENDING, ENGINE_RUNNING, ENGINE_PAUSED_PARTITIONS, CONSUMER_LAG):
+        assert gauge._multiprocess_mode == "livesum"
+    assert BREAKER_STATE._multiprocess_mode == "livemax"